@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Synthetic hafh_stories.json generator for benchmarks
+
+Produces stories shaped like the real export (pid, tsid, name, prefecture,
+country, ts_stay_text, ts_text, likes_count) with mixed Japanese/English
+text, Zipfian likes and stories-per-property, and a prefecture skew
+towards the big travel destinations.
+
+Run: python3 benchmarks/generate_dataset.py 100000 -o benchmarks/data/stories_100000.json
+"""
+
+import argparse
+import bisect
+import itertools
+import json
+import os
+import random
+
+# (prefecture, relative weight, towns) - weights roughly follow travel volume
+PREFECTURES = [
+    ('Tokyo', 120, ['Shinjuku', 'Asakusa', 'Shibuya', 'Ueno', 'Shimokitazawa']),
+    ('Kyoto', 90, ['Gion', 'Arashiyama', 'Fushimi', 'Amanohashidate']),
+    ('Osaka', 70, ['Namba', 'Umeda', 'Tennoji']),
+    ('Hokkaido', 60, ['Sapporo', 'Otaru', 'Niseko', 'Hakodate', 'Furano']),
+    ('Okinawa', 50, ['Naha', 'Ishigaki', 'Miyako', 'Onna']),
+    ('Kanagawa', 45, ['Hakone', 'Kamakura', 'Yokohama', 'Enoshima']),
+    ('Nagano', 40, ['Karuizawa', 'Hakuba', 'Matsumoto', 'Nozawa Onsen']),
+    ('Shizuoka', 30, ['Atami', 'Izu', 'Shimoda']),
+    ('Fukuoka', 30, ['Hakata', 'Itoshima', 'Dazaifu']),
+    ('Nara', 20, ['Nara', 'Yoshino', 'Totsukawa']),
+    ('Hiroshima', 20, ['Onomichi', 'Miyajima']),
+    ('Ishikawa', 18, ['Kanazawa', 'Wajima', 'Kaga']),
+    ('Oita', 15, ['Beppu', 'Yufuin']),
+    ('Gunma', 14, ['Kusatsu', 'Minakami']),
+    ('Tochigi', 12, ['Nikko', 'Nasu']),
+    ('Hyogo', 12, ['Kobe', 'Kinosaki', 'Himeji']),
+    ('Mie', 10, ['Ise', 'Toba']),
+    ('Kagoshima', 10, ['Yakushima', 'Ibusuki']),
+    ('Wakayama', 9, ['Koyasan', 'Shirahama', 'Kumano']),
+    ('Chiba', 9, ['Tateyama', 'Kamogawa']),
+]
+for _name in ['Aomori', 'Iwate', 'Miyagi', 'Akita', 'Yamagata', 'Fukushima', 'Ibaraki',
+              'Saitama', 'Niigata', 'Toyama', 'Fukui', 'Yamanashi', 'Gifu', 'Aichi',
+              'Shiga', 'Tottori', 'Shimane', 'Okayama', 'Yamaguchi', 'Tokushima',
+              'Kagawa', 'Ehime', 'Kochi', 'Saga', 'Nagasaki', 'Kumamoto', 'Miyazaki']:
+    PREFECTURES.append((_name, 4, [_name]))
+
+# Non-Japan stays (about 10% of stories), region stored in the prefecture field
+OVERSEAS = [
+    ('TW', 'Taipei'), ('TW', 'Hualien'), ('KR', 'Seoul'), ('KR', 'Busan'),
+    ('TH', 'Bangkok'), ('TH', 'Chiang Mai'), ('VN', 'Da Nang'), ('PH', 'Cebu'),
+    ('ID', 'Bali'), ('MY', 'Penang'), ('US', 'Hawaii'), ('FR', 'Paris'),
+]
+
+PROPERTY_KINDS_EN = ['Guesthouse', 'Hostel', 'Ryokan', 'Hotel', 'Inn', 'Lodge', 'House', 'Cabin']
+PROPERTY_KINDS_JA = ['ゲストハウス', '旅館', 'ホテル', '民宿', 'ホステル', 'の宿']
+NAME_WORDS = ['Sakura', 'Yuzu', 'Kaze', 'Hoshi', 'Mori', 'Umi', 'Tsuki', 'Hikari', 'Komorebi',
+              'Kumo', 'Sora', 'Tanuki', 'Neko', 'Momiji', 'Wabi', 'Hinata', 'Asahi', 'Tabi']
+
+THEMES = [
+    ('onsen', '温泉'), ('hot spring', '露天風呂'), ('ryokan', '旅館'), ('mountain', '山'),
+    ('beach', '海'), ('workation', 'ワーケーション'), ('sauna', 'サウナ'), ('temple', 'お寺'),
+    ('local food', '地元のご飯'), ('dog friendly', 'ペット可'), ('snow', '雪'), ('cafe', 'カフェ'),
+]
+
+EN_SENTENCES = [
+    "The host was incredibly kind and gave us tips for the {theme} nearby.",
+    "We stayed three nights in {town} and loved the quiet {theme}.",
+    "Perfect base for exploring {town}; the {theme} was the highlight.",
+    "The room was clean and cozy, with a view of the {theme}.",
+    "I worked remotely here for a week and the wifi was fast.",
+    "Breakfast used local ingredients and the staff spoke some English.",
+    "A short walk from the station, easy to find even at night.",
+    "Would definitely come back in autumn for the {theme}.",
+]
+JA_SENTENCES = [
+    "{town}の{theme}がとても良かったです。",
+    "オーナーさんがとても親切で、{theme}のおすすめを教えてくれました。",
+    "駅から近くて便利でした。",
+    "部屋は清潔で、静かに過ごせました。",
+    "朝ごはんが美味しくて、また泊まりたいと思いました。",
+    "{town}での滞在は最高の思い出になりました！",
+    "ワーケーションにぴったりの環境でした。",
+    "{theme}からの景色が素晴らしかったです。",
+]
+
+
+def zipf_cumulative_weights(n, exponent):
+    """Cumulative Zipf weights for ranks 1..n (for bisect sampling)"""
+    return list(itertools.accumulate(1.0 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+def weighted_index(rng, cumulative):
+    """Draw an index from cumulative weights"""
+    return bisect.bisect_left(cumulative, rng.random() * cumulative[-1])
+
+
+def build_properties(rng, count):
+    """Property table: (pid, name, country, prefecture, town, popularity rank)"""
+    prefecture_cumulative = list(itertools.accumulate(w for _, w, _ in PREFECTURES))
+    properties = []
+    for pid in range(count):
+        if rng.random() < 0.1:
+            country, prefecture = rng.choice(OVERSEAS)
+            town = prefecture
+        else:
+            country = 'JP'
+            prefecture, _, towns = PREFECTURES[weighted_index(rng, prefecture_cumulative)]
+            town = rng.choice(towns)
+        if rng.random() < 0.35:
+            name = f"{town}{rng.choice(PROPERTY_KINDS_JA)} {rng.choice(NAME_WORDS)}"
+        else:
+            name = f"{rng.choice(PROPERTY_KINDS_EN)} {rng.choice(NAME_WORDS)} {town}"
+        properties.append((100000 + pid, name, country, prefecture, town))
+    return properties
+
+
+def build_text(rng, town, sentences=4):
+    """Story text mixing English and Japanese sentences"""
+    parts = []
+    for _ in range(sentences):
+        theme_en, theme_ja = rng.choice(THEMES)
+        if rng.random() < 0.5:
+            parts.append(rng.choice(JA_SENTENCES).format(town=town, theme=theme_ja))
+        else:
+            parts.append(rng.choice(EN_SENTENCES).format(town=town, theme=theme_en))
+    return ' '.join(parts)
+
+
+def generate(count, path, seed=42, stories_per_property=6.3):
+    """Write `count` synthetic stories to `path` as one JSON array (streamed)"""
+    rng = random.Random(seed)
+    property_count = max(1, int(count / stories_per_property))
+    properties = build_properties(rng, property_count)
+    # Properties are shuffled, so Zipf rank is independent of prefecture
+    popularity_cumulative = zipf_cumulative_weights(property_count, 1.07)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[\n')
+        for tsid in range(count):
+            rank = weighted_index(rng, popularity_cumulative)
+            pid, name, country, prefecture, town = properties[rank]
+            # Likes follow the property's Zipf rank with per-story noise
+            likes = int(800 / ((rank + 1) ** 0.8) * rng.uniform(0.3, 1.5)) + rng.randint(0, 3)
+            story = {
+                'tsid': 500000 + tsid,
+                'pid': pid,
+                'name': name,
+                'prefecture': prefecture,
+                'country': country,
+                'ts_stay_text': build_text(rng, town, rng.randint(2, 6)),
+                'ts_text': build_text(rng, town, 2),
+                'likes_count': likes,
+            }
+            if tsid:
+                f.write(',\n')
+            f.write(json.dumps(story, ensure_ascii=False))
+        f.write('\n]\n')
+    return property_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic hafh_stories.json')
+    parser.add_argument('count', type=int, help='number of stories to generate')
+    parser.add_argument('-o', '--output', help='output path (default benchmarks/data/stories_<count>.json)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                         'data', f'stories_{args.count}.json')
+    property_count = generate(args.count, output, seed=args.seed)
+    print(f"✅ Wrote {args.count} stories ({property_count} properties) to {output}")
+
+
+if __name__ == '__main__':
+    main()
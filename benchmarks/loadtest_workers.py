@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Gunicorn worker-model load test
+
+Starts gunicorn with each worker class / worker count / thread count in
+the matrix, replays the same webhook traffic mix against it for a fixed
+duration, and prints a comparison table (throughput, p50/p95/p99, errors).
+Worker classes whose library isn't installed (e.g. gevent) are skipped.
+
+Run: python3 benchmarks/loadtest_workers.py --data benchmarks/data/stories_10000.json
+"""
+
+import argparse
+import http.client
+import importlib.util
+import itertools
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from run_benchmarks import build_requests, percentile  # noqa: E402
+
+# Voice-agent traffic is dominated by recommend; the rest follows roughly
+# what a conversation does around it
+TRAFFIC_MIX = [
+    ('/recommend', 45), ('/recommend (personalized)', 15), ('/search', 10),
+    ('/inspiration', 8), ('/experiences', 5), ('/gallery', 5),
+    ('/save-progress', 4), ('/resume-conversation', 4), ('/update-progress', 3),
+    ('/health', 1),
+]
+
+# Worker classes and the module each one needs
+WORKER_CLASSES = {'sync': None, 'gthread': None, 'gevent': 'gevent', 'eventlet': 'eventlet'}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(port, timeout):
+    """Poll /health/ready until the server has warmed up or the timeout passes"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/health/ready')
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def build_mix(rng, total):
+    """Shuffled request list drawn from TRAFFIC_MIX"""
+    requests = []
+    weight_total = sum(w for _, w in TRAFFIC_MIX)
+    for endpoint, weight in TRAFFIC_MIX:
+        requests.extend(build_requests(rng, endpoint, max(1, total * weight // weight_total)))
+    rng.shuffle(requests)
+    return requests
+
+
+def drive(port, requests, concurrency, duration):
+    """Replay requests over keep-alive connections for `duration` seconds"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        i = offset
+        while time.perf_counter() < deadline:
+            method, path, body = requests[i % len(requests)]
+            i += concurrency
+            payload = json.dumps(body) if body is not None else None
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                failed = not 200 <= response.status < 300
+            except (OSError, http.client.HTTPException):
+                failed = True
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if failed:
+                    errors[0] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': errors[0],
+        'throughput': len(ordered) / wall if wall else 0.0,
+        'p50_ms': percentile(ordered, 50) * 1000,
+        'p95_ms': percentile(ordered, 95) * 1000,
+        'p99_ms': percentile(ordered, 99) * 1000,
+    }
+
+
+def run_config(worker_class, workers, threads, args, requests):
+    """Start gunicorn with one configuration, load it, stop it"""
+    port = free_port()
+    cmd = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'),
+           '-k', worker_class, '-w', str(workers), '--threads', str(threads),
+           '-b', f'127.0.0.1:{port}', 'webhook_server:app']
+    env = dict(os.environ, DATA_PATH=os.path.abspath(args.data))
+    # A few synthetic callers send every request; don't rate-limit them
+    env.setdefault('CALLER_RATE_LIMIT', '0')
+    proc = subprocess.Popen(cmd, cwd=REPO_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_until_ready(port, args.startup_timeout):
+            return None
+        drive(port, requests, args.concurrency, args.warmup)
+        return drive(port, requests, args.concurrency, args.duration)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare gunicorn worker models under webhook traffic')
+    parser.add_argument('--data', default=os.path.join(REPO_DIR, 'data', 'hafh_stories.json'),
+                        help='stories file the server loads (see generate_dataset.py)')
+    parser.add_argument('--worker-classes', nargs='+', default=['sync', 'gthread', 'gevent'])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8],
+                        help='threads per worker (only varied for gthread)')
+    parser.add_argument('--concurrency', type=int, default=16, help='client connections')
+    parser.add_argument('--duration', type=float, default=15.0, help='seconds of measured load per config')
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds of unmeasured load per config')
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--seed', type=int, default=11)
+    parser.add_argument('--json', help='also write raw results to this file')
+    args = parser.parse_args()
+
+    requests = build_mix(random.Random(args.seed), 2000)
+    rows = []
+    for worker_class in args.worker_classes:
+        module = WORKER_CLASSES.get(worker_class)
+        if module and importlib.util.find_spec(module) is None:
+            print(f"⏭️  Skipping {worker_class}: {module} not installed")
+            continue
+        thread_counts = args.threads if worker_class == 'gthread' else [1]
+        for workers, threads in itertools.product(args.workers, thread_counts):
+            print(f"🏃 {worker_class} workers={workers} threads={threads}...")
+            result = run_config(worker_class, workers, threads, args, requests)
+            if result is None:
+                print("   ❌ server did not become ready")
+                continue
+            rows.append(dict(result, worker_class=worker_class, workers=workers, threads=threads))
+
+    rows.sort(key=lambda r: r['throughput'], reverse=True)
+    header = f"{'class':<9} {'workers':>7} {'threads':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"
+    print('\n' + header)
+    print('-' * len(header))
+    for r in rows:
+        print(f"{r['worker_class']:<9} {r['workers']:>7} {r['threads']:>7} {r['throughput']:>9.1f} "
+              f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['errors']:>7}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Endpoint benchmark harness
+
+For each dataset scale this generates (or reuses) a synthetic stories file,
+starts a fresh Python process with DATA_PATH pointing at it, and drives
+every endpoint twice: in-process through the Flask test client (handler
+cost only) and over a real threaded HTTP server (adds WSGI, sockets and
+concurrency). Reports throughput, p50/p95/p99 latency and non-2xx responses (errors) per
+endpoint; a 429 or a shed 503 is fast, so its latency says nothing about
+the endpoint.
+
+Run: python3 benchmarks/run_benchmarks.py --scales 10000 100000 1000000
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+QUERIES = ['onsen', 'ryokan', 'mountain', 'beach', 'workation', 'sauna', '温泉', '旅館',
+           'quiet', 'local food', 'Hakoneh', 'dog friendly']
+DESTINATIONS = ['Kyoto', 'Tokyo', 'Nagano', 'Hokkaido', 'Okinawa', 'Nara', 'Kanagawa', 'Beppu', '']
+
+
+# Bearer token the child server and the /deltas requests share
+BENCH_DELTA_TOKEN = 'bench-token'
+
+# Synthetic callers; /save-progress cycles through all of them so the
+# endpoints that need saved state (resume, update) never hit a 404
+BENCH_USERS = 20
+
+
+def build_requests(rng, endpoint, n):
+    """n (method, path, body) tuples for one endpoint"""
+    requests = []
+    for i in range(n):
+        user = i % BENCH_USERS if endpoint == '/save-progress' else rng.randrange(BENCH_USERS)
+        email = f"bench{user}@example.com"
+        body = None
+        if endpoint in ('/search', '/recommend'):
+            body = {'query': rng.choice(QUERIES), 'destination': rng.choice(DESTINATIONS)}
+        elif endpoint == '/recommend (personalized)':
+            body = {'query': rng.choice(QUERIES), 'email': email}
+        elif endpoint == '/inspiration':
+            body = {'destination': rng.choice(DESTINATIONS), 'limit': 5}
+        elif endpoint in ('/experiences', '/gallery'):
+            body = {'theme': rng.choice(QUERIES)}
+        elif endpoint == '/save-progress':
+            body = {'email': email, 'preferences': {'destination': rng.choice(DESTINATIONS),
+                                                    'style': rng.choice(QUERIES), 'budget': 'mid'},
+                    'viewed_properties': []}
+        elif endpoint == '/update-progress':
+            body = {'email': email, 'add_viewed_property': str(100000 + rng.randint(0, 1000))}
+        elif endpoint == '/facets':
+            body = {'query': rng.choice(QUERIES)}
+        elif endpoint == '/deltas':
+            # Likes changes to stories every scale has (tsids start at 500000)
+            body = {'deltas': [{'op': 'likes', 'tsid': str(500000 + rng.randint(0, 1000)),
+                                'likes_count': rng.randint(0, 500)} for _ in range(10)]}
+        elif endpoint == '/similar':
+            body = {'pid': str(100000 + rng.randint(0, 100)), 'limit': 5}
+        elif endpoint in ('/resume-conversation', '/get-user-history'):
+            body = {'email': email}
+        path = endpoint.split(' ')[0]
+        requests.append(('POST' if body is not None else 'GET', path, body))
+    return requests
+
+
+# Endpoint order matters: save-progress seeds the state the later calls read
+ENDPOINTS = ['/health', '/', '/details', '/save-progress', '/search', '/recommend',
+             '/recommend (personalized)', '/experiences', '/gallery', '/inspiration', '/similar', '/facets',
+             '/resume-conversation', '/update-progress', '/get-user-history', '/deltas', '/metrics']
+
+
+def request_headers(path):
+    """Extra headers for a request (the bearer token /deltas needs)"""
+    return {'Authorization': f'Bearer {BENCH_DELTA_TOKEN}'} if path == '/deltas' else {}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, wall_seconds, errors=0):
+    """Throughput, latency percentiles (ms) and error count for one endpoint run"""
+    ordered = sorted(latencies)
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'throughput': len(ordered) / wall_seconds if wall_seconds else 0.0,
+        'p50_ms': percentile(ordered, 50) * 1000,
+        'p95_ms': percentile(ordered, 95) * 1000,
+        'p99_ms': percentile(ordered, 99) * 1000,
+    }
+
+
+def run_test_client(app, requests_by_endpoint, warmup):
+    """Sequential in-process run through the Flask test client"""
+    client = app.test_client()
+    results = {}
+    for endpoint, reqs in requests_by_endpoint.items():
+        for method, path, body in reqs[:warmup]:
+            client.open(path, method=method, json=body, headers=request_headers(path))
+        latencies = []
+        errors = 0
+        wall_start = time.perf_counter()
+        for method, path, body in reqs:
+            start = time.perf_counter()
+            response = client.open(path, method=method, json=body, headers=request_headers(path))
+            latencies.append(time.perf_counter() - start)
+            if not 200 <= response.status_code < 300:
+                errors += 1
+        results[endpoint] = summarize(latencies, time.perf_counter() - wall_start, errors)
+    return results
+
+
+def run_http(app, requests_by_endpoint, concurrency):
+    """Concurrent run against a real threaded HTTP server on localhost"""
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = {}
+    try:
+        for endpoint, reqs in requests_by_endpoint.items():
+            latencies = []
+            errors = [0]
+            lock = threading.Lock()
+            pending = list(reqs)
+
+            def worker():
+                while True:
+                    with lock:
+                        if not pending:
+                            return
+                        method, path, body = pending.pop()
+                    payload = json.dumps(body) if body is not None else None
+                    headers = request_headers(path)
+                    if body is not None:
+                        headers['Content-Type'] = 'application/json'
+                    start = time.perf_counter()
+                    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                    try:
+                        conn.request(method, path, body=payload, headers=headers)
+                        response = conn.getresponse()
+                        response.read()
+                        failed = not 200 <= response.status < 300
+                    except (OSError, http.client.HTTPException):
+                        failed = True
+                    conn.close()
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        latencies.append(elapsed)
+                        if failed:
+                            errors[0] += 1
+
+            threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+            wall_start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            results[endpoint] = summarize(latencies, time.perf_counter() - wall_start, errors[0])
+    finally:
+        server.shutdown()
+    return results
+
+
+def run_worker(args):
+    """Child process: load one dataset, benchmark it, write JSON results"""
+    sys.path.insert(0, REPO_DIR)
+    load_start = time.perf_counter()
+    import webhook_server
+    webhook_server.wait_until_ready()
+    load_seconds = time.perf_counter() - load_start
+
+    rng = random.Random(args.seed)
+    requests_by_endpoint = {e: build_requests(rng, e, args.requests) for e in ENDPOINTS}
+    results = {
+        'scale': args.scale,
+        'properties_loaded': len(webhook_server.PROPERTIES),
+        'load_seconds': load_seconds,
+        'test_client': run_test_client(webhook_server.app, requests_by_endpoint, args.warmup),
+        'http': run_http(webhook_server.app, requests_by_endpoint, args.concurrency),
+    }
+    with open(args.result_file, 'w') as f:
+        json.dump(results, f)
+
+
+def dataset_path(scale):
+    path = os.path.join(BENCH_DIR, 'data', f'stories_{scale}.json')
+    if not os.path.exists(path):
+        sys.path.insert(0, BENCH_DIR)
+        from generate_dataset import generate
+        print(f"⏳ Generating {scale} stories -> {path}")
+        generate(scale, path)
+    return path
+
+
+def print_report(all_results):
+    header = (f"{'scale':>9}  {'mode':<11} {'endpoint':<27} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'p99 ms':>9} {'errors':>7}")
+    print('\n' + header)
+    print('-' * len(header))
+    for results in all_results:
+        print(f"{results['scale']:>9}  loaded {results['properties_loaded']} properties "
+              f"in {results['load_seconds']:.2f}s")
+        for mode in ('test_client', 'http'):
+            for endpoint, r in results[mode].items():
+                print(f"{results['scale']:>9}  {mode:<11} {endpoint:<27} {r['throughput']:>9.1f} "
+                      f"{r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every webhook endpoint at several dataset scales')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=10, help='untimed test-client requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8, help='HTTP client threads')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--json', help='also write raw results to this file')
+    # Internal: run as the per-scale child process
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--scale', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return 0
+
+    all_results = []
+    for scale in args.scales:
+        path = dataset_path(scale)
+        with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as tmp:
+            result_file = tmp.name
+        env = dict(os.environ, DATA_PATH=path, DELTA_TOKEN=BENCH_DELTA_TOKEN)
+        # A few synthetic callers send every request; don't rate-limit them
+        env.setdefault('CALLER_RATE_LIMIT', '0')
+        cmd = [sys.executable, os.path.abspath(__file__), '--worker', '--scale', str(scale),
+               '--result-file', result_file, '--requests', str(args.requests),
+               '--warmup', str(args.warmup), '--concurrency', str(args.concurrency),
+               '--seed', str(args.seed)]
+        print(f"🏃 Benchmarking {scale} stories...")
+        # Server logs go to stdout; keep them out of the report
+        subprocess.run(cmd, env=env, cwd=REPO_DIR, stdout=subprocess.DEVNULL, check=True)
+        with open(result_file) as f:
+            all_results.append(json.load(f))
+        os.unlink(result_file)
+
+    print_report(all_results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(all_results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
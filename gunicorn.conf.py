@@ -0,0 +1,96 @@
+"""
+Gunicorn configuration for the KABUK webhook server
+
+Chosen with benchmarks/loadtest_workers.py: handlers are short and
+CPU-bound, so sync and gthread reach similar throughput per core, but sync
+workers close the connection after every response while gthread honours
+keep-alive and keeps a slow /recommend from stalling queued callers.
+gevent buys nothing without I/O to overlap. Every value can be overridden
+with the environment variable next to it.
+
+Run: gunicorn -c gunicorn.conf.py webhook_server:app
+"""
+
+import glob
+import json
+import os
+
+# Render injects PORT
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# Conversation state lives in each worker's memory until it moves to a shared
+# store, so keep one worker by default and scale with threads
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+# The app sizes its per-route concurrency limits from the same variable
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+# Each worker imports the app itself and loads data in a background thread,
+# so it accepts connections (and answers /health/live) right away. Preloading
+# in the master would fork workers before that thread finished.
+preload_app = False
+
+# ElevenLabs holds connections open between tool calls; keep them alive
+# longer than the platform load balancer's idle timeout
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '75'))
+
+# Voice tool calls give up well before this; anything slower is stuck
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = 30
+
+# Recycle workers to bound memory growth; jitter keeps them from restarting
+# together. Note a restart drops that worker's in-memory conversation state.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '1000'))
+
+accesslog = None  # the app writes its own structured request logs
+errorlog = '-'
+
+
+def on_starting(server):
+    """Clear per-worker metrics snapshots and the archive left over from a previous run"""
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, 'metrics_*.json*')):
+            os.remove(path)
+
+
+def _add_metrics(target, source):
+    """Add one worker's metrics snapshot into another (same layout as the app's)"""
+    for route, stats in source.get('routes', {}).items():
+        total = target['routes'].setdefault(route, {'count': 0, 'errors': 0, 'sum': 0.0,
+                                                    'buckets': [0] * len(stats['buckets'])})
+        total['count'] += stats['count']
+        total['errors'] += stats['errors']
+        total['sum'] += stats['sum']
+        total['buckets'] = [a + b for a, b in zip(total['buckets'], stats['buckets'])]
+    for key, n in source.get('counters', {}).items():
+        target['counters'][key] = target['counters'].get(key, 0) + n
+
+
+def child_exit(server, worker):
+    """
+    Fold a dead worker's metrics snapshot into metrics_archive.json and
+    remove it, so its totals outlive it and a new worker reusing the PID
+    can't overwrite them (counters never go backwards).
+    """
+    metrics_dir = os.environ.get('METRICS_DIR')
+    if not metrics_dir:
+        return
+    path = os.path.join(metrics_dir, f'metrics_{worker.pid}.json')
+    archive_path = os.path.join(metrics_dir, 'metrics_archive.json')
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return
+    try:
+        with open(archive_path) as f:
+            archive = json.load(f)
+    except (OSError, ValueError):
+        archive = {'routes': {}, 'counters': {}}
+    _add_metrics(archive, snapshot)
+    with open(archive_path + '.tmp', 'w') as f:
+        json.dump(archive, f)
+    os.replace(archive_path + '.tmp', archive_path)
+    os.remove(path)
@@ -0,0 +1,50 @@
+"""
+Shared fixtures: the app loaded once over a small synthetic dataset
+
+The server reads its configuration from the environment at import time, so
+the dataset is generated and the environment set here, before any test
+module imports webhook_server.
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+
+from generate_dataset import generate  # noqa: E402
+
+DATA_DIR = tempfile.mkdtemp(prefix='kabuk-tests-')
+atexit.register(shutil.rmtree, DATA_DIR, True)
+STORIES_PATH = os.path.join(DATA_DIR, 'stories.json')
+STORIES_COUNT = 3000
+generate(STORIES_COUNT, STORIES_PATH, seed=3)
+
+os.environ.update(
+    DATA_PATH=STORIES_PATH,
+    INDEX_PATH=os.path.join(DATA_DIR, 'stories.index'),
+    DELTA_TOKEN='test-token',
+    # Tests send many requests as one caller; admission tests turn limits back on
+    CALLER_RATE_LIMIT='0',
+    SHARD_MIN_PROPERTIES='100',
+)
+
+import webhook_server  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def ws():
+    """The webhook_server module, warmed up"""
+    assert webhook_server.wait_until_ready(), 'warm-up failed'
+    return webhook_server
+
+
+@pytest.fixture
+def client(ws):
+    return ws.app.test_client()
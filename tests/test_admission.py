@@ -0,0 +1,136 @@
+"""Admission control and load shedding (user-049)"""
+
+import time
+
+import pytest
+
+
+@pytest.fixture
+def admission(ws, monkeypatch):
+    """Isolated admission state: nothing in flight, not overloaded, stamps trusted"""
+    monkeypatch.setattr(ws, '_ADMISSION_INFLIGHT', {})
+    monkeypatch.setattr(ws, 'ADMISSION', {'overloaded': False, 'window_start': time.monotonic(), 'window_min': None})
+    monkeypatch.setattr(ws, 'TRUST_REQUEST_START', True)
+    return ws
+
+
+def admission_counts(ws):
+    counters = ws.snapshot_metrics()['counters']
+    return {tuple(key.split(':', 2)[1:]): n for key, n in counters.items() if key.startswith('admission:')}
+
+
+@pytest.fixture
+def counted(ws):
+    """Admission counters added during the test, as {(outcome, route): n}"""
+    before = admission_counts(ws)
+    return lambda: {key: n - before.get(key, 0) for key, n in admission_counts(ws).items() if n != before.get(key, 0)}
+
+
+def busy(ws, monkeypatch, **routes):
+    """Pretend requests are in flight, enough for the worker to count as busy"""
+    inflight = {'/recommend': ws.ADMISSION_BUSY_INFLIGHT}
+    inflight.update(routes)
+    monkeypatch.setattr(ws, '_ADMISSION_INFLIGHT', inflight)
+
+
+@pytest.mark.parametrize('path', ['/', '/details'])
+def test_idle_worker_serves_concurrent_pages(admission, counted, monkeypatch, client, path):
+    monkeypatch.setitem(admission._ADMISSION_INFLIGHT, path, 3)
+    response = client.get(path)
+    assert response.status_code == 200
+    assert counted() == {}
+
+
+def test_busy_worker_holds_routes_to_their_limit(admission, counted, monkeypatch, client):
+    busy(admission, monkeypatch, **{'/search': admission.PRIORITY_CONCURRENCY[1]})
+    data = client.post('/search', json={'query': 'onsen'}).get_json()
+    assert data['degraded']
+    assert counted() == {('degraded', '/search'): 1}
+    # Priority 0 is never held back by the other routes' limits
+    assert 'degraded' not in client.post('/recommend', json={'query': 'onsen'}).get_json()
+
+
+def test_shed_pages_get_the_cached_html(admission, counted, monkeypatch, client):
+    busy(admission, monkeypatch, **{'/': 1})
+    response = client.get('/')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/html'
+    assert response.get_data(as_text=True) == admission.CACHED_INDEX_HTML
+    assert counted() == {('degraded', '/'): 1}
+    text = admission.render_metrics(admission.snapshot_metrics())
+    assert 'kabuk_admission_total{outcome="degraded",route="/"}' in text
+
+
+def test_shed_pages_before_warm_up_get_a_busy_page(admission, monkeypatch, client):
+    monkeypatch.setattr(admission, 'CACHED_DETAILS_HTML', None)
+    busy(admission, monkeypatch, **{'/details': 1})
+    response = client.get('/details')
+    assert response.status_code == 503
+    assert response.mimetype == 'text/html'
+    assert response.headers['Retry-After'] == '1'
+    assert admission.BUSY_MESSAGE in response.get_data(as_text=True)
+
+
+def test_overload_sheds_all_but_priority_zero(admission, monkeypatch, client):
+    monkeypatch.setitem(admission.ADMISSION, 'overloaded', True)
+    monkeypatch.setattr(admission, 'ADMISSION_INTERVAL', 60)
+    assert client.post('/search', json={'query': 'onsen'}).get_json()['degraded']
+    response = client.post('/similar', json={'name': 'x'})
+    assert response.status_code == 503
+    assert response.get_json()['overloaded']
+    assert 'degraded' not in client.post('/recommend', json={'query': 'onsen'}).get_json()
+    assert client.get('/health').status_code == 200
+
+
+def test_queue_time_drives_overload(admission, monkeypatch, client):
+    monkeypatch.setattr(admission, 'ADMISSION_INTERVAL', 0)
+    stamp = f't={int((time.time() - 1) * 1000)}'
+    client.get('/details', headers={'X-Request-Start': stamp})
+    assert admission.ADMISSION['overloaded']
+    client.get('/details', headers={'X-Request-Start': f't={int(time.time() * 1000)}'})
+    assert not admission.ADMISSION['overloaded']
+
+
+@pytest.mark.parametrize('value', ['inf', '1e400', 'nan', 't=-inf', 't=1000', str(int((time.time() + 3600) * 1e6))])
+def test_unusable_stamps_are_ignored(admission, value):
+    with admission.app.test_request_context('/details', headers={'X-Request-Start': value}):
+        assert admission.request_queue_ms() is None
+
+
+def test_stamps_in_seconds_milli_and_microseconds(admission):
+    now = time.time() - 1
+    for value in (f'{now:.3f}', f't={int(now * 1e3)}', f't={int(now * 1e6)}'):
+        with admission.app.test_request_context('/details', headers={'X-Request-Start': value}):
+            assert 900 < admission.request_queue_ms() < 5000
+
+
+def test_stamps_are_ignored_unless_trusted(admission, monkeypatch, client):
+    monkeypatch.setattr(admission, 'TRUST_REQUEST_START', False)
+    monkeypatch.setattr(admission, 'ADMISSION_INTERVAL', 0)
+    client.get('/details', headers={'X-Request-Start': f't={int((time.time() - 60) * 1000)}'})
+    assert not admission.ADMISSION['overloaded']
+
+
+def test_overload_expires_without_stamped_requests(admission, monkeypatch, client):
+    monkeypatch.setattr(admission, 'ADMISSION_INTERVAL', 0.05)
+    client.get('/details', headers={'X-Request-Start': f't={int((time.time() - 60) * 1000)}'})
+    time.sleep(0.06)
+    client.get('/details')
+    assert admission.ADMISSION['overloaded']
+    # The next interval saw no stamps: one stale stamp doesn't keep the worker overloaded
+    time.sleep(0.06)
+    assert client.post('/search', json={'query': 'onsen'}).get_json().get('degraded') is None
+    assert not admission.ADMISSION['overloaded']
+
+
+def test_callers_are_rate_limited(admission, monkeypatch, client):
+    monkeypatch.setattr(admission, 'CALLER_RATE_LIMIT', 0.5)
+    monkeypatch.setattr(admission, 'CALLER_BURST', 2)
+    monkeypatch.setattr(admission, '_CALLER_BUCKETS', {})
+    headers = {'X-Caller-Id': 'caller-1'}
+    codes = [client.post('/search', json={}, headers=headers).status_code for _ in range(3)]
+    assert codes == [200, 200, 429]
+    response = client.post('/search', json={}, headers=headers)
+    assert int(response.headers['Retry-After']) >= 1
+    # Another caller has their own bucket
+    assert client.post('/search', json={}, headers={'X-Caller-Id': 'caller-2'}).status_code == 200
@@ -0,0 +1,102 @@
+"""Time-budgeted requests with partial, resumable results (user-050)"""
+
+import time
+
+import pytest
+from flask import g
+
+
+def all_pages(client, route, body, headers=None, limit=50):
+    """Every (partial, pids) page of a result list, following cursors"""
+    pages = []
+    data = client.post(route, json=body, headers=headers or {}).get_json()
+    while True:
+        found = data['properties'] if route == '/search' else data['recommendations']['properties']
+        pages.append((data.get('partial', False), [prop['pid'] for prop in found]))
+        if not data.get('next_cursor') or len(pages) >= limit:
+            return pages
+        data = client.post(route, json={'cursor': data['next_cursor']}, headers=headers or {}).get_json()
+
+
+def flatten(pages):
+    return [pid for _, pids in pages for pid in pids]
+
+
+@pytest.fixture
+def deadline_after(ws, monkeypatch):
+    """Make out_of_time() fire after n checks in each request"""
+    def install(n):
+        def out_of_time():
+            g.checks = g.get('checks', 0) + 1
+            if g.checks <= n:
+                return False
+            g.partial = True
+            return True
+        monkeypatch.setattr(ws, 'out_of_time', out_of_time)
+    return install
+
+
+def test_zero_budget_is_partial_and_resumable(client):
+    full = client.post('/search', json={'query': 'onsen'}).get_json()
+    cut = client.post('/search', json={'query': 'onsen'}, headers={'X-Time-Budget-Ms': '0'}).get_json()
+    assert cut['partial']
+    assert cut['next_cursor']
+    resumed = client.post('/search', json={'cursor': cut['next_cursor']}).get_json()
+    assert [p['pid'] for p in cut['properties'] + resumed['properties']][:len(full['properties'])] == \
+        [p['pid'] for p in full['properties']]
+
+
+def test_partial_search_pages_lose_and_repeat_nothing(client, deadline_after):
+    body = {'query': 'onsen'}
+    expected = flatten(all_pages(client, '/search', body))
+    deadline_after(3)
+    pages = all_pages(client, '/search', body, limit=200)
+    assert any(partial for partial, _ in pages)
+    assert flatten(pages) == expected
+
+
+def test_partial_recommend_pages_lose_and_repeat_nothing(client, deadline_after):
+    # Near duplicates are held back per page, so shorter pages can show more
+    body = {'query': 'onsen'}
+    expected = flatten(all_pages(client, '/recommend', body))
+    deadline_after(1)
+    pages = all_pages(client, '/recommend', body, limit=500)
+    assert all(partial for partial, _ in pages[:-1])
+    shown = flatten(pages)
+    assert len(shown) == len(set(shown))
+    assert set(expected) <= set(shown)
+
+
+def test_sharded_requests_resume_after_a_missed_deadline(ws, client):
+    body = {'query': 'onsen'}
+    expected = flatten(all_pages(client, '/search', body))
+    assert ws.start_shards(3)
+    try:
+        cut = client.post('/search', json=body, headers={'X-Time-Budget-Ms': '0'}).get_json()
+        assert cut['partial'] and cut['next_cursor']
+        # The shards' late replies are drained before they are asked again
+        rest = all_pages(client, '/search', {'cursor': cut['next_cursor']})
+        assert [p['pid'] for p in cut['properties']] + flatten(rest) == expected
+    finally:
+        ws.stop_shards()
+
+
+@pytest.mark.parametrize('value', ['soon', 'nan', 'inf', '1e400', '-5', '-inf'])
+def test_unusable_budgets(client, value):
+    data = client.post('/search', json={'query': 'onsen'}, headers={'X-Time-Budget-Ms': value}).get_json()
+    # A bad header falls back to the default budget, a huge one is capped; a negative one is no time at all
+    assert data.get('partial', False) == value.startswith('-')
+
+
+def test_queue_time_counts_only_from_a_trusted_stamp(ws, client, monkeypatch):
+    body = {'query': 'onsen'}
+    stamp = {'X-Time-Budget-Ms': '1000', 'X-Request-Start': f't={int((time.time() - 2) * 1000)}'}
+    assert not client.post('/search', json=body, headers=stamp).get_json().get('partial')
+    monkeypatch.setattr(ws, 'TRUST_REQUEST_START', True)
+    monkeypatch.setattr(ws, 'ADMISSION', {'overloaded': False, 'window_start': time.monotonic(), 'window_min': None})
+    monkeypatch.setattr(ws, 'ADMISSION_INTERVAL', 60)
+    assert client.post('/search', json=body, headers=stamp).get_json()['partial']
+    # A forged stamp from the future or far past is ignored
+    for value in ('t=1e400', f't={int((time.time() + 3600) * 1000)}', 't=1000'):
+        headers = dict(stamp, **{'X-Request-Start': value})
+        assert not client.post('/search', json=body, headers=headers).get_json().get('partial')
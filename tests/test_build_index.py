@@ -0,0 +1,67 @@
+"""build-index CLI and the streaming JSON reader it relies on (user-038)"""
+
+import json
+import subprocess
+import sys
+
+import pytest
+
+from conftest import REPO_DIR, STORIES_PATH
+
+
+def build_index(source, output):
+    return subprocess.run([sys.executable, '-m', 'webhook_server', 'build-index', str(source), '-o', str(output)],
+                          cwd=REPO_DIR, capture_output=True, text=True, timeout=300)
+
+
+def read_all(ws, path):
+    return [row for chunk in ws.read_json_array(str(path)) for row in chunk]
+
+
+@pytest.fixture
+def small_reads(ws, monkeypatch):
+    """Force objects to straddle read boundaries"""
+    monkeypatch.setattr(ws, 'INGEST_READ_BYTES', 7)
+
+
+def test_reader_streams_objects_across_reads(ws, tmp_path, small_reads):
+    rows = [{'tsid': n, 'text': 'x' * n} for n in range(20)]
+    path = tmp_path / 'ok.json'
+    path.write_text(json.dumps(rows, indent=1))
+    assert read_all(ws, path) == rows
+
+
+def test_reader_reports_the_file_offset_of_bad_json(ws, tmp_path, small_reads):
+    text = json.dumps([{'a': 1}] * 30)
+    broken = text[:200] + '@' + text[200:]
+    path = tmp_path / 'bad.json'
+    path.write_text(broken)
+    with pytest.raises(ws.IngestError, match=f'near character {broken.index("@")}'):
+        read_all(ws, path)
+
+
+def test_reader_rejects_a_truncated_array(ws, tmp_path, small_reads):
+    path = tmp_path / 'cut.json'
+    path.write_text('[{"a": 1}, {"a": 2},\n')
+    with pytest.raises(ws.IngestError, match='closing'):
+        read_all(ws, path)
+
+
+def test_build_index_writes_an_artifact(tmp_path):
+    output = tmp_path / 'stories.index'
+    result = build_index(STORIES_PATH, output)
+    assert result.returncode == 0, result.stderr
+    assert output.exists() and 'properties' in result.stdout
+
+
+@pytest.mark.parametrize('content', ['[{"tsid": 1, "name": "Inn", "likes_count": 3}, {"tsid": 2, "na',
+                                     '[{"tsid": 1, "name": "Inn"}, @@ ]',
+                                     '[]'])
+def test_build_index_fails_on_a_bad_export(tmp_path, content):
+    source = tmp_path / 'bad.json'
+    source.write_text(content)
+    output = tmp_path / 'bad.index'
+    result = build_index(source, output)
+    assert result.returncode != 0
+    assert not output.exists()
+    assert 'error' in result.stderr
@@ -0,0 +1,156 @@
+"""Live story deltas (user-048)"""
+
+import random
+
+import pytest
+
+
+AUTH = {'Authorization': 'Bearer test-token'}
+
+
+def post(client, rows, headers=AUTH):
+    return client.post('/deltas', json={'deltas': rows}, headers=headers)
+
+
+def live(ws):
+    return [i for i, prop in enumerate(ws.PROPERTIES) if prop['stories']]
+
+
+def check_invariants(ws, terms):
+    """The incrementally updated stores agree with what a full rebuild would produce"""
+    alive = live(ws)
+    for i in alive:
+        prop = ws.PROPERTIES[i]
+        assert prop['likes'] == sum(ws.STORIES[o]['likes'] for o in prop['stories'])
+        assert prop['stories'] == sorted(prop['stories'], key=ws._story_key)
+        flags = ws.tag_text(prop['search_name'])
+        for o in prop['stories']:
+            flags |= ws.STORY_THEME_FLAGS[o]
+        assert ws.THEME_FLAGS[i] == flags
+    assert list(ws.POPULAR_ORDER) == sorted(alive, key=ws._popularity_key)
+    assert list(ws.POPULAR_NEG_LIKES) == [-ws.PROPERTIES[i]['likes'] for i in ws.POPULAR_ORDER]
+    assert list(ws.bitmap_indices(ws.FACET_INDEX['all']['all'])) == alive
+    for theme in ws.THEME_BITS:
+        assert list(ws.THEME_POSTINGS[theme]) == [i for i in ws.POPULAR_ORDER
+                                                  if ws.THEME_FLAGS[i] & ws.THEME_BITS[theme]]
+    for term in terms:
+        expected = [i for i in alive if term in ws.property_terms(ws.PROPERTIES[i])]
+        assert list(ws.bitmap_indices(ws.term_bitmap(term))) == expected, term
+
+
+def random_batch(ws, rng, n=40):
+    tsids = sorted(ws.STORY_INDEX)
+    pids = sorted(ws.PID_INDEX)
+    rows = []
+    for k in range(n):
+        op = rng.choice(['likes', 'likes', 'upsert', 'remove', 'new'])
+        if op == 'likes':
+            rows.append({'op': 'likes', 'tsid': rng.choice(tsids), 'likes_count': rng.randint(0, 5000)})
+        elif op == 'remove':
+            rows.append({'op': 'remove', 'tsid': rng.choice(tsids)})
+        elif op == 'upsert':
+            rows.append({'op': 'upsert', 'tsid': rng.choice(tsids), 'pid': rng.choice(pids),
+                         'ts_stay_text': 'Zebrafinch sauna by the sea.', 'likes_count': rng.randint(0, 50)})
+        else:
+            rows.append({'op': 'upsert', 'tsid': f'new-{rng.random()}', 'pid': f'new-{k}', 'name': f'Quokka Lodge {k}',
+                         'prefecture': 'Hokkaido', 'ts_stay_text': 'Quokka snow cabin.', 'likes_count': 7})
+    return rows
+
+
+def test_requires_the_token(ws, client, monkeypatch):
+    assert post(client, [], headers={}).status_code == 401
+    assert post(client, [], headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    monkeypatch.setattr(ws, 'DELTA_TOKEN', '')
+    assert post(client, []).status_code == 404
+
+
+def test_refused_with_several_workers(ws, client, monkeypatch):
+    monkeypatch.setattr(ws, 'WEB_WORKERS', 2)
+    response = post(client, [])
+    assert response.status_code == 409
+    assert 'DELTA_PATH' in response.get_json()['error']
+
+
+@pytest.mark.parametrize('body', [{'deltas': 'likes'}, {'rows': []}, {'deltas': [{}] * 10001}])
+def test_bad_bodies_are_a_400(client, body):
+    assert client.post('/deltas', json=body, headers=AUTH).status_code == 400
+
+
+def test_bad_records_are_reported_and_the_rest_apply(ws, client):
+    tsid = sorted(ws.STORY_INDEX)[0]
+    likes = ws.STORIES[ws.STORY_INDEX[tsid]]['likes'] + 1
+    data = post(client, [
+        {'op': 'likes', 'tsid': tsid, 'likes_count': likes},
+        {'op': 'likes', 'tsid': 'no-such-story', 'likes_count': 1},
+        {'op': 'explode', 'tsid': tsid},
+        {'op': 'likes', 'likes_count': 1},
+        'not an object',
+    ]).get_json()
+    assert data['applied'] == 1
+    assert [e['index'] for e in data['errors']] == [1, 2, 3, 4]
+    assert ws.STORIES[ws.STORY_INDEX[tsid]]['likes'] == likes
+
+
+def test_likes_change_moves_the_property(ws, client):
+    i = ws.POPULAR_ORDER[-1]
+    o = ws.PROPERTIES[i]['stories'][0]
+    top = ws.PROPERTIES[ws.POPULAR_ORDER[0]]['likes']
+    post(client, [{'op': 'likes', 'tsid': ws.STORIES[o]['tsid'], 'likes_count': top + 10 ** 6}])
+    assert ws.POPULAR_ORDER[0] == i
+    check_invariants(ws, [])
+
+
+def test_new_and_removed_properties_are_searchable_then_gone(ws, client):
+    row = {'op': 'upsert', 'tsid': 'axolotl-1', 'pid': 'axolotl', 'name': 'Axolotl House',
+           'prefecture': 'Kyoto', 'ts_stay_text': 'An axolotl tank in the lobby.', 'likes_count': 4}
+    assert post(client, [row]).get_json()['applied'] == 1
+    found = client.post('/search', json={'query': 'axolotl'}).get_json()['properties']
+    assert [prop['pid'] for prop in found] == ['axolotl']
+    assert post(client, [{'op': 'remove', 'tsid': 'axolotl-1'}]).get_json()['applied'] == 1
+    found = client.post('/search', json={'query': 'axolotl'}).get_json()['properties']
+    assert 'axolotl' not in [prop['pid'] for prop in found]
+    check_invariants(ws, ['axolotl'])
+
+
+def test_random_batches_keep_the_stores_consistent(ws, client):
+    rng = random.Random(5)
+    for _ in range(3):
+        data = post(client, random_batch(ws, rng)).get_json()
+        assert data['success'] and not data['errors']
+    check_invariants(ws, ['zebrafinch', 'quokka', 'onsen', 'sauna', 'wifi', '温泉'])
+
+
+def test_shards_apply_deltas_in_place(ws, client):
+    assert ws.start_shards(3)
+    try:
+        pids = [process.pid for process in ws.SHARDS['processes']]
+        rng = random.Random(8)
+        for _ in range(2):
+            post(client, random_batch(ws, rng))
+        assert [process.pid for process in ws.SHARDS['processes']] == pids
+        for query, expr in [('quokka', None), ('zebrafinch', None), ('', {'prefecture': 'Hokkaido'}),
+                            ('onsen', {'likes': {'min': 100}})]:
+            expected = list(ws.selection_indices(ws.select_properties(query, '', expr)))
+            selected = ws.find_properties(query, '', expr)
+            assert isinstance(selected, ws.ShardedSelection)
+            assert list(ws.selection_indices(selected)) == expected, (query, expr)
+    finally:
+        ws.stop_shards()
+
+
+def test_readers_keep_a_consistent_snapshot(ws, client):
+    # Requests read without a lock: a batch swaps in new lists rather than editing the ones they hold
+    i = ws.POPULAR_ORDER[-1]
+    prop = ws.PROPERTIES[i]
+    held = [ws.POPULAR_ORDER, ws.POPULAR_NEG_LIKES, prop['stories'], ws.THEME_POSTINGS['onsen']]
+    before = [list(values) for values in held]
+    prefectures = ws.PREFECTURE_INDEX
+    o = prop['stories'][0]
+    post(client, [{'op': 'likes', 'tsid': ws.STORIES[o]['tsid'], 'likes_count': 10 ** 7},
+                  {'op': 'upsert', 'tsid': 'numbat-1', 'pid': 'numbat', 'name': 'Numbat Inn',
+                   'prefecture': 'Numbatshire', 'ts_stay_text': 'Numbat onsen.', 'likes_count': 1}])
+    assert [list(values) for values in held] == before
+    key = ws.prefecture_key('Numbatshire')
+    assert key not in prefectures and key in ws.PREFECTURE_INDEX
+    assert ws.POPULAR_ORDER[0] == i
+    check_invariants(ws, ['numbat'])
@@ -0,0 +1,37 @@
+"""MinHash/LSH near-duplicate detection (user-036)"""
+
+TEXT = ("The host was incredibly kind and gave us tips for the onsen nearby. "
+        "We stayed three nights in Hakone and loved the quiet mountain views.")
+
+
+def similarity(ws, a, b):
+    sa, sb = ws.minhash_signature(a), ws.minhash_signature(b)
+    return sum(x == y for x, y in zip(sa, sb)) / ws.MINHASH_BINS
+
+
+def test_signature_shape_and_determinism(ws):
+    signature = ws.minhash_signature(TEXT)
+    assert len(signature) == ws.MINHASH_BINS
+    assert signature == ws.minhash_signature('  '.join(TEXT.split(' ')))  # whitespace-insensitive
+    assert len(ws.band_keys(signature)) == ws.MINHASH_BANDS
+
+
+def test_near_copies_score_high_and_unrelated_text_low(ws):
+    assert similarity(ws, TEXT, TEXT + ' Great!') > 0.8
+    assert similarity(ws, TEXT, 'Breakfast used local ingredients and the staff spoke some English.') < 0.2
+
+
+def test_admit_diverse_skips_a_near_duplicate(ws, monkeypatch):
+    texts = [TEXT, TEXT + ' Great!', 'A short walk from the station, easy to find even at night.']
+    monkeypatch.setattr(ws, 'MINHASH_INDEX', ws.build_minhash_index([{'description': t} for t in texts]))
+    picked = ws.new_diversity_filter()
+    assert [ws.admit_diverse(picked, i) for i in range(3)] == [True, False, True]
+
+
+def test_recommend_pages_hold_no_near_duplicates(ws, client):
+    data = client.post('/recommend', json={'query': 'onsen'}).get_json()
+    index = {p['pid']: i for i, p in enumerate(ws.PROPERTIES)}
+    chosen = [index[p['pid']] for p in data['recommendations']['properties']]
+    for n, a in enumerate(chosen):
+        for b in chosen[n + 1:]:
+            assert ws.estimated_similarity(a, b) < ws.DIVERSITY_THRESHOLD or len(chosen) < ws.RECOMMEND_PAGE_SIZE
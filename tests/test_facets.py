@@ -0,0 +1,66 @@
+"""/facets over compressed bitmaps and the theme lexicon behind it (user-041)"""
+
+import pytest
+
+
+def tags(ws, text):
+    return set(ws.theme_names(ws.tag_text(ws.normalize_text(text))))
+
+
+# Text that mentions a theme word without being about the theme
+NOT_THEMED = [
+    ('ペットボトルの水をもらいました。', 'pet_friendly'),
+    ('山の手線で新宿まで行きました。', 'mountain'),
+    ('Breakfast was served at eight and dinner at seven.', 'food'),
+    ('朝ご飯を食べてから出発しました。', 'food'),
+    ('自然に会話が弾みました。', 'nature'),
+    ('富山からの電車で来ました。', 'mountain'),
+    ('熱海から電車で一時間。', 'beach'),
+    ('上海が好きです。', 'beach'),
+    ('The sauna-free spa was closed.', 'onsen'),
+]
+
+THEMED = [
+    ('ペット可の宿でした。', 'pet_friendly'),
+    ('愛犬と一緒に泊まれました。', 'pet_friendly'),
+    ('山頂からの眺めが最高でした。', 'mountain'),
+    ('郷土料理がとても美味しかった。', 'food'),
+    ('The local cuisine was the highlight.', 'food'),
+    ('大自然に囲まれた静かな宿。', 'nature'),
+    ('海の見える部屋でした。', 'beach'),
+    ('Great hot springs nearby.', 'onsen'),
+]
+
+
+@pytest.mark.parametrize('text,theme', NOT_THEMED)
+def test_theme_words_in_other_senses_do_not_tag(ws, text, theme):
+    assert theme not in tags(ws, text)
+
+
+@pytest.mark.parametrize('text,theme', THEMED)
+def test_theme_phrases_tag(ws, text, theme):
+    assert theme in tags(ws, text)
+
+
+def test_counts_match_a_scan(ws, client):
+    data = client.post('/facets', json={'query': 'onsen', 'limit': 50}).get_json()
+    matching = [i for i in ws.bitmap_indices(ws.FACET_INDEX['all']['all']) if ws.property_has_terms(i, 'onsen')]
+    assert data['total'] == len(matching)
+    for row in data['facets']['prefecture']:
+        expected = sum(1 for i in matching if ws.PROPERTIES[i]['prefecture'] == row['value'])
+        assert row['count'] == expected
+    for row in data['facets']['theme']:
+        bit = ws.THEME_BITS[row['value']]
+        assert row['count'] == sum(1 for i in matching if ws.THEME_FLAGS[i] & bit)
+
+
+def test_facet_filters_narrow_the_counts(client):
+    everything = client.post('/facets', json={}).get_json()
+    kyoto = client.post('/facets', json={'prefecture': 'Kyoto'}).get_json()
+    assert 0 < kyoto['total'] < everything['total']
+    assert [row['value'] for row in kyoto['facets']['prefecture']] == ['Kyoto']
+
+
+@pytest.mark.parametrize('limit', ['ten', 0, -1])
+def test_invalid_limit_is_a_400(client, limit):
+    assert client.post('/facets', json={'limit': limit}).status_code == 400
@@ -0,0 +1,68 @@
+"""Composable bitmap filters (user-042)"""
+
+import pytest
+
+
+def scan(ws, predicate):
+    return {i for i in ws.bitmap_indices(ws.FACET_INDEX['all']['all']) if predicate(ws.PROPERTIES[i])}
+
+
+def matches(ws, expr):
+    return set(ws.bitmap_indices(ws.compile_filter(expr)))
+
+
+def test_leaf_matches_a_scan(ws):
+    assert matches(ws, {'prefecture': 'Kyoto'}) == scan(ws, lambda p: p['prefecture'] == 'Kyoto')
+
+
+def test_list_value_is_an_or(ws):
+    expected = scan(ws, lambda p: p['prefecture'] in ('Kyoto', 'Osaka'))
+    assert matches(ws, {'prefecture': ['Kyoto', 'Osaka']}) == expected
+    assert matches(ws, {'or': [{'prefecture': 'Kyoto'}, {'prefecture': 'Osaka'}]}) == expected
+
+
+def test_and_not_and_likes_combine(ws):
+    likes = {'min': 50, 'max': 500}
+    expr = {'and': [{'likes': likes}, {'not': {'prefecture': 'Kyoto'}}]}
+    expected = scan(ws, lambda p: 50 <= p['likes'] <= 500 and p['prefecture'] != 'Kyoto')
+    assert expected
+    assert matches(ws, expr) == expected
+
+
+def test_likes_bounds_are_optional(ws):
+    assert matches(ws, {'likes': {'min': 100}}) == scan(ws, lambda p: p['likes'] >= 100)
+    assert matches(ws, {'likes': {'max': 10}}) == scan(ws, lambda p: p['likes'] <= 10)
+
+
+@pytest.mark.parametrize('expr', [
+    {'colour': 'red'},
+    {'and': []},
+    {'or': {'prefecture': 'Kyoto'}},
+    {'prefecture': 'Kyoto', 'country': 'Japan'},
+    {'likes': {'min': 'lots'}},
+    {'likes': 5},
+    'Kyoto',
+])
+def test_malformed_filters_raise(ws, expr):
+    with pytest.raises(ws.FilterError):
+        ws.compile_filter(expr)
+
+
+def test_nesting_is_bounded(ws):
+    expr = {'prefecture': 'Kyoto'}
+    for _ in range(ws.FILTER_MAX_DEPTH + 1):
+        expr = {'not': expr}
+    with pytest.raises(ws.FilterError):
+        ws.compile_filter(expr)
+
+
+def test_search_applies_the_filter(ws, client):
+    data = client.post('/search', json={'filter': {'prefecture': 'Kyoto'}}).get_json()
+    assert data['properties']
+    assert {prop['prefecture'] for prop in data['properties']} == {'Kyoto'}
+
+
+def test_bad_filter_is_a_400(client):
+    response = client.post('/search', json={'filter': {'colour': 'red'}})
+    assert response.status_code == 400
+    assert 'colour' in response.get_json()['error']
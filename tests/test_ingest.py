@@ -0,0 +1,115 @@
+"""Streaming ingestion from JSONL, CSV and Parquet sources (user-047)"""
+
+import importlib.util
+import json
+import re
+
+import pytest
+
+
+def write_sources(tmp_path, specs):
+    path = tmp_path / 'sources.json'
+    path.write_text(json.dumps(specs))
+    return str(path)
+
+
+def ingest(ws, monkeypatch, tmp_path, specs):
+    monkeypatch.setattr(ws, 'DATA_SOURCES', write_sources(tmp_path, specs))
+    return ws.ingest_stories(ws.data_sources())
+
+
+def test_jsonl_csv_and_json_read_the_same(ws, tmp_path, monkeypatch):
+    rows = [{'tsid': '1', 'pid': '10', 'name': 'Inn A', 'prefecture': 'Kyoto', 'ts_stay_text': 'Quiet, clean',
+             'likes_count': '3'},
+            {'tsid': '2', 'pid': '11', 'name': 'Inn B', 'prefecture': 'Nara', 'ts_stay_text': '温泉',
+             'likes_count': '5'}]
+    (tmp_path / 'a.json').write_text(json.dumps(rows))
+    (tmp_path / 'a.jsonl').write_text(''.join(json.dumps(row) + '\n' for row in rows) + 'not json\n')
+    with open(tmp_path / 'a.csv', 'w', newline='', encoding='utf-8') as f:
+        f.write(','.join(rows[0]) + '\n')
+        for row in rows:
+            f.write(','.join(f'"{value}"' for value in row.values()) + '\n')
+    results = [ingest(ws, monkeypatch, tmp_path, [{'path': name}]) for name in ('a.json', 'a.jsonl', 'a.csv')]
+    assert results[0] == results[1] == results[2]
+    assert [story['likes'] for story in results[0]] == [3, 5]
+    assert results[0][1]['description'] == '温泉'
+
+
+def test_reads_in_chunks(ws, tmp_path, monkeypatch):
+    monkeypatch.setattr(ws, 'INGEST_CHUNK_ROWS', 4)
+    path = tmp_path / 'many.jsonl'
+    path.write_text(''.join(json.dumps({'tsid': n}) + '\n' for n in range(10)))
+    assert [len(chunk) for chunk in ws.read_jsonl(str(path))] == [4, 4, 2]
+
+
+def test_field_map_and_property_join(ws, tmp_path, monkeypatch):
+    (tmp_path / 'stories.jsonl').write_text(
+        json.dumps({'id': 's1', 'property_id': 'p1', 'review_text': '', 'ts_text': 'Lovely', 'likes': 2}) + '\n' +
+        json.dumps({'id': 's2', 'property_id': 'p2', 'review_text': 'Fine', 'likes': 1, 'name': 'Kept'}) + '\n')
+    (tmp_path / 'properties.csv').write_text('property_id,name_en,prefecture\np1,Joined Inn,Hokkaido\n')
+    fields = {'tsid': 'id', 'pid': 'property_id', 'description': ['review_text', 'ts_text'], 'likes': 'likes'}
+    stories = ingest(ws, monkeypatch, tmp_path, [
+        {'path': 'stories.jsonl', 'fields': fields},
+        {'path': 'properties.csv', 'kind': 'properties', 'fields': {'pid': 'property_id', 'name': 'name_en'}},
+    ])
+    assert [(s['tsid'], s['name'], s['prefecture'], s['description']) for s in stories] == [
+        ('s1', 'Joined Inn', 'Hokkaido', 'Lovely'),
+        ('s2', 'Kept', '', 'Fine'),
+    ]
+
+
+def test_later_source_replaces_a_story(ws, tmp_path, monkeypatch):
+    (tmp_path / 'old.jsonl').write_text(json.dumps({'tsid': '1', 'name': 'Inn', 'likes_count': 1}) + '\n')
+    (tmp_path / 'new.jsonl').write_text(json.dumps({'tsid': '1', 'name': 'Inn', 'likes_count': 9}) + '\n')
+    stories = ingest(ws, monkeypatch, tmp_path, [{'path': 'old.jsonl'}, {'path': 'new.jsonl'}])
+    assert [s['likes'] for s in stories] == [9]
+
+
+def test_unusable_rows_are_skipped(ws):
+    fields = ws.DEFAULT_FIELD_MAP
+    assert ws.map_story({'name': 'Inn', 'likes_count': 'many'}, fields, {}) is None
+    assert ws.map_story({'name': 'Unknown Property'}, fields, {}) is None
+    assert ws.map_story({'name': 'Inn'}, fields, {})['country'] == 'JP'
+    assert ws.map_story(None, fields, {}) is None
+
+
+def test_rows_that_are_not_objects_are_skipped(ws, tmp_path, monkeypatch, capsys):
+    rows = [None, {'tsid': '1', 'pid': 'p1', 'name': 'Inn', 'likes_count': 2}, 3, ['Inn'], 'Inn']
+    (tmp_path / 'stories.json').write_text(json.dumps(rows))
+    (tmp_path / 'properties.jsonl').write_text('null\n' + json.dumps({'pid': 'p1', 'prefecture': 'Nara'}) + '\n')
+    stories = ingest(ws, monkeypatch, tmp_path, [{'path': 'stories.json'},
+                                                 {'path': 'properties.jsonl', 'kind': 'properties'}])
+    assert [(s['tsid'], s['prefecture']) for s in stories] == [('1', 'Nara')]
+    out = capsys.readouterr().out
+    assert re.search(r'Skipped 4 unusable rows in \S*stories\.json', out)
+    assert re.search(r'Skipped 1 unusable rows in \S*properties\.jsonl', out)
+
+
+@pytest.mark.parametrize('specs,message', [
+    ({'path': 'a.json'}, 'expected a list'),
+    ([{'name': 'a.json'}], 'expected a list'),
+    ([{'path': 'a.xlsx'}], 'unknown format'),
+    ([{'path': 'a.json', 'kind': 'hotels'}], 'kind must be'),
+    ([{'path': 'a.json', 'fields': {'stars': 'rating'}}], "unknown field 'stars'"),
+])
+def test_bad_source_lists_raise(ws, tmp_path, monkeypatch, specs, message):
+    monkeypatch.setattr(ws, 'DATA_SOURCES', write_sources(tmp_path, specs))
+    with pytest.raises(ws.IngestError, match=message):
+        ws.data_sources()
+
+
+def test_parquet(ws, tmp_path, monkeypatch):
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+    table = pa.table({'tsid': ['1'], 'name': ['Inn'], 'ts_stay_text': ['Nice'], 'likes_count': [4], 'extra': [0]})
+    pq.write_table(table, tmp_path / 'a.parquet')
+    stories = ingest(ws, monkeypatch, tmp_path, [{'path': 'a.parquet'}])
+    assert [(s['name'], s['description'], s['likes']) for s in stories] == [('Inn', 'Nice', 4)]
+
+
+def test_parquet_without_pyarrow_is_an_ingest_error(ws, tmp_path, monkeypatch):
+    if importlib.util.find_spec('pyarrow'):
+        pytest.skip('pyarrow is installed')
+    (tmp_path / 'a.parquet').write_bytes(b'PAR1')
+    with pytest.raises(ws.IngestError, match='pyarrow'):
+        ingest(ws, monkeypatch, tmp_path, [{'path': 'a.parquet'}])
@@ -0,0 +1,62 @@
+"""Queued structured logging (user-027)"""
+
+import json
+import os
+import time
+
+
+def log_counts(ws):
+    counters = ws.snapshot_metrics()['counters']
+    return {key.split(':', 1)[1]: n for key, n in counters.items() if key.startswith('log_records:')}
+
+
+def test_parse_sample_rates_clamps_and_skips_bad_entries(ws):
+    rates = ws.parse_sample_rates('/gallery=0.1, /experiences=2,/bad=x,junk')
+    assert rates == {'/gallery': 0.1, '/experiences': 1.0}
+
+
+def test_log_event_queues_a_record_for_the_writer(ws, monkeypatch):
+    written = []
+    monkeypatch.setattr(ws, '_write_log_batch', written.extend)
+    monkeypatch.setattr(ws, '_LOG_BUCKETS', {})
+    ws.log_event('/test', 'hello', user='x@example.com')
+    deadline = time.monotonic() + 2
+    while not written and time.monotonic() < deadline:
+        ws.flush_logs()
+        time.sleep(0.01)
+    record = next(r for r in written if r['route'] == '/test')
+    assert record['event'] == 'hello' and record['level'] == 'info' and record['user'] == 'x@example.com'
+    json.dumps(record)
+
+
+def test_rate_limit_drops_records_past_the_burst(ws, monkeypatch):
+    monkeypatch.setattr(ws, 'LOG_RATE_LIMIT', 3.0)
+    monkeypatch.setattr(ws, '_LOG_BUCKETS', {})
+    before = log_counts(ws).get('rate_limited', 0)
+    for _ in range(10):
+        ws.log_event('/burst', 'tick')
+    assert log_counts(ws)['rate_limited'] - before >= 6
+
+
+def test_sampling_never_drops_errors(ws, monkeypatch):
+    monkeypatch.setattr(ws, 'LOG_SAMPLE_RATES', {'/sampled': 0.0})
+    monkeypatch.setattr(ws, '_LOG_BUCKETS', {})
+    before = log_counts(ws)
+    ws.log_event('/sampled', 'noise')
+    ws.log_event('/sampled', 'failure', level='error')
+    after = log_counts(ws)
+    assert after['sampled_out'] - before.get('sampled_out', 0) == 1
+    assert after['queued'] - before.get('queued', 0) == 1
+
+
+def test_log_counters_are_merged_like_request_counts(ws, tmp_path, monkeypatch):
+    ws.log_event('/counted', 'tick')
+    monkeypatch.setattr(ws, 'METRICS_DIR', str(tmp_path))
+    # No background flusher: it would outlive the test's METRICS_DIR
+    monkeypatch.setitem(ws._METRICS_FLUSHER, 'pid', os.getpid())
+    other = {'routes': {}, 'counters': {'log_records:queued': 1000}}
+    (tmp_path / 'metrics_1.json').write_text(json.dumps(other))
+    text = ws.render_metrics(ws.collect_metrics())
+    line = next(l for l in text.splitlines() if l.startswith('kabuk_log_records_total{outcome="queued"}'))
+    assert int(line.split()[-1]) == log_counts(ws)['queued'] + 1000
+    assert '# TYPE kabuk_log_records_total counter' in text
@@ -0,0 +1,57 @@
+"""Prometheus /metrics and the per-worker snapshot archive (user-028)"""
+
+import importlib.util
+import json
+import os
+import types
+
+from conftest import REPO_DIR
+
+
+def load_gunicorn_conf():
+    spec = importlib.util.spec_from_file_location('gunicorn_conf', os.path.join(REPO_DIR, 'gunicorn.conf.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def snapshot(count, hits):
+    return {'routes': {'/search': {'count': count, 'errors': 1, 'sum': 0.5 * count,
+                                   'buckets': [count] + [0] * 12}},
+            'counters': {'cache_hits:personalization': hits}}
+
+
+def test_metrics_reports_per_route_counts_and_histograms(client):
+    client.post('/search', json={'query': 'onsen'})
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'kabuk_requests_total{route="/search"}' in text
+    assert 'kabuk_request_duration_seconds_bucket{route="/search",le="+Inf"}' in text
+
+
+def test_child_exit_folds_dead_worker_into_archive(tmp_path, monkeypatch):
+    conf = load_gunicorn_conf()
+    monkeypatch.setenv('METRICS_DIR', str(tmp_path))
+    for pid, count in ((101, 3), (102, 4)):
+        (tmp_path / f'metrics_{pid}.json').write_text(json.dumps(snapshot(count, count)))
+
+    conf.child_exit(None, types.SimpleNamespace(pid=101))
+    conf.child_exit(None, types.SimpleNamespace(pid=102))
+
+    assert sorted(os.listdir(tmp_path)) == ['metrics_archive.json']
+    archive = json.loads((tmp_path / 'metrics_archive.json').read_text())
+    assert archive['routes']['/search']['count'] == 7
+    assert archive['routes']['/search']['buckets'][0] == 7
+    assert archive['counters']['cache_hits:personalization'] == 7
+
+    # A new worker reusing a PID starts its own file; the archived totals stay
+    (tmp_path / 'metrics_101.json').write_text(json.dumps(snapshot(1, 0)))
+    assert json.loads((tmp_path / 'metrics_archive.json').read_text()) == archive
+
+
+def test_on_starting_clears_snapshots_and_archive(tmp_path, monkeypatch):
+    conf = load_gunicorn_conf()
+    monkeypatch.setenv('METRICS_DIR', str(tmp_path))
+    for name in ('metrics_5.json', 'metrics_archive.json', 'metrics_6.json.tmp', 'other.txt'):
+        (tmp_path / name).write_text('{}')
+    conf.on_starting(None)
+    assert os.listdir(tmp_path) == ['other.txt']
@@ -0,0 +1,39 @@
+"""Nearby-prefecture fallback over the adjacency rings (user-040)"""
+
+import pytest
+
+
+@pytest.fixture
+def empty_prefecture(ws):
+    """A prefecture the rings know about that has no properties in the test data"""
+    missing = [key for key in ws.PREFECTURE_RINGS if not ws.PREFECTURE_INDEX.get(key)]
+    if not missing:
+        pytest.skip('every prefecture has properties in this dataset')
+    return missing[0]
+
+
+def test_rings_start_with_the_prefecture_itself(ws):
+    for key, rings in ws.PREFECTURE_RINGS.items():
+        assert rings[0] == [key]
+
+
+def test_nearby_properties_come_from_the_nearest_rings(ws):
+    indices, used = ws.nearby_properties('kyoto', 5)
+    assert len(indices) == 5 and used[0] == 'kyoto'
+    assert ws.nearby_properties('atlantis', 5) == ([], [])
+
+
+def test_search_widens_to_neighbours(ws, client, empty_prefecture):
+    data = client.post('/search', json={'destination': empty_prefecture}).get_json()
+    assert data['properties']
+    assert data['nearby']['prefectures'] and empty_prefecture not in data['nearby']['prefectures']
+    rings = [key for ring in ws.PREFECTURE_RINGS[empty_prefecture] for key in ring]
+    assert all(key in rings for key in data['nearby']['prefectures'])
+
+
+def test_known_destinations_are_not_widened(client):
+    assert 'nearby' not in client.post('/search', json={'destination': 'Kyoto'}).get_json()
+
+
+def test_prefecture_without_stays_is_not_spell_corrected(ws, empty_prefecture):
+    assert ws.correct_query(empty_prefecture) == empty_prefecture
@@ -0,0 +1,34 @@
+"""Japanese text normalization precomputed at load (user-033)"""
+
+import pytest
+
+
+@pytest.mark.parametrize('raw,normalized', [
+    ('ＫＹＯＴＯ', 'kyoto'),
+    ('Nikkō', 'nikko'),
+    ('オンセン', 'おんせん'),
+    ('ラーメン', 'らめん'),
+])
+def test_normalize_text(ws, raw, normalized):
+    assert ws.normalize_text(raw) == normalized
+
+
+@pytest.mark.parametrize('kana,romaji', [
+    ('きょうと', 'kyoto'), ('はこね', 'hakone'), ('ほっかいどう', 'hokkaido'), ('おおさか', 'osaka'),
+    ('きゅうしゅう', 'kyushu'), ('とうきょう', 'tokyo'), ('しゃしん', 'shashin'), ('べっぷ', 'beppu'),
+    ('おおい', 'oi'), ('いう', 'iu'), ('ええ', 'ee'),
+])
+def test_kana_to_romaji(ws, kana, romaji):
+    assert ws.kana_to_romaji(kana) == romaji
+
+
+def test_katakana_query_matches_hiragana_and_katakana_text(client):
+    katakana = client.post('/search', json={'query': 'ゲストハウス'}).get_json()
+    hiragana = client.post('/search', json={'query': 'げすとはうす'}).get_json()
+    assert katakana['properties']
+    assert [p['pid'] for p in katakana['properties']] == [p['pid'] for p in hiragana['properties']]
+
+
+def test_search_responses_hide_normalized_fields(client):
+    for prop in client.post('/search', json={'query': 'onsen'}).get_json()['properties']:
+        assert not [key for key in prop if key.startswith('search_')]
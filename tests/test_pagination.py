@@ -0,0 +1,94 @@
+"""Signed cursor pagination for /search and /recommend (user-034)"""
+
+import base64
+import json
+
+import pytest
+
+
+def walk(client, route, body, key):
+    """Every page of a route's results, following next_cursor"""
+    pages = []
+    while True:
+        response = client.post(route, json=body)
+        assert response.status_code == 200
+        data = response.get_json()
+        pages.append([p['pid'] for p in (data[key] if key == 'properties' else data[key]['properties'])])
+        if not data.get('next_cursor'):
+            return pages
+        body = {'cursor': data['next_cursor']}
+
+
+def payload(cursor):
+    body = cursor.split('.')[0]
+    return json.loads(base64.urlsafe_b64decode(body + '=' * (-len(body) % 4)))
+
+
+def forge(cursor, **changes):
+    """The cursor's payload with changes, keeping the original signature"""
+    body, signature = cursor.split('.')
+    raw = json.dumps(dict(payload(cursor), **changes), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=') + '.' + signature
+
+
+def test_search_pages_cover_every_match_once(ws, client):
+    pages = walk(client, '/search', {'query': 'onsen'}, 'properties')
+    pids = [pid for page in pages for pid in page]
+    assert len(pages) > 2 and len(pids) == len(set(pids))
+    matches = sorted(ws.bitmap_indices(ws.select_properties('onsen', '')), key=ws._popularity_key)
+    assert pids == [ws.PROPERTIES[i]['pid'] for i in matches]
+
+
+def test_recommend_pages_do_not_repeat(client):
+    pages = walk(client, '/recommend', {'query': 'onsen', 'destination': 'Tokyo'}, 'recommendations')
+    pids = [pid for page in pages for pid in page]
+    assert len(pages) > 1 and len(pids) == len(set(pids))
+
+
+@pytest.mark.parametrize('token', ['not-a-cursor', 'e30', 'e30.AAAA', ''.join(['x'] * 40) + '.abc'])
+def test_malformed_cursors_are_rejected(client, token):
+    response = client.post('/search', json={'cursor': token})
+    assert response.status_code == 400
+
+
+def test_tampered_cursor_is_rejected(client):
+    cursor = client.post('/search', json={'query': 'onsen'}).get_json()['next_cursor']
+    response = client.post('/search', json={'cursor': forge(cursor, o=0)})
+    assert response.status_code == 400
+
+
+def test_cursor_for_another_route_is_rejected(client):
+    cursor = client.post('/search', json={'query': 'onsen'}).get_json()['next_cursor']
+    assert client.post('/recommend', json={'cursor': cursor}).status_code == 400
+
+
+def test_cursor_from_another_dataset_version_is_rejected(ws, client, monkeypatch):
+    cursor = client.post('/search', json={'query': 'onsen'}).get_json()['next_cursor']
+    monkeypatch.setattr(ws, 'DATASET_VERSION', 'other')
+    response = client.post('/search', json={'cursor': cursor})
+    assert response.status_code == 400 and 'expired' in response.get_json()['error']
+
+
+def test_personalized_cursor_hides_the_caller_and_cannot_be_forged(client):
+    client.post('/save-progress', json={'email': 'victim@example.com',
+                                        'preferences': {'destination': 'Kyoto', 'style': 'onsen'}})
+    data = client.post('/recommend', json={'email': 'victim@example.com', 'query': 'stay'}).get_json()
+    cursor = data['next_cursor']
+    assert 'victim' not in json.dumps(payload(cursor))
+    assert client.post('/recommend', json={'cursor': cursor}).get_json()['personalized']
+
+    plain = client.post('/recommend', json={'query': 'stay'}).get_json()['next_cursor']
+    forged = forge(plain, u=payload(cursor)['u'])
+    assert client.post('/recommend', json={'cursor': forged}).status_code == 400
+
+
+def test_cursor_callers_are_bounded(ws, monkeypatch):
+    monkeypatch.setattr(ws, 'CURSOR_CALLERS', ws.OrderedDict())
+    monkeypatch.setattr(ws, 'CURSOR_CALLERS_MAX', 3)
+    tokens = [ws.cursor_caller(f'user{n}@example.com') for n in range(3)]
+    assert ws.cursor_state_key(tokens[0]) == 'user0@example.com'
+    ws.cursor_caller('user3@example.com')
+    # user1 was the least recently used
+    assert len(ws.CURSOR_CALLERS) == 3
+    assert ws.cursor_state_key(tokens[1]) is None
+    assert ws.cursor_state_key(tokens[0]) == 'user0@example.com'
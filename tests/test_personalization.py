@@ -0,0 +1,46 @@
+"""Personalized /recommend from saved conversation state (user-026)"""
+
+
+def save(client, email, destination='Kyoto', style='onsen', viewed=()):
+    response = client.post('/save-progress', json={
+        'email': email,
+        'preferences': {'destination': destination, 'style': style, 'budget': 'mid'},
+        'viewed_properties': list(viewed),
+    })
+    assert response.status_code == 200
+
+
+def test_saved_preferences_personalize_recommend(client):
+    save(client, 'kyoto@example.com')
+    body = client.post('/recommend', json={'email': 'kyoto@example.com'}).get_json()
+    assert body['success'] and body['personalized']
+    assert body['recommendations']['properties']
+
+
+def test_viewed_properties_are_not_recommended_again(client):
+    save(client, 'viewer@example.com')
+    first = client.post('/recommend', json={'email': 'viewer@example.com'}).get_json()
+    seen = [p['pid'] for p in first['recommendations']['properties']]
+    save(client, 'viewer@example.com', viewed=seen)
+    again = client.post('/recommend', json={'email': 'viewer@example.com'}).get_json()
+    assert not set(seen) & {p['pid'] for p in again['recommendations']['properties']}
+
+
+def test_saving_progress_invalidates_the_cached_candidates(ws, client):
+    save(client, 'cache@example.com')
+    client.post('/recommend', json={'email': 'cache@example.com'})
+    assert 'email:cache@example.com' in ws.PERSONALIZATION_CACHE
+    save(client, 'cache@example.com', destination='Okinawa')
+    assert 'email:cache@example.com' not in ws.PERSONALIZATION_CACHE
+
+
+def test_cache_evicts_least_recently_used_callers(ws, client, monkeypatch):
+    monkeypatch.setattr(ws, 'PERSONALIZATION_CACHE_MAX', 3)
+    for n in range(5):
+        save(client, f'lru{n}@example.com')
+        client.post('/recommend', json={'email': f'lru{n}@example.com'})
+        # Keep the first caller warm so it survives eviction
+        client.post('/recommend', json={'email': 'lru0@example.com'})
+    assert len(ws.PERSONALIZATION_CACHE) == 3
+    assert 'email:lru0@example.com' in ws.PERSONALIZATION_CACHE
+    assert 'email:lru1@example.com' not in ws.PERSONALIZATION_CACHE
@@ -0,0 +1,34 @@
+"""Stories aggregated into property entities at load (user-035)"""
+
+
+def story(tsid, pid, likes, text='', name='Inn', prefecture='Kyoto'):
+    return {'tsid': tsid, 'pid': pid, 'name': name, 'prefecture': prefecture, 'country': 'JP',
+            'description': text, 'likes': likes}
+
+
+def test_aggregate_groups_stories_by_pid(ws):
+    stories = [story('1', 'a', 5, 'first'), story('2', 'b', 1, 'other'), story('3', 'a', 9, 'best')]
+    entities = ws.aggregate_properties(stories)
+    assert [e['pid'] for e in entities] == ['a', 'b']
+    a = entities[0]
+    assert a['likes'] == 14 and a['story_count'] == 2
+    assert a['stories'] == [2, 0]  # most liked first
+    assert a['description'] == 'best'
+
+
+def test_description_skips_empty_stories(ws):
+    entities = ws.aggregate_properties([story('1', 'a', 9, ''), story('2', 'a', 1, 'words')])
+    assert entities[0]['description'] == 'words'
+
+
+def test_stories_without_pid_group_by_name_and_prefecture(ws):
+    stories = [story('1', '', 1, 'x', name='Inn'), story('2', '', 2, 'y', name='Inn'),
+               story('3', '', 3, 'z', name='Inn', prefecture='Nara')]
+    assert len(ws.aggregate_properties(stories)) == 2
+
+
+def test_loaded_properties_are_unique_and_account_for_every_story(ws):
+    live = [p for p in ws.PROPERTIES if p['stories']]
+    assert len({p['pid'] for p in live}) == len(live)
+    assert sum(p['story_count'] for p in live) == len(ws.STORY_INDEX)
+    assert all(p['likes'] == sum(ws.STORIES[o]['likes'] for o in p['stories']) for p in live)
@@ -0,0 +1,21 @@
+"""Server-Timing phase breakdown (user-029)"""
+
+
+def phases(response):
+    header = response.headers['Server-Timing']
+    return {part.split(';')[0].strip(): float(part.split('dur=')[1]) for part in header.split(',')}
+
+
+def test_header_formats_phases_and_total(ws):
+    assert ws.server_timing_header([('parse', 0.1234), ('match', 2.0)], 3.5) == \
+        'parse;dur=0.123, match;dur=2.000, total;dur=3.500'
+
+
+def test_recommend_reports_its_phases(client):
+    timing = phases(client.post('/recommend', json={'query': 'onsen', 'destination': 'Kyoto'}))
+    assert 'match' in timing and 'total' in timing
+    assert sum(ms for name, ms in timing.items() if name != 'total') <= timing['total'] + 0.01
+
+
+def test_every_route_gets_a_total(client):
+    assert 'total' in phases(client.get('/health'))
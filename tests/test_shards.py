@@ -0,0 +1,87 @@
+"""Sharded selection gives the same answers as selecting in-process (user-046)"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+CASES = [
+    ('onsen', '', None),
+    ('', 'kyoto', None),
+    ('quiet', 'nagano', None),
+    ('', '', {'theme': ['sauna', 'beach']}),
+    ('wifi', '', {'and': [{'likes': {'min': 20}}, {'not': {'prefecture': 'Tokyo'}}]}),
+    ('温泉', '', None),
+    ('nosuchword', '', None),
+]
+
+
+@pytest.fixture
+def shards(ws):
+    assert ws.start_shards(3)
+    yield ws.SHARDS
+    ws.stop_shards()
+
+
+def in_process(ws, query, destination, expr, start=0):
+    return list(ws.selection_indices(ws.select_properties(query, destination, expr), start))
+
+
+def test_matches_are_most_liked_first(ws):
+    expected = sorted(ws.bitmap_indices(ws.select_properties('onsen', '', None)), key=ws._popularity_key)
+    assert in_process(ws, 'onsen', '', None) == expected
+    # A sparse selection is heaped rather than walked, in the same order
+    few = expected[::ws.RANK_WALK_RATIO * 4]
+    assert list(ws.selection_indices(ws.bitmap_from_indices(sorted(few)))) == few
+
+
+@pytest.mark.parametrize('query,destination,expr', CASES)
+def test_sharded_matches_equal_in_process(ws, shards, query, destination, expr):
+    expected = in_process(ws, query, destination, expr)
+    selected = ws.find_properties(query, destination, expr)
+    assert isinstance(selected, ws.ShardedSelection)
+    assert bool(selected) == bool(expected)
+    # More than SHARD_BATCH matches takes several rounds
+    assert list(ws.selection_indices(selected)) == expected
+
+
+def test_sharded_pages_resume_at_a_position(ws, shards):
+    expected = in_process(ws, 'onsen', '', None)
+    start = ws.popularity_position(expected[len(expected) // 2])
+    selected = ws.find_properties('onsen', '', None, start=start)
+    assert list(ws.selection_indices(selected, start)) == expected[len(expected) // 2:]
+
+
+def test_sharded_candidates_are_checked(ws, shards):
+    expected = set(in_process(ws, '', 'kyoto', None))
+    candidates = list(range(0, len(ws.PROPERTIES), 3))
+    selected = ws.find_properties('', 'kyoto', None, candidates)
+    assert {i for i in candidates if ws.selection_contains(selected, i)} == expected & set(candidates)
+
+
+def test_search_responses_match(ws, client):
+    bodies = [{'query': 'onsen'}, {'destination': 'Kyoto', 'theme': 'sauna'}, {'query': 'wifi', 'min_likes': 10}]
+    plain = [client.post('/search', json=body).get_json()['properties'] for body in bodies]
+    assert ws.start_shards(3)
+    try:
+        sharded = [client.post('/search', json=body).get_json()['properties'] for body in bodies]
+    finally:
+        ws.stop_shards()
+    assert sharded == plain
+
+
+def test_bad_filter_from_a_shard_is_a_400(ws, shards, client):
+    assert client.post('/search', json={'filter': {'likes': {'min': 'lots'}}}).status_code == 400
+    # The shards are still serving afterwards
+    assert ws.SHARDS['pid'] is not None
+
+
+def test_concurrent_requests_use_their_own_pipes(ws, shards):
+    queries = ['onsen', 'wifi', 'quiet', '温泉'] * 4
+    expected = {query: in_process(ws, query, '', None) for query in queries}
+
+    def run(query):
+        return list(ws.selection_indices(ws.find_properties(query, '', None)))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        assert list(pool.map(run, queries)) == [expected[query] for query in queries]
@@ -0,0 +1,40 @@
+"""/similar over the precomputed k-NN graph (user-037)"""
+
+import pytest
+
+
+def most_liked(ws):
+    return ws.PROPERTIES[ws.POPULAR_ORDER[0]]
+
+
+def test_similar_by_pid_returns_ranked_neighbours(ws, client):
+    source = most_liked(ws)
+    data = client.post('/similar', json={'pid': source['pid'], 'limit': 4}).get_json()
+    assert data['source']['pid'] == source['pid']
+    scores = [item['similarity'] for item in data['similar']]
+    assert 0 < len(scores) <= 4 and scores == sorted(scores, reverse=True)
+    assert source['pid'] not in {item['pid'] for item in data['similar']}
+
+
+def test_similar_resolves_exact_and_partial_names(ws, client):
+    source = most_liked(ws)
+    exact = client.post('/similar', json={'name': source['name']}).get_json()
+    assert exact['source']['pid'] == ws.PROPERTIES[ws.NAME_INDEX[source['search_name']]]['pid']
+    word = max(ws.tokenize(source['search_name']), key=len)
+    partial = client.post('/similar', json={'name': word}).get_json()
+    assert word in ws.normalize_text(partial['source']['name'])
+
+
+def test_unknown_property_is_a_404(client):
+    assert client.post('/similar', json={'name': 'zzqqxxyy nowhere'}).status_code == 404
+
+
+@pytest.mark.parametrize('limit', ['many', -3, 0, None, [5]])
+def test_invalid_limit_is_a_400(ws, client, limit):
+    response = client.post('/similar', json={'pid': most_liked(ws)['pid'], 'limit': limit})
+    assert response.status_code == 400
+
+
+def test_limit_is_capped_at_k(ws, client):
+    data = client.post('/similar', json={'pid': most_liked(ws)['pid'], 'limit': 500}).get_json()
+    assert len(data['similar']) <= ws.KNN_K
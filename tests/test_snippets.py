@@ -0,0 +1,47 @@
+"""Query-aware snippets from sentence offsets (user-045)"""
+
+
+def bare(text):
+    return text.removeprefix('...').removesuffix('...')
+
+
+def test_split_story_offsets_and_flags(ws):
+    description = 'The onsen was lovely. 部屋は清潔でした。Great beach nearby!'
+    ends, flags, text = ws.split_story(description)
+    assert ends == [22, 31, len(description)]
+    assert [ws.theme_names(f) for f in flags] == [['onsen'], [], ['beach']]
+    assert text == ''.join(ws.normalize_text(part) for part in (description[:22], description[22:31], description[31:]))
+
+
+def test_snippets_fit_the_budget_and_come_from_a_story(ws):
+    for prop in ws.PROPERTIES[:200]:
+        if not prop['stories']:
+            continue
+        text = ws.snippet(prop, budget=80)
+        assert len(bare(text)) <= 80
+        assert any(bare(text) in ws.STORIES[o]['description'] for o in prop['stories'])
+
+
+def test_theme_focus_picks_a_sentence_with_the_theme(ws):
+    mask = ws.THEME_BITS['sauna']
+    shown = 0
+    for i in ws.THEME_POSTINGS['sauna'][:50]:
+        text = ws.snippet(ws.PROPERTIES[i], ws.snippet_focus('', ['sauna']))
+        assert ws.tag_text(ws.normalize_text(bare(text))) & mask
+        shown += 1
+    assert shown
+
+
+def test_keyword_focus_picks_a_sentence_with_the_keyword(ws):
+    focus = ws.snippet_focus('wifi')
+    assert focus == (0, ['wifi'])
+    for i in ws.bitmap_indices(ws.query_bitmap('wifi')):
+        text = ws.snippet(ws.PROPERTIES[i], focus)
+        assert 'wifi' in ws.normalize_text(text)
+
+
+def test_search_highlights_follow_the_query(ws, client):
+    data = client.post('/search', json={'query': 'onsen'}).get_json()
+    assert data['properties']
+    for prop in data['properties']:
+        assert ws.tag_text(ws.normalize_text(prop['highlight'])) & ws.THEME_BITS['onsen']
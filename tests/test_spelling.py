@@ -0,0 +1,27 @@
+"""Typo-tolerant lookup with a symmetric-delete index (user-032)"""
+
+import pytest
+
+
+def test_edit_distance_counts_transpositions_as_one(ws):
+    assert ws.edit_distance('onsen', 'onsen', 2) == 0
+    assert ws.edit_distance('onsne', 'onsen', 2) == 1
+    assert ws.edit_distance('kyoto', 'tokyo', 2) == 3  # capped at max + 1
+
+
+@pytest.mark.parametrize('typo,word', [('hakne', 'hakone'), ('onssen', 'onsen'), ('mountian', 'mountain')])
+def test_correct_term_finds_the_vocabulary_word(ws, typo, word):
+    assert word in ws.SPELL_INDEX['terms']
+    assert ws.correct_term(typo) == word
+
+
+def test_known_short_and_numeric_terms_are_left_alone(ws):
+    assert ws.correct_term('onsen') == 'onsen'
+    assert ws.correct_term('ab') == 'ab'
+    assert ws.correct_term('2024') == '2024'
+
+
+def test_search_reports_the_correction(client):
+    body = client.post('/search', json={'query': 'onssen'}).get_json()
+    assert body['corrected']['query'] == 'onsen'
+    assert body['properties']
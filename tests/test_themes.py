@@ -0,0 +1,52 @@
+"""Load-time theme tags and postings (user-044)"""
+
+import pytest
+
+
+def test_property_flags_are_the_or_of_its_stories(ws):
+    for i, prop in enumerate(ws.PROPERTIES):
+        if not prop['stories']:
+            continue
+        flags = ws.tag_text(prop['search_name'])
+        for o in prop['stories']:
+            flags |= ws.STORY_THEME_FLAGS[o]
+        assert ws.THEME_FLAGS[i] == flags, prop['name']
+
+
+def test_story_flags_match_retagging(ws):
+    for o in range(0, len(ws.STORIES), 97):
+        assert ws.STORY_THEME_FLAGS[o] == ws.tag_text(ws.normalize_text(ws.STORIES[o]['description']))
+
+
+def test_postings_hold_every_tagged_property_most_liked_first(ws):
+    for theme, bit in ws.THEME_BITS.items():
+        postings = list(ws.THEME_POSTINGS[theme])
+        tagged = {i for i in ws.bitmap_indices(ws.FACET_INDEX['all']['all']) if ws.THEME_FLAGS[i] & bit}
+        assert set(postings) == tagged, theme
+        likes = [ws.PROPERTIES[i]['likes'] for i in postings]
+        assert likes == sorted(likes, reverse=True), theme
+
+
+def test_themed_properties_intersects(ws):
+    both = ws.themed_properties(['onsen', 'ryokan'])
+    assert both
+    assert set(both) == set(ws.THEME_POSTINGS['onsen']) & set(ws.THEME_POSTINGS['ryokan'])
+
+
+@pytest.mark.parametrize('text,themes', [
+    ('hot springs', ['onsen']),
+    ('温泉', ['onsen']),
+    ('pet_friendly', ['pet_friendly']),
+    ('onsens and beaches', ['onsen', 'beach']),
+    ('onsenbu', []),
+])
+def test_resolve_themes(ws, text, themes):
+    assert ws.resolve_themes(text) == themes
+
+
+def test_theme_filter_uses_the_tags(ws, client):
+    data = client.post('/search', json={'theme': 'sauna'}).get_json()
+    assert data['properties']
+    for prop in data['properties']:
+        i = ws.PID_INDEX[prop['pid']]
+        assert ws.THEME_FLAGS[i] & ws.THEME_BITS['sauna']
@@ -0,0 +1,53 @@
+"""Intent and entity extraction from whole sentences (user-043)"""
+
+import pytest
+
+
+def parse(ws, text):
+    return ws.parse_utterance(ws.normalize_text(text))
+
+
+def test_automaton_finds_overlapping_patterns(ws):
+    automaton = ws.build_automaton({'he': ['he'], 'she': ['she'], 'hers': ['hers'], 'his': ['his']})
+    found = {(start, end, payloads[0]) for start, end, payloads in ws.scan_automaton(automaton, 'ushers')}
+    assert found == {(1, 4, 'she'), (2, 4, 'he'), (2, 6, 'hers')}
+
+
+@pytest.mark.parametrize('text,intent,destination,themes,keywords', [
+    ('find me an onsen ryokan in kyoto', 'recommend', 'kyoto', ['onsen', 'ryokan'], ''),
+    ('recommend a quiet cabin in nagano', 'recommend', 'nagano', [], 'quiet cabin'),
+    ('京都の温泉旅館', None, 'kyoto', ['onsen', 'ryokan'], ''),
+])
+def test_sentences_split_into_entities(ws, text, intent, destination, themes, keywords):
+    parsed = parse(ws, text)
+    assert parsed['intent'] == intent
+    assert parsed['destination'] == destination
+    assert parsed['themes'] == themes
+    assert parsed['keywords'] == keywords
+
+
+def test_first_destination_wins_and_near_is_noted(ws):
+    parsed = parse(ws, 'kyoto onsen near osaka')
+    assert parsed['destination'] == 'kyoto'
+    assert parsed['nearby']
+
+
+def test_latin_names_only_match_whole_words(ws):
+    parsed = parse(ws, 'tokyoite onsenbu')
+    assert parsed['destination'] is None
+    assert parsed['themes'] == []
+    assert parsed['keywords'] == 'tokyoite onsenbu'
+
+
+def test_misheard_place_is_recovered(ws):
+    parsed = ws.understand_query(ws.normalize_text('onsen in kyotto'))
+    assert parsed['destination'] == 'kyoto'
+    assert parsed['themes'] == ['onsen']
+
+
+def test_recommend_turns_the_sentence_into_filters(ws, client):
+    data = client.post('/recommend', json={'query': 'find me an onsen ryokan in kyoto'}).get_json()
+    assert data['parsed']['destination'] == 'kyoto'
+    properties = data['recommendations']['properties']
+    assert properties
+    assert {prop['location'] for prop in properties} == {'Kyoto'}
@@ -0,0 +1,33 @@
+"""Background warm-up with liveness and readiness probes (user-039)"""
+
+import pytest
+
+
+def test_live_and_ready_once_warm(client):
+    assert client.get('/health/live').status_code == 200
+    ready = client.get('/health/ready')
+    assert ready.status_code == 200
+    assert ready.get_json()['ready'] and ready.get_json()['progress'] == 1.0
+
+
+@pytest.fixture
+def warming(ws, monkeypatch):
+    """Pretend warm-up is still running in this process"""
+    monkeypatch.setitem(ws.WARMUP, 'ready', False)
+    monkeypatch.setitem(ws.WARMUP, 'completed', ['stories'])
+    monkeypatch.setitem(ws.WARMUP, 'stage', 'indexes')
+
+
+def test_ready_is_503_with_progress_while_warming(client, warming):
+    assert client.get('/health/live').status_code == 200
+    response = client.get('/health/ready')
+    assert response.status_code == 503
+    assert response.get_json()['stage'] == 'indexes'
+
+
+@pytest.mark.parametrize('route', ['/search', '/recommend'])
+def test_data_endpoints_answer_at_once_while_warming(client, warming, route):
+    response = client.post(route, json={'query': 'onsen'})
+    assert response.status_code == 200
+    assert response.get_json()['warming_up'] is True
+    assert response.headers['Retry-After']
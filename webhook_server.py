@@ -4,10 +4,35 @@ Minimal webhook server for ElevenLabs agent integration
 Provides property search from HafH travel stories data
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, has_request_context
 from flask_cors import CORS
+import atexit
+import base64
+import bisect
+import csv
+import gc
+import glob
+import hashlib
+import heapq
+import hmac
+import itertools
 import json
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import queue
 import random
+import re
+import secrets
+import sys
+import threading
+import time
+import unicodedata
+import zlib
+from array import array
+from collections import OrderedDict
 from datetime import datetime
 
 app = Flask(__name__)
@@ -16,58 +41,3175 @@ CORS(app)
 # Cache for landing page HTML (built once at startup)
 CACHED_INDEX_HTML = None
 
-# Load sample properties from travel stories
+# Cache for the details page (built once data is loaded)
+CACHED_DETAILS_HTML = None
+
+# Travel stories export (override with DATA_PATH, e.g. for benchmark datasets)
+DATA_PATH = os.environ.get('DATA_PATH', 'data/hafh_stories.json')
+
+# JSON file listing several sources to load and merge instead (see INGESTION)
+DATA_SOURCES = os.environ.get('DATA_SOURCES', '')
+
+# Travel stories as loaded (one entry per story)
+STORIES = []
+
+# Properties aggregated from STORIES (one entry per property)
 PROPERTIES = []
 
-# In-memory conversation state storage
-# TODO: Replace with Redis or database for production
-CONVERSATION_STATE = {}
+# Property indices ordered by likes (most popular first), built at load time
+POPULAR_ORDER = []
+
+# Property pid -> index into PROPERTIES
+PID_INDEX = {}
+
+# Normalized property name -> first property index with that name
+NAME_INDEX = {}
+
+# Property key (see story_key()) -> index into PROPERTIES, tombstones included
+PROPERTY_KEYS = {}
+
+# Story tsid -> offset into STORIES, for stories still attached to a property
+STORY_INDEX = {}
+
+# Identifies the loaded dataset; pagination cursors from another version are rejected
+DATASET_VERSION = ''
+
+# In-memory conversation state storage
+# TODO: Replace with Redis or database for production
+CONVERSATION_STATE = {}
+
+# Per-user personalized candidate lists (state key -> property indices)
+# Invalidated whenever that user's conversation state changes; least
+# recently used entries are dropped past PERSONALIZATION_CACHE_MAX users
+PERSONALIZATION_CACHE = OrderedDict()
+PERSONALIZATION_CACHE_MAX = int(os.environ.get('PERSONALIZATION_CACHE_MAX', '5000'))
+_PERSONALIZATION_LOCK = threading.Lock()
+
+# ============================================================================
+# STRUCTURED LOGGING
+# ============================================================================
+# Request handlers never write to stdout directly. log_event() drops a small
+# dict on a bounded queue and a background thread serializes and writes JSON
+# lines in batches, so a slow stdout can never stall a voice-agent call.
+
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+LOG_QUEUE = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+
+# Max records per second per route (token bucket, burst of the same size)
+LOG_RATE_LIMIT = float(os.environ.get('LOG_RATE_LIMIT', '100'))
+
+def parse_sample_rates(spec):
+    """Parse LOG_SAMPLE_RATES like '/gallery=0.1,/experiences=0.5'"""
+    rates = {}
+    for part in spec.split(','):
+        if '=' in part:
+            route, rate = part.split('=', 1)
+            try:
+                rates[route.strip()] = max(0.0, min(1.0, float(rate)))
+            except ValueError:
+                continue
+    return rates
+
+# Fraction of non-error records kept per route (1.0 = log everything)
+LOG_SAMPLE_RATES = parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES', ''))
+
+_LOG_BUCKETS = {}
+_LOG_WRITER = {'pid': None}
+_LOG_START_LOCK = threading.Lock()
+
+def _write_log_batch(batch):
+    """Serialize and write a batch of records in one stdout call"""
+    lines = ''.join(json.dumps(r, ensure_ascii=False, default=str) + '\n' for r in batch)
+    try:
+        sys.stdout.write(lines)
+        sys.stdout.flush()
+        inc_counter('log_records:written', len(batch))
+    except Exception:
+        inc_counter('log_records:dropped', len(batch))
+
+def _log_writer_loop(log_queue):
+    """Background writer: block for one record, then drain whatever else is queued"""
+    while True:
+        batch = [log_queue.get()]
+        try:
+            while len(batch) < 500:
+                batch.append(log_queue.get_nowait())
+        except queue.Empty:
+            pass
+        _write_log_batch(batch)
+
+def start_log_writer():
+    """Start the writer thread (again after a fork, since threads don't survive it)"""
+    global LOG_QUEUE
+    with _LOG_START_LOCK:
+        if _LOG_WRITER['pid'] == os.getpid():
+            return
+        if _LOG_WRITER['pid'] is not None:
+            # Forked child: the parent's queue may hold a copied, locked mutex
+            LOG_QUEUE = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        thread = threading.Thread(target=_log_writer_loop, args=(LOG_QUEUE,),
+                                  name='log-writer', daemon=True)
+        thread.start()
+        _LOG_WRITER['pid'] = os.getpid()
+
+def flush_logs():
+    """Write anything still queued (called at interpreter exit)"""
+    batch = []
+    try:
+        while True:
+            batch.append(LOG_QUEUE.get_nowait())
+    except queue.Empty:
+        pass
+    if batch:
+        _write_log_batch(batch)
+
+atexit.register(flush_logs)
+
+def log_event(route, event, level='info', **fields):
+    """Queue one structured log record. Never blocks; drops and counts when full."""
+    if level != 'error':
+        rate = LOG_SAMPLE_RATES.get(route, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            inc_counter('log_records:sampled_out')
+            return
+
+    now = time.monotonic()
+    bucket = _LOG_BUCKETS.get(route)
+    if bucket is None:
+        bucket = _LOG_BUCKETS[route] = [LOG_RATE_LIMIT, now]
+    tokens = min(LOG_RATE_LIMIT, bucket[0] + (now - bucket[1]) * LOG_RATE_LIMIT)
+    bucket[1] = now
+    if tokens < 1:
+        bucket[0] = tokens
+        inc_counter('log_records:rate_limited')
+        return
+    bucket[0] = tokens - 1
+
+    if _LOG_WRITER['pid'] != os.getpid():
+        start_log_writer()
+
+    record = {'ts': round(time.time(), 3), 'level': level, 'route': route, 'event': event}
+    record.update(fields)
+    try:
+        LOG_QUEUE.put_nowait(record)
+        inc_counter('log_records:queued')
+    except queue.Full:
+        inc_counter('log_records:dropped')
+
+# ============================================================================
+# METRICS
+# ============================================================================
+# Each request thread records into its own shard (plain dicts, no lock on the
+# hot path). /metrics merges the shards at scrape time. With METRICS_DIR set,
+# every worker also snapshots its totals there so any worker can report the
+# sum across all gunicorn workers. When a worker exits, the gunicorn master
+# folds its snapshot into metrics_archive.json (see gunicorn.conf.py), so
+# recycled workers don't take their counts with them.
+
+# Latency histogram upper bounds in seconds (a final +Inf bucket is implied)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = 5.0
+
+_METRICS_LOCAL = threading.local()
+_METRICS_SHARDS = []  # (thread, shard) pairs
+_METRICS_RETIRED = {'routes': {}, 'counters': {}}  # totals folded in from finished threads
+_METRICS_LOCK = threading.Lock()
+_METRICS_FLUSHER = {'pid': None}
+
+# Counter families kept with inc_counter('<kind>:<label>:...'), so they are
+# summed across threads and workers like the request counts:
+# kind -> (metric name, help, label names)
+COUNTER_FAMILIES = {
+    'admission': ('kabuk_admission_total', 'Requests shed, degraded or rate limited by admission control',
+                  ('outcome', 'route')),
+    'log_records': ('kabuk_log_records_total', 'Structured log records by outcome', ('outcome',)),
+}
+
+# Extra series reported at scrape time: name -> (help, type, fn)
+# fn returns a number, or a dict of label string -> number
+METRIC_COLLECTORS = {}
+
+def register_collector(name, help_text, metric_type, fn):
+    """Expose a subsystem value (index size, cache occupancy...) on /metrics"""
+    METRIC_COLLECTORS[name] = (help_text, metric_type, fn)
+
+def _metrics_shard():
+    """Return this thread's private counters, creating them on first use"""
+    shard = getattr(_METRICS_LOCAL, 'shard', None)
+    if shard is None:
+        shard = {'routes': {}, 'counters': {}}
+        _METRICS_LOCAL.shard = shard
+        with _METRICS_LOCK:
+            _METRICS_SHARDS.append((threading.current_thread(), shard))
+    return shard
+
+def record_request(route, status, elapsed):
+    """Count one request and its latency for a route"""
+    routes = _metrics_shard()['routes']
+    stats = routes.get(route)
+    if stats is None:
+        stats = routes[route] = {'count': 0, 'errors': 0, 'sum': 0.0,
+                                 'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+    stats['count'] += 1
+    if status >= 500:
+        stats['errors'] += 1
+    stats['sum'] += elapsed
+    stats['buckets'][bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+def inc_counter(key, amount=1):
+    """Bump a named counter, e.g. 'cache_hits:personalization'"""
+    counters = _metrics_shard()['counters']
+    counters[key] = counters.get(key, 0) + amount
+
+def record_cache(cache, hit):
+    """Count a cache hit or miss for the hit-ratio series"""
+    inc_counter(f"cache_{'hits' if hit else 'misses'}:{cache}")
+
+def _merge_metrics(target, source):
+    """Add one metrics snapshot into another"""
+    for route, stats in source['routes'].items():
+        total = target['routes'].get(route)
+        if total is None:
+            total = target['routes'][route] = {'count': 0, 'errors': 0, 'sum': 0.0,
+                                               'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+        total['count'] += stats['count']
+        total['errors'] += stats['errors']
+        total['sum'] += stats['sum']
+        for i, n in enumerate(stats['buckets']):
+            total['buckets'][i] += n
+    for key, n in source['counters'].items():
+        target['counters'][key] = target['counters'].get(key, 0) + n
+
+def snapshot_metrics():
+    """Merge every thread shard of this process into one snapshot"""
+    merged = {'routes': {}, 'counters': {}}
+    with _METRICS_LOCK:
+        alive = []
+        for thread, shard in _METRICS_SHARDS:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                # Fold finished threads into the retired totals so the list stays short
+                _merge_metrics(_METRICS_RETIRED, shard)
+        _METRICS_SHARDS[:] = alive
+        _merge_metrics(merged, _METRICS_RETIRED)
+        for _, shard in alive:
+            _merge_metrics(merged, shard)
+    return merged
+
+def _write_metrics_snapshot():
+    """Persist this worker's totals to METRICS_DIR (atomic replace)"""
+    path = os.path.join(METRICS_DIR, f"metrics_{os.getpid()}.json")
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot_metrics(), f)
+    os.replace(tmp_path, path)
+
+def _metrics_flusher_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            _write_metrics_snapshot()
+        except Exception as e:
+            log_event('/metrics', 'snapshot_failed', level='error', error=str(e))
+
+def _final_metrics_snapshot():
+    """Write this worker's last totals before it exits, for the master to archive"""
+    if _METRICS_FLUSHER['pid'] == os.getpid():
+        try:
+            _write_metrics_snapshot()
+        except Exception:
+            pass
+
+atexit.register(_final_metrics_snapshot)
+
+def start_metrics_flusher():
+    """Start the per-worker snapshot thread (again after a fork)"""
+    with _METRICS_LOCK:
+        if _METRICS_FLUSHER['pid'] == os.getpid():
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        threading.Thread(target=_metrics_flusher_loop, name='metrics-flusher', daemon=True).start()
+        _METRICS_FLUSHER['pid'] = os.getpid()
+
+def collect_metrics():
+    """Totals for this process, or for all workers when METRICS_DIR is set"""
+    if not METRICS_DIR:
+        return snapshot_metrics()
+    start_metrics_flusher()
+    _write_metrics_snapshot()
+    merged = {'routes': {}, 'counters': {}}
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics_*.json')):
+        try:
+            with open(path) as f:
+                _merge_metrics(merged, json.load(f))
+        except (OSError, ValueError):
+            continue
+    return merged
+
+def render_metrics(snapshot):
+    """Format a snapshot in the Prometheus text exposition format"""
+    lines = [
+        '# HELP kabuk_requests_total Requests handled per route',
+        '# TYPE kabuk_requests_total counter'
+    ]
+    routes = sorted(snapshot['routes'].items())
+    for route, stats in routes:
+        lines.append(f'kabuk_requests_total{{route="{route}"}} {stats["count"]}')
+    lines += ['# HELP kabuk_request_errors_total Requests per route that returned 5xx',
+              '# TYPE kabuk_request_errors_total counter']
+    for route, stats in routes:
+        lines.append(f'kabuk_request_errors_total{{route="{route}"}} {stats["errors"]}')
+    lines += ['# HELP kabuk_request_duration_seconds Request latency per route',
+              '# TYPE kabuk_request_duration_seconds histogram']
+    for route, stats in routes:
+        cumulative = 0
+        for bound, n in zip(LATENCY_BUCKETS + ('+Inf',), stats['buckets']):
+            cumulative += n
+            lines.append(f'kabuk_request_duration_seconds_bucket{{route="{route}",le="{bound}"}} {cumulative}')
+        lines.append(f'kabuk_request_duration_seconds_sum{{route="{route}"}} {stats["sum"]:.6f}')
+        lines.append(f'kabuk_request_duration_seconds_count{{route="{route}"}} {stats["count"]}')
+
+    caches = {}
+    for key, n in snapshot['counters'].items():
+        kind, _, name = key.partition(':')
+        if kind in ('cache_hits', 'cache_misses'):
+            caches.setdefault(name, {'cache_hits': 0, 'cache_misses': 0})[kind] = n
+    if caches:
+        lines += ['# HELP kabuk_cache_hit_ratio Fraction of lookups served from cache',
+                  '# TYPE kabuk_cache_hit_ratio gauge']
+        for name, c in sorted(caches.items()):
+            total = c['cache_hits'] + c['cache_misses']
+            ratio = c['cache_hits'] / total if total else 0.0
+            lines.append(f'kabuk_cache_hit_ratio{{cache="{name}"}} {ratio:.4f}')
+        lines += ['# HELP kabuk_cache_lookups_total Cache lookups by outcome',
+                  '# TYPE kabuk_cache_lookups_total counter']
+        for name, c in sorted(caches.items()):
+            lines.append(f'kabuk_cache_lookups_total{{cache="{name}",outcome="hit"}} {c["cache_hits"]}')
+            lines.append(f'kabuk_cache_lookups_total{{cache="{name}",outcome="miss"}} {c["cache_misses"]}')
+
+    for kind, (name, help_text, labels) in sorted(COUNTER_FAMILIES.items()):
+        rows = []
+        for key, n in snapshot['counters'].items():
+            parts = key.split(':', len(labels))
+            if parts[0] == kind and len(parts) == len(labels) + 1:
+                rows.append((','.join(f'{label}="{value}"' for label, value in zip(labels, parts[1:])), n))
+        if rows:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            lines += [f'{name}{{{label_text}}} {n}' for label_text, n in sorted(rows)]
+
+    for name, (help_text, metric_type, fn) in sorted(METRIC_COLLECTORS.items()):
+        try:
+            value = fn()
+        except Exception:
+            continue
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}']
+        if isinstance(value, dict):
+            for labels, v in sorted(value.items()):
+                lines.append(f'{name}{{{labels}}} {v}')
+        else:
+            lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+# ============================================================================
+# REQUEST PHASE TIMING
+# ============================================================================
+# Search-style handlers mark the end of each stage (parse, match, rank,
+# serialize). Every response carries the breakdown in a Server-Timing header;
+# sending "debug": true (or ?debug=1) also puts it in the JSON body.
+
+def mark_phase(name):
+    """Record time spent since the previous mark as phase `name`"""
+    now = time.perf_counter()
+    g.phases.append((name, (now - g.phase_mark) * 1000.0))
+    g.phase_mark = now
+
+def parse_request_json():
+    """request.get_json() timed as the 'parse' phase"""
+    g.phase_mark = time.perf_counter()
+    data = request.get_json() or {}
+    mark_phase('parse')
+    return data
+
+def timing_requested(data):
+    """True when the caller opted in to the timing breakdown in the body"""
+    if request.args.get('debug') in ('1', 'true', 'timing'):
+        return True
+    return isinstance(data, dict) and bool(data.get('debug'))
+
+def timed_jsonify(payload, data):
+    """jsonify() timed as the 'serialize' phase, with optional debug timing field"""
+    if g.get('partial'):
+        payload['partial'] = True
+    if timing_requested(data):
+        payload['debug'] = {'timing_ms': {name: round(ms, 3) for name, ms in g.phases}}
+    g.phase_mark = time.perf_counter()
+    response = jsonify(payload)
+    mark_phase('serialize')
+    return response
+
+def server_timing_header(phases, total_ms):
+    """Format phases as a Server-Timing header value"""
+    parts = [f"{name};dur={ms:.3f}" for name, ms in phases]
+    parts.append(f"total;dur={total_ms:.3f}")
+    return ', '.join(parts)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = g.phase_mark = time.perf_counter()
+    g.phases = []
+    start_budget()
+    if METRICS_DIR and _METRICS_FLUSHER['pid'] != os.getpid():
+        start_metrics_flusher()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        record_request(route, response.status_code, elapsed)
+        response.headers['Server-Timing'] = server_timing_header(g.get('phases', []), elapsed * 1000.0)
+    return response
+
+# ----------------------------------------------------------------------------
+# Time budgets
+# ----------------------------------------------------------------------------
+# Tool calls have a hard timeout, and an answer after it is wasted. Each
+# request gets a budget (X-Time-Budget-Ms, else REQUEST_BUDGET_MS, clamped
+# to 0..REQUEST_BUDGET_MAX_MS) less the time it already spent in the
+# proxy's queue, when a trusted X-Request-Start says so (see
+# request_queue_ms()). Scans that can run long (result pages,
+# personalization, shard rounds) check out_of_time() as they go and stop
+# with what they have found; the response then carries "partial": true,
+# and its cursor resumes where the scan stopped.
+
+REQUEST_BUDGET_MS = float(os.environ.get('REQUEST_BUDGET_MS', '3000'))
+REQUEST_BUDGET_MAX_MS = 30000.0
+
+# Share of the budget kept for building the answer once scanning stops
+BUDGET_RESERVE = 0.1
+
+def start_budget():
+    """Set this request's deadline (perf_counter time)"""
+    try:
+        budget = float(request.headers.get('X-Time-Budget-Ms', REQUEST_BUDGET_MS))
+    except ValueError:
+        budget = REQUEST_BUDGET_MS
+    # nan would make every deadline check fail; inf is clamped like any large budget
+    if math.isnan(budget):
+        budget = REQUEST_BUDGET_MS
+    budget = min(max(budget, 0.0), REQUEST_BUDGET_MAX_MS)
+    # None unless a trusted proxy stamped a plausible arrival time
+    queued = request_queue_ms()
+    if queued is not None:
+        budget -= min(queued, budget)
+    g.deadline = g.request_start + budget * (1 - BUDGET_RESERVE) / 1000.0
+    g.partial = False
+
+def remaining_budget():
+    """Seconds left before this request's deadline; None outside a request"""
+    if not has_request_context() or 'deadline' not in g:
+        return None
+    return g.deadline - time.perf_counter()
+
+def out_of_time():
+    """True once the request's budget is spent (the answer is then marked partial)"""
+    if not has_request_context() or time.perf_counter() < g.get('deadline', math.inf):
+        return False
+    g.partial = True
+    return True
+
+# ============================================================================
+# WARM-UP AND READINESS
+# ============================================================================
+# Importing the app is cheap, so the server binds immediately; stories and
+# indexes load in a background thread. /health/live answers as soon as the
+# process is up, /health/ready only once warm-up has finished (with progress
+# while it runs). Until then data routes answer with a precomputed "still
+# loading" response instead of making the caller wait.
+
+WARMUP_BUILD_STAGES = ['stories', 'properties', 'normalize', 'spelling', 'minhash', 'facets', 'knn']
+
+WARMUP = {'pid': None, 'ready': False, 'stage': None, 'plan': [], 'completed': [],
+          'started_at': None, 'ready_at': None, 'error': None}
+_WARMUP_LOCK = threading.Lock()
+_WARMUP_READY = threading.Event()
+
+WARMUP_MESSAGE = "I'm still loading our travel stories. Please ask again in a few seconds."
+
+# Serialized once; served as-is by data routes until ready
+WARMUP_FALLBACKS = {
+    route: json.dumps(dict(body, success=True, warming_up=True, message=WARMUP_MESSAGE))
+    for route, body in {
+        '/search': {'properties': [], 'next_cursor': None},
+        '/recommend': {'personalized': False, 'recommendations': {'properties': [], 'inspiration': []},
+                       'next_cursor': None},
+        '/experiences': {'experiences': []},
+        '/gallery': {'gallery': []},
+        '/inspiration': {'stories': [], 'count': 0},
+        '/similar': {'source': None, 'similar': []},
+        '/facets': {'total': 0, 'facets': {'country': [], 'prefecture': [], 'theme': []}}
+    }.items()
+}
+
+def warmup_plan(stages):
+    """Stages the running warm-up still has to go through (for progress)"""
+    WARMUP['plan'] = WARMUP['completed'] + ([WARMUP['stage']] if WARMUP['stage'] else []) + list(stages)
+
+def warmup_stage(name):
+    """Mark the current warm-up stage finished and move on to `name` (None = done)"""
+    if WARMUP['stage']:
+        WARMUP['completed'].append(WARMUP['stage'])
+    WARMUP['stage'] = name
+    if name and name not in WARMUP['plan']:
+        WARMUP['plan'].append(name)
+
+def readiness_status():
+    """Warm-up state for /health/ready"""
+    plan = WARMUP['plan'] or ['load']
+    started = WARMUP['started_at']
+    return {
+        'ready': WARMUP['ready'],
+        'stage': WARMUP['stage'],
+        'completed': list(WARMUP['completed']),
+        'progress': 1.0 if WARMUP['ready'] else round(len(WARMUP['completed']) / len(plan), 2),
+        'elapsed_seconds': round((WARMUP['ready_at'] or time.time()) - started, 2) if started else 0.0,
+        'error': WARMUP['error']
+    }
+
+def _warmup():
+    WARMUP['started_at'] = time.time()
+    try:
+        load_data()
+        warmup_stage('pages')
+        warm_caches()
+        start_shards(SCORING_SHARDS)
+        start_delta_watcher()
+        warmup_stage(None)
+        WARMUP['ready_at'] = time.time()
+        WARMUP['ready'] = True
+        _WARMUP_READY.set()
+        print(f"📊 Serving {len(PROPERTIES)} properties (ready in {WARMUP['ready_at'] - WARMUP['started_at']:.1f}s)")
+    except Exception as e:
+        WARMUP['error'] = str(e)
+        print(f"❌ Warm-up failed: {e}")
+
+def start_warmup():
+    """Start the warm-up thread (again in a fork taken before warm-up finished)"""
+    global _WARMUP_READY
+    with _WARMUP_LOCK:
+        if WARMUP['ready'] or WARMUP['pid'] == os.getpid():
+            return
+        if WARMUP['pid'] is not None:
+            # Forked mid-warm-up: the parent's thread and partial state didn't come along
+            _WARMUP_READY = threading.Event()
+        WARMUP.update(pid=os.getpid(), stage=None, plan=[], completed=[], error=None)
+        threading.Thread(target=_warmup, name='warmup', daemon=True).start()
+
+def wait_until_ready(timeout=None):
+    """Block until warm-up has finished (scripts and benchmarks); False on timeout"""
+    start_warmup()
+    return _WARMUP_READY.wait(timeout)
+
+@app.before_request
+def serve_fallback_until_ready():
+    if WARMUP['ready']:
+        return None
+    start_warmup()
+    fallback = WARMUP_FALLBACKS.get(request.path)
+    if fallback is None:
+        return None
+    response = app.response_class(fallback, mimetype='application/json')
+    response.headers['Retry-After'] = '5'
+    return response
+
+# ============================================================================
+# ADMISSION CONTROL
+# ============================================================================
+# When traffic spikes, requests wait in gunicorn's queue and the voice
+# agent's tool call times out while the caller sits in silence. Better to
+# answer at once with less. Every data route has a priority:
+#
+#   0  /recommend and the conversation-state endpoints: always served
+#   1  the other search-style routes: a cached degraded answer under overload
+#   2  landing and details pages: shed first (to the cached page)
+#
+# Once a worker is busy (ADMISSION_BUSY_INFLIGHT requests in flight, by
+# default half its threads), each route may only hold so many of its threads
+# (ROUTE_CONCURRENCY, by default half the threads for priority 1 and one for
+# priority 2); an idle worker serves anything. Each identified caller (email, conversation_id or X-Caller-Id) gets a
+# token bucket. Overload is read from queue time: the X-Request-Start stamp a
+# proxy puts on the request when it arrives (Heroku-style routers, nginx
+# `proxy_set_header X-Request-Start "t=${msec}"`). Clients can send the
+# header too, so it is only read with TRUST_REQUEST_START=1 (set it when the
+# proxy in front overwrites it), and stamps more than
+# REQUEST_START_MAX_SKEW seconds from now are ignored. As in CoDel, the
+# server is overloaded once the shortest queue time seen in a whole
+# ADMISSION_INTERVAL stays above ADMISSION_QUEUE_TARGET_MS. Intervals close
+# by the clock on any request, and one without stamped requests recovers.
+# Without trusted stamps only the limits apply.
+# Degraded answers (most popular stays) are serialized once at warm-up and
+# after live updates, so serving one costs no search.
+
+ROUTE_PRIORITY = {
+    '/recommend': 0, '/save-progress': 0, '/resume-conversation': 0, '/update-progress': 0, '/get-user-history': 0,
+    '/search': 1, '/experiences': 1, '/gallery': 1, '/inspiration': 1, '/similar': 1, '/facets': 1, '/deltas': 1,
+    '/': 2, '/details': 2
+}
+
+# Probes and scrapes are never shed
+ADMISSION_EXEMPT = {'/health', '/health/live', '/health/ready', '/metrics', '/favicon.ico'}
+
+# Request threads per worker (gunicorn's setting, also the limit for priority 0)
+ADMISSION_THREADS = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+def parse_route_limits(spec):
+    """Parse ROUTE_CONCURRENCY like '/search=4,/details=1'"""
+    limits = {}
+    for part in spec.split(','):
+        if '=' in part:
+            route, limit = part.split('=', 1)
+            try:
+                limits[route.strip()] = max(1, int(limit))
+            except ValueError:
+                continue
+    return limits
+
+ROUTE_CONCURRENCY = parse_route_limits(os.environ.get('ROUTE_CONCURRENCY', ''))
+PRIORITY_CONCURRENCY = {0: ADMISSION_THREADS, 1: max(1, ADMISSION_THREADS // 2), 2: 1}
+
+# Requests in flight (all routes) from which the per-route limits apply
+ADMISSION_BUSY_INFLIGHT = int(os.environ.get('ADMISSION_BUSY_INFLIGHT', str(max(1, ADMISSION_THREADS // 2))))
+
+# Requests per second per identified caller (0 = no limit), and the burst allowed
+CALLER_RATE_LIMIT = float(os.environ.get('CALLER_RATE_LIMIT', '5'))
+CALLER_BURST = float(os.environ.get('CALLER_BURST', '20'))
+CALLER_BUCKETS_MAX = 10000
+
+ADMISSION_QUEUE_TARGET_MS = float(os.environ.get('ADMISSION_QUEUE_TARGET_MS', '250'))
+ADMISSION_INTERVAL = float(os.environ.get('ADMISSION_INTERVAL', '1.0'))
+
+# Read X-Request-Start at all (only behind a proxy that sets it), and how far
+# from now a stamp may be before it is taken for a bad clock or a forgery
+TRUST_REQUEST_START = os.environ.get('TRUST_REQUEST_START', '0') == '1'
+REQUEST_START_MAX_SKEW = 300.0
+
+BUSY_MESSAGE = "We're a little busy right now. Please ask again in a moment."
+DEGRADED_MESSAGE = "We're a little busy right now, so here are our most popular stays."
+
+# Shed pages before the first cached copy exists
+BUSY_PAGE_HTML = ('<!DOCTYPE html><html><head><meta charset="UTF-8"><meta http-equiv="refresh" content="5">'
+                  f'<title>KABUK AI</title></head><body><p>{BUSY_MESSAGE}</p></body></html>')
+
+ADMISSION = {'overloaded': False, 'window_start': time.monotonic(), 'window_min': None}
+_ADMISSION_INFLIGHT = {}
+_ADMISSION_LOCK = threading.Lock()
+_CALLER_BUCKETS = {}
+
+# Serialized degraded answers per route (see build_degraded_responses())
+DEGRADED_RESPONSES = {}
+
+def request_queue_ms():
+    """Milliseconds between a trusted X-Request-Start stamp and now; None without a usable one"""
+    if not TRUST_REQUEST_START:
+        return None
+    value = request.headers.get('X-Request-Start', '')
+    try:
+        start = float(value[2:] if value.startswith('t=') else value)
+    except ValueError:
+        return None
+    if not math.isfinite(start):
+        return None
+    # Proxies stamp seconds, milliseconds or microseconds since the epoch
+    if start > 1e14:
+        start /= 1e6
+    elif start > 1e11:
+        start /= 1e3
+    waited = time.time() - start
+    if abs(waited) > REQUEST_START_MAX_SKEW:
+        return None
+    return max(0.0, waited * 1000.0)
+
+def observe_queue_time(queue_ms):
+    """Feed one queue time to the overload detector"""
+    with _ADMISSION_LOCK:
+        window_min = ADMISSION['window_min']
+        ADMISSION['window_min'] = queue_ms if window_min is None else min(window_min, queue_ms)
+
+def admission_overloaded():
+    """Whether the last closed interval's shortest queue time was over target (closing a due interval)"""
+    now = time.monotonic()
+    with _ADMISSION_LOCK:
+        if now - ADMISSION['window_start'] >= ADMISSION_INTERVAL:
+            window_min = ADMISSION['window_min']
+            ADMISSION['overloaded'] = window_min is not None and window_min > ADMISSION_QUEUE_TARGET_MS
+            ADMISSION.update(window_start=now, window_min=None)
+        return ADMISSION['overloaded']
+
+def request_caller():
+    """Who is calling, when the request says (email, conversation id or X-Caller-Id)"""
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        caller = data.get('email') or data.get('conversation_id')
+        if caller:
+            return str(caller)
+    return request.headers.get('X-Caller-Id')
+
+def caller_wait(caller):
+    """0 if the caller has a token left (and takes it), else seconds until they will"""
+    now = time.monotonic()
+    bucket = _CALLER_BUCKETS.get(caller)
+    if bucket is None:
+        if len(_CALLER_BUCKETS) >= CALLER_BUCKETS_MAX:
+            # Callers idle long enough to have refilled lose nothing by being forgotten
+            idle = now - CALLER_BURST / CALLER_RATE_LIMIT
+            for key in [k for k, b in _CALLER_BUCKETS.items() if b[1] < idle]:
+                _CALLER_BUCKETS.pop(key, None)
+        bucket = _CALLER_BUCKETS[caller] = [CALLER_BURST, now]
+    tokens = min(CALLER_BURST, bucket[0] + (now - bucket[1]) * CALLER_RATE_LIMIT)
+    bucket[1] = now
+    if tokens < 1:
+        bucket[0] = tokens
+        return (1 - tokens) / CALLER_RATE_LIMIT
+    bucket[0] = tokens - 1
+    return 0
+
+def count_admission(outcome, route):
+    inc_counter(f'admission:{outcome}:{route}')
+
+def shed_response(route, reason):
+    """The degraded answer for a route when it has one, else a fast 503"""
+    log_event(route, 'shed', reason=reason)
+    if route in ('/', '/details'):
+        # Pages are prebuilt: the cached copy costs no more than a refusal
+        page = CACHED_INDEX_HTML if route == '/' else CACHED_DETAILS_HTML
+        if page:
+            count_admission('degraded', route)
+            return app.response_class(page, mimetype='text/html')
+        count_admission('shed', route)
+        return app.response_class(BUSY_PAGE_HTML, status=503, mimetype='text/html', headers={'Retry-After': '1'})
+    degraded = DEGRADED_RESPONSES.get(route)
+    if degraded is not None:
+        count_admission('degraded', route)
+        return app.response_class(degraded, mimetype='application/json')
+    count_admission('shed', route)
+    response = jsonify({'success': False, 'overloaded': True, 'error': f'Server busy ({reason})',
+                        'message': BUSY_MESSAGE})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.before_request
+def admit_request():
+    route = request.url_rule.rule if request.url_rule else None
+    if route is None or route in ADMISSION_EXEMPT:
+        return None
+    priority = ROUTE_PRIORITY.get(route, 2)
+    queue_ms = request_queue_ms()
+    if queue_ms is not None:
+        observe_queue_time(queue_ms)
+
+    caller = request_caller() if CALLER_RATE_LIMIT > 0 else None
+    if caller:
+        wait = caller_wait(caller)
+        if wait:
+            count_admission('rate_limited', route)
+            response = jsonify({'success': False, 'error': 'Too many requests from this caller',
+                                'message': BUSY_MESSAGE})
+            response.headers['Retry-After'] = str(math.ceil(wait))
+            return response, 429
+
+    if admission_overloaded() and priority > 0:
+        return shed_response(route, 'overloaded')
+    limit = ROUTE_CONCURRENCY.get(route) or PRIORITY_CONCURRENCY[priority]
+    with _ADMISSION_LOCK:
+        busy = sum(_ADMISSION_INFLIGHT.values()) >= ADMISSION_BUSY_INFLIGHT
+        if busy and _ADMISSION_INFLIGHT.get(route, 0) >= limit:
+            admitted = False
+        else:
+            _ADMISSION_INFLIGHT[route] = _ADMISSION_INFLIGHT.get(route, 0) + 1
+            admitted = True
+    if not admitted:
+        return shed_response(route, 'concurrency limit')
+    g.admitted_route = route
+    return None
+
+@app.teardown_request
+def release_admission(exc):
+    route = g.pop('admitted_route', None)
+    if route is not None:
+        with _ADMISSION_LOCK:
+            _ADMISSION_INFLIGHT[route] -= 1
+
+# ============================================================================
+# INGESTION
+# ============================================================================
+# Stories come from one or more sources: the hafh_stories.json export at
+# DATA_PATH by default, or the list in the DATA_SOURCES file, e.g.
+#
+#   [{"path": "stories.parquet", "fields": {"description": "review_text"}},
+#    {"path": "properties.csv", "kind": "properties"}]
+#
+# Every reader streams its file in chunks (JSON arrays included), so a large
+# warehouse export never has to be parsed in one piece. "fields" maps story
+# fields onto source columns (a list means the first non-empty column wins)
+# over DEFAULT_FIELD_MAP. "properties" sources are joined onto stories by
+# property key (pid) and their name, prefecture and country win; a story
+# id seen again in a later source replaces the earlier one.
+
+# Rows per chunk handed from a reader to the mapping step, and bytes per read
+INGEST_CHUNK_ROWS = 5000
+INGEST_READ_BYTES = 1 << 20
+
+# Story field -> source columns, first non-empty wins (the hafh_stories export)
+DEFAULT_FIELD_MAP = {
+    'tsid': ['tsid'],
+    'pid': ['pid'],
+    'name': ['name'],
+    'prefecture': ['prefecture'],
+    'country': ['country'],
+    'description': ['ts_stay_text', 'ts_text'],
+    'likes': ['likes_count']
+}
+
+# Fields a "properties" source can set on the stories it joins onto
+PROPERTY_SOURCE_FIELDS = ('name', 'prefecture', 'country')
+
+SOURCE_FORMATS = {'.json': 'json', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv', '.tsv': 'tsv',
+                  '.parquet': 'parquet', '.pq': 'parquet'}
+
+class IngestError(ValueError):
+    """A data source that can't be read as configured"""
+
+def _chunked(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= INGEST_CHUNK_ROWS:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def read_json_array(path):
+    """Chunks of objects from a JSON array file, decoded as the bytes arrive"""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        def objects():
+            # consumed: characters of the file before buffer[0], for error positions
+            buffer, pos, started, consumed = '', 0, False, 0
+            while True:
+                data = f.read(INGEST_READ_BYTES)
+                consumed += pos
+                buffer = buffer[pos:] + data
+                pos = 0
+                while True:
+                    while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == ','
+                                                 or (buffer[pos] == '[' and not started)):
+                        started = started or buffer[pos] == '['
+                        pos += 1
+                    if pos >= len(buffer) or buffer[pos] == ']':
+                        break
+                    try:
+                        obj, end = decoder.raw_decode(buffer, pos)
+                    except ValueError:
+                        if not data:
+                            raise IngestError(f"{path}: malformed JSON near character {consumed + pos}")
+                        break  # the object continues in the next read
+                    pos = end
+                    yield obj
+                if pos < len(buffer) and buffer[pos] == ']':
+                    return
+                if not data:
+                    if started:
+                        raise IngestError(f"{path}: file ends before the closing ']' (truncated?)")
+                    return
+        yield from _chunked(objects())
+
+def read_jsonl(path):
+    """Chunks of objects from a JSON-lines file (malformed lines skipped)"""
+    def objects():
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+    return _chunked(objects())
+
+def read_csv(path, delimiter=','):
+    """Chunks of row dicts from a CSV file with a header row"""
+    def rows():
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            yield from csv.DictReader(f, delimiter=delimiter)
+    return _chunked(rows())
+
+def read_parquet(path, columns=None):
+    """Chunks of row dicts from a Parquet file, one record batch at a time (needs pyarrow)"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise IngestError(f"{path}: reading Parquet needs pyarrow (pip install pyarrow)")
+    parquet = pq.ParquetFile(path)
+    present = [c for c in columns if c in parquet.schema_arrow.names] if columns else None
+    for batch in parquet.iter_batches(batch_size=INGEST_CHUNK_ROWS, columns=present):
+        yield batch.to_pylist()
+
+def source_chunks(source):
+    """Chunks of raw rows from one source"""
+    fmt = source['format']
+    if fmt == 'json':
+        return read_json_array(source['path'])
+    if fmt == 'jsonl':
+        return read_jsonl(source['path'])
+    if fmt in ('csv', 'tsv'):
+        return read_csv(source['path'], '\t' if fmt == 'tsv' else ',')
+    columns = sorted({c for cols in source['fields'].values() for c in cols})
+    return read_parquet(source['path'], columns)
+
+def data_sources():
+    """The configured sources with format, kind and field map filled in"""
+    if not DATA_SOURCES:
+        specs, base = [{'path': DATA_PATH}], ''
+    else:
+        with open(DATA_SOURCES, 'r', encoding='utf-8') as f:
+            specs = json.load(f)
+        base = os.path.dirname(DATA_SOURCES)
+        if not isinstance(specs, list) or not all(isinstance(spec, dict) and spec.get('path') for spec in specs):
+            raise IngestError(f"{DATA_SOURCES}: expected a list of {{\"path\": ...}} objects")
+    sources = []
+    for spec in specs:
+        path = os.path.join(base, spec['path'])
+        fmt = spec.get('format') or SOURCE_FORMATS.get(os.path.splitext(path)[1].lower())
+        if fmt not in ('json', 'jsonl', 'csv', 'tsv', 'parquet'):
+            raise IngestError(f"{path}: unknown format {fmt!r}")
+        kind = spec.get('kind', 'stories')
+        if kind not in ('stories', 'properties'):
+            raise IngestError(f"{path}: kind must be 'stories' or 'properties'")
+        fields = dict(DEFAULT_FIELD_MAP)
+        for field, columns in (spec.get('fields') or {}).items():
+            if field not in DEFAULT_FIELD_MAP:
+                raise IngestError(f"{path}: unknown field {field!r}")
+            fields[field] = columns if isinstance(columns, list) else [columns]
+        sources.append({'path': path, 'format': fmt, 'kind': kind, 'fields': fields})
+    return sources
+
+def _column(row, columns):
+    """First non-empty value among columns, else None"""
+    for column in columns:
+        value = row.get(column)
+        if value is not None and value != '':
+            return value
+    return None
+
+def map_story(row, fields, joined):
+    """Story record from one source row, with its property's joined fields; None if unusable"""
+    if not isinstance(row, dict):
+        return None
+    try:
+        record = {
+            'tsid': str(_column(row, fields['tsid']) or ''),
+            'pid': str(_column(row, fields['pid']) or ''),
+            'name': _column(row, fields['name']) or '',
+            'prefecture': _column(row, fields['prefecture']) or '',
+            'country': _column(row, fields['country']) or 'JP',
+            'description': str(_column(row, fields['description']) or ''),
+            'likes': int(float(_column(row, fields['likes']) or 0))
+        }
+    except (TypeError, ValueError):
+        return None
+    if record['pid'] in joined:
+        record.update(joined[record['pid']])
+    if not record['name'] or record['name'] == 'Unknown Property':
+        return None
+    return record
+
+def ingest_stories(sources):
+    """Stream every source, join property sources by pid and return the story records"""
+    joined = {}
+    for source in sources:
+        if source['kind'] == 'properties':
+            fields = source['fields']
+            bad = 0
+            for chunk in source_chunks(source):
+                for row in chunk:
+                    # JSON sources can hold nulls, numbers or lists where rows belong
+                    if not isinstance(row, dict):
+                        bad += 1
+                        continue
+                    pid = str(_column(row, fields['pid']) or '')
+                    if pid:
+                        values = {f: _column(row, fields[f]) for f in PROPERTY_SOURCE_FIELDS}
+                        joined.setdefault(pid, {}).update((f, v) for f, v in values.items() if v is not None)
+            print(f"✅ Joined {len(joined)} properties from {source['path']}")
+            if bad:
+                print(f"⚠️  Skipped {bad} unusable rows in {source['path']}")
+
+    stories = []
+    by_tsid = {}
+    for source in sources:
+        if source['kind'] != 'stories':
+            continue
+        read = bad = 0
+        for chunk in source_chunks(source):
+            for row in chunk:
+                record = map_story(row, source['fields'], joined)
+                if record is None:
+                    bad += 1
+                    continue
+                read += 1
+                # The same story in a later source replaces the earlier copy
+                if record['tsid'] and record['tsid'] in by_tsid:
+                    stories[by_tsid[record['tsid']]] = record
+                    continue
+                if record['tsid']:
+                    by_tsid[record['tsid']] = len(stories)
+                stories.append(record)
+        if len(sources) > 1:
+            print(f"✅ Read {read} stories from {source['path']}")
+        if bad:
+            print(f"⚠️  Skipped {bad} unusable rows in {source['path']}")
+    return stories
+
+def load_sample_data(workers=1, strict=False):
+    """
+    Load ALL stories from the configured sources and group them into properties.
+
+    The server falls back to two sample stories when the sources can't be
+    read; with strict (build-index) a bad or empty source raises IngestError.
+    """
+    global PROPERTIES, STORIES, THEME_FLAGS, STORY_THEME_FLAGS, STORY_SENTENCES, SENTENCE_ENDS, SENTENCE_FLAGS
+    warmup_stage('stories')
+    stories = []
+    try:
+        stories = ingest_stories(data_sources())
+        if strict and not stories:
+            raise IngestError('no usable stories in the configured sources')
+        print(f"✅ Loaded {len(stories)} stories")
+    except Exception as e:
+        if strict:
+            raise e if isinstance(e, IngestError) else IngestError(str(e))
+        print(f"⚠️  Could not load data: {e}")
+        # Fallback sample data
+        stories = [
+            {
+                'tsid': 'sample_1',
+                'pid': 'sample_1',
+                'name': 'Mountain Retreat Nagano',
+                'prefecture': 'Nagano',
+                'country': 'JP',
+                'description': 'Peaceful mountain property with stunning views. Guests love the serene atmosphere.',
+                'likes': 45
+            },
+            {
+                'tsid': 'sample_2',
+                'pid': 'sample_2',
+                'name': 'Kyoto Traditional Guesthouse',
+                'prefecture': 'Kyoto',
+                'country': 'JP',
+                'description': 'Authentic Japanese experience in historic Kyoto. Traditional architecture and warm hospitality.',
+                'likes': 38
+            }
+        ]
+
+    STORIES = stories
+    warmup_stage('properties')
+    PROPERTIES = aggregate_properties(STORIES)
+    print(f"✅ Grouped into {len(PROPERTIES)} properties")
+    warmup_stage('normalize')
+    (THEME_FLAGS, STORY_THEME_FLAGS, STORY_SENTENCES, SENTENCE_ENDS,
+     SENTENCE_FLAGS) = normalize_properties(PROPERTIES, STORIES, workers)
+
+def aggregate_properties(stories):
+    """
+    Group stories into one entity per property.
+
+    Keyed by pid (name + prefecture when the export has no pid). Each entity
+    carries total likes, story count, the most-liked story's text as its
+    description, and offsets into STORIES ordered by likes.
+    """
+    entities = []
+    by_key = {}
+    for offset, story in enumerate(stories):
+        key = story_key(story)
+        entity = by_key.get(key)
+        if entity is None:
+            entity = by_key[key] = {
+                'pid': story['pid'] or story['tsid'] or key,
+                'name': story['name'],
+                'prefecture': story['prefecture'],
+                'country': story['country'],
+                'likes': 0,
+                'stories': []
+            }
+            entities.append(entity)
+        entity['likes'] += story['likes']
+        entity['stories'].append(offset)
+
+    for entity in entities:
+        entity['stories'].sort(key=lambda o: stories[o]['likes'], reverse=True)
+        entity['story_count'] = len(entity['stories'])
+        representative = next((stories[o] for o in entity['stories'] if stories[o]['description']),
+                              stories[entity['stories'][0]])
+        entity['description'] = representative['description']
+    return entities
+
+def story_key(story):
+    """Key of the property a story belongs to: pid, or name + prefecture when the export has none"""
+    return story['pid'] or f"{story['name']}|{story['prefecture']}"
+
+# ============================================================================
+# INDEXES
+# ============================================================================
+# Everything here is derived from PROPERTIES once, after loading, so request
+# handlers only do lookups.
+
+# Cores used for load-time index building (pools only start for large datasets)
+INDEX_WORKERS = int(os.environ.get('INDEX_WORKERS', '0')) or os.cpu_count() or 1
+
+# Serial below this many items; pool start-up costs more than it saves
+PARALLEL_MIN_ITEMS = 5000
+PARALLEL_CHUNK = 500
+
+# Inputs for parallel_map() workers, inherited through fork (set just before the pool starts)
+PARALLEL_INPUT = {}
+
+def parallel_map(fn, n, workers, **inputs):
+    """
+    Run fn over (start, end) chunks of range(n) and return the results in order.
+
+    fn reads its data from PARALLEL_INPUT, which forked pool workers inherit,
+    so large inputs are never pickled. Falls back to a plain loop for small
+    inputs, workers=1 or platforms without fork.
+    """
+    PARALLEL_INPUT.update(inputs)
+    try:
+        bounds = [(start, min(n, start + PARALLEL_CHUNK)) for start in range(0, n, PARALLEL_CHUNK)]
+        if workers > 1 and n >= PARALLEL_MIN_ITEMS and 'fork' in multiprocessing.get_all_start_methods():
+            with multiprocessing.get_context('fork').Pool(workers) as pool:
+                return pool.map(fn, bounds)
+        return [fn(b) for b in bounds]
+    finally:
+        PARALLEL_INPUT.clear()
+
+def build_indexes(workers=1):
+    """Build all load-time indexes over PROPERTIES"""
+    global POPULAR_ORDER, SPELL_INDEX, DATASET_VERSION, MINHASH_INDEX, KNN_INDEX
+    global PREFECTURE_INDEX, PLACE_PREFECTURE, FACET_INDEX, FACET_ALIASES, TERM_POSTINGS, TERM_OFFSETS
+    DATASET_VERSION = compute_dataset_version()
+    # Precompute popularity order so top-N lookups never re-sort
+    POPULAR_ORDER = sorted(range(len(PROPERTIES)), key=lambda i: PROPERTIES[i]['likes'], reverse=True)
+    PREFECTURE_INDEX, PLACE_PREFECTURE = build_prefecture_index(PROPERTIES, POPULAR_ORDER)
+    warmup_stage('spelling')
+    SPELL_INDEX = build_spell_index(PROPERTIES, workers)
+    warmup_stage('minhash')
+    MINHASH_INDEX = build_minhash_index(PROPERTIES, workers)
+    warmup_stage('facets')
+    FACET_INDEX, FACET_ALIASES, TERM_POSTINGS, TERM_OFFSETS = build_facet_index(PROPERTIES, THEME_FLAGS, workers)
+    build_derived_indexes()
+    warmup_stage('knn')
+    KNN_INDEX = build_knn_index(PROPERTIES, workers)
+    print(f"✅ Indexes built ({len(SPELL_INDEX['terms'])} spelling terms)")
+
+def build_derived_indexes():
+    """Lookups rebuilt in O(n) whether indexes were built or loaded from an artifact"""
+    global PID_INDEX, POPULAR_NEG_LIKES, QUERY_AUTOMATON, THEME_POSTINGS
+    global PROPERTY_KEYS, STORY_INDEX, TERM_DELTA, NAME_INDEX
+    PID_INDEX = {prop['pid']: i for i, prop in enumerate(PROPERTIES)}
+    NAME_INDEX = {}
+    for i, prop in enumerate(PROPERTIES):
+        if prop['search_name']:
+            NAME_INDEX.setdefault(prop['search_name'], i)
+    PROPERTY_KEYS = {story_key(STORIES[prop['stories'][0]]): i for i, prop in enumerate(PROPERTIES)}
+    STORY_INDEX = {story['tsid']: o for o, story in enumerate(STORIES) if story['tsid']}
+    TERM_DELTA = {}
+    THEME_POSTINGS = build_theme_postings(THEME_FLAGS, POPULAR_ORDER)
+    POPULAR_NEG_LIKES = array('i', (-PROPERTIES[i]['likes'] for i in POPULAR_ORDER))
+    QUERY_AUTOMATON = build_query_automaton()
+
+def compute_dataset_version():
+    """Short hash of the source files' identity and property count (same in every worker)"""
+    try:
+        parts = []
+        for source in data_sources():
+            stat = os.stat(source['path'])
+            parts.append(f"{os.path.abspath(source['path'])}:{stat.st_size}:{stat.st_mtime_ns}")
+        identity = f"{'|'.join(parts)}:{len(PROPERTIES)}"
+    except (OSError, ValueError):
+        identity = f"fallback:{len(PROPERTIES)}"
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()[:12]
+
+def tokenize(text):
+    """Latin-script word tokens of already-normalized text"""
+    return re.findall(r'[a-z0-9]+', text)
+
+# ----------------------------------------------------------------------------
+# Text normalization
+# ----------------------------------------------------------------------------
+# Stories mix full/half-width characters, katakana/hiragana and romanized
+# names with or without macrons ("Nikkō", "Nikko"). Each property gets
+# normalized copies of its searchable fields once at load time, and queries
+# go through the same normalize_text(), so matching stays a plain substring
+# test with no per-request cost.
+
+# Build a romaji column from kana in property names (ROMAJI_COLUMN=0 to skip)
+ROMAJI_COLUMN = os.environ.get('ROMAJI_COLUMN', '1') == '1'
+
+# Macron/circumflex vowels used in romanized Japanese
+_MACRON_TABLE = str.maketrans('āēīōūâêîôûĀĒĪŌŪÂÊÎÔÛ', 'aeiouaeiouaeiouaeiou')
+
+# Long-vowel marks and the dash variants speech-to-text and IMEs produce
+_LONG_VOWEL_RE = re.compile('[ー〜～‐―−]')
+
+def _fold_katakana(text):
+    """Map katakana (ァ..ヶ) to the matching hiragana"""
+    return ''.join(chr(ord(c) - 0x60) if 'ァ' <= c <= 'ヶ' else c for c in text)
+
+def normalize_text(text):
+    """NFKC, lowercase, katakana -> hiragana, macrons and long-vowel marks removed"""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = _fold_katakana(text).translate(_MACRON_TABLE)
+    return _LONG_VOWEL_RE.sub('', text)
+
+_KANA_ROMAJI = dict(zip(
+    'あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもやゆよらりるれろわをん'
+    'がぎぐげござじずぜぞだぢづでどばびぶべぼぱぴぷぺぽぁぃぅぇぉゃゅょ',
+    ['a', 'i', 'u', 'e', 'o', 'ka', 'ki', 'ku', 'ke', 'ko', 'sa', 'shi', 'su', 'se', 'so',
+     'ta', 'chi', 'tsu', 'te', 'to', 'na', 'ni', 'nu', 'ne', 'no', 'ha', 'hi', 'fu', 'he', 'ho',
+     'ma', 'mi', 'mu', 'me', 'mo', 'ya', 'yu', 'yo', 'ra', 'ri', 'ru', 're', 'ro', 'wa', 'o', 'n',
+     'ga', 'gi', 'gu', 'ge', 'go', 'za', 'ji', 'zu', 'ze', 'zo', 'da', 'ji', 'zu', 'de', 'do',
+     'ba', 'bi', 'bu', 'be', 'bo', 'pa', 'pi', 'pu', 'pe', 'po', 'a', 'i', 'u', 'e', 'o',
+     'ya', 'yu', 'yo']
+))
+
+def kana_to_romaji(text):
+    """
+    Hepburn romaji for hiragana in normalized text, long vowels written
+    without macrons the way place names are (きょうと -> kyoto, おおさか ->
+    osaka); other characters pass through
+    """
+    out = []
+    double_next = False
+    after_kana = False
+    for c in text:
+        if c == 'っ':
+            double_next = True
+            continue
+        romaji = _KANA_ROMAJI.get(c)
+        previous_kana, after_kana = after_kana, romaji is not None
+        if romaji is None:
+            out.append(c)
+        elif previous_kana and (c == 'う' and out[-1].endswith(('o', 'u')) or c == 'お' and out[-1].endswith('o')):
+            # Long vowels ou, oo and uu: Ō/Ū with the macron dropped
+            pass
+        elif c in 'ゃゅょ' and out and out[-1].endswith('i') and len(out[-1]) > 1:
+            # Contracted sounds: きゃ -> kya, しゃ -> sha, ちゃ -> cha
+            stem = out[-1][:-1]
+            out[-1] = stem + romaji[1:] if stem.endswith(('sh', 'ch', 'j')) else stem + romaji
+        else:
+            out.append(romaji[0] + romaji if double_next and romaji[0] not in 'aiueon' else romaji)
+        double_next = False
+    return ''.join(out)
+
+# Fields returned to callers; search_* and other derived keys stay internal
+PUBLIC_PROPERTY_FIELDS = ('pid', 'name', 'prefecture', 'country', 'description', 'likes', 'story_count')
+
+def public_property(prop):
+    """Copy of a property without internal index fields"""
+    return {k: prop[k] for k in PUBLIC_PROPERTY_FIELDS if k in prop}
+
+def _normalize_rows(bounds):
+    """(normalized search fields, [(sentence ends, sentence flags)] per story) for properties[start:end]"""
+    properties, stories = PARALLEL_INPUT['properties'], PARALLEL_INPUT['stories']
+    rows = []
+    for prop in properties[bounds[0]:bounds[1]]:
+        texts = []
+        sentences = []
+        for o in prop['stories']:
+            ends, flags, text = split_story(stories[o]['description'])
+            texts.append(text)
+            sentences.append((ends, flags))
+        fields = {
+            'search_name': normalize_text(prop['name']),
+            'search_prefecture': normalize_text(prop['prefecture']),
+            # All of a property's stories are searchable, not just the representative one
+            'search_description': '\n'.join(texts)
+        }
+        if ROMAJI_COLUMN:
+            romaji = kana_to_romaji(fields['search_name'])
+            fields['search_romaji'] = romaji if romaji != fields['search_name'] else ''
+        rows.append((fields, sentences))
+    return rows
+
+def normalize_properties(properties, stories, workers=1):
+    """
+    Store normalized search fields on every property (search_* keys).
+
+    Returns theme flags per property and per story (see tag_text()) and the
+    sentence tables (STORY_SENTENCES, SENTENCE_ENDS, SENTENCE_FLAGS).
+    """
+    chunks = parallel_map(_normalize_rows, len(properties), workers, properties=properties, stories=stories)
+    theme_flags = array('I', bytes(4 * len(properties)))
+    story_flags = array('I', bytes(4 * len(stories)))
+    by_story = [None] * len(stories)
+    rows = (row for rows in chunks for row in rows)
+    for i, (prop, (fields, sentences)) in enumerate(zip(properties, rows)):
+        prop.update(fields)
+        merged = tag_text(fields['search_name'])
+        for offset, (ends, flags) in zip(prop['stories'], sentences):
+            by_story[offset] = (ends, flags)
+            for f in flags:
+                story_flags[offset] |= f
+            merged |= story_flags[offset]
+        theme_flags[i] = merged
+
+    story_sentences, sentence_ends, sentence_flags = array('I'), array('I'), array('I')
+    for ends, flags in by_story:
+        story_sentences.append(len(sentence_ends))
+        sentence_ends.extend(ends)
+        sentence_flags.extend(flags)
+    story_sentences.append(len(sentence_ends))
+    return theme_flags, story_flags, story_sentences, sentence_ends, sentence_flags
+
+# ----------------------------------------------------------------------------
+# Typo tolerance (symmetric delete spelling correction)
+# ----------------------------------------------------------------------------
+# Speech-to-text mangles place names ("Hakoneh", "Nikk"). Every vocabulary
+# term is indexed under all strings reachable by deleting up to
+# SPELL_MAX_DISTANCE characters from its prefix; a misspelled query term
+# generates its own deletes and looks them up, so a correction costs a few
+# dict lookups instead of an edit-distance pass over every property.
+
+SPELL_MAX_DISTANCE = 2
+SPELL_PREFIX_LENGTH = 7
+SPELL_MIN_TERM_LENGTH = 3
+# Name and prefecture words outrank description words on ties
+SPELL_PLACE_WEIGHT = 100
+
+SPELL_INDEX = {'terms': {}, 'deletes': {}}
+
+def _deletes(term, max_distance):
+    """All strings reachable by deleting up to max_distance characters"""
+    results = {term}
+    frontier = {term}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for word in frontier:
+            if len(word) <= 1:
+                continue
+            for i in range(len(word)):
+                next_frontier.add(word[:i] + word[i + 1:])
+        results |= next_frontier
+        frontier = next_frontier
+    return results
+
+def edit_distance(a, b, max_distance):
+    """Damerau-Levenshtein (optimal string alignment) distance, capped at max_distance + 1"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = current[0]
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+            row_min = min(row_min, current[j])
+        if row_min > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+def _count_terms(bounds):
+    """Weighted vocabulary counts for properties[start:end]"""
+    terms = {}
+    for prop in PARALLEL_INPUT['properties'][bounds[0]:bounds[1]]:
+        place_tokens = tokenize(prop['search_name']) + tokenize(prop['search_prefecture'])
+        if prop.get('search_romaji'):
+            place_tokens += tokenize(prop['search_romaji'])
+        for token in place_tokens:
+            terms[token] = terms.get(token, 0) + SPELL_PLACE_WEIGHT
+        for token in tokenize(prop['search_description']):
+            terms[token] = terms.get(token, 0) + 1
+    return terms
+
+def build_spell_index(properties, workers=1):
+    """Vocabulary with frequencies plus the prefix-delete lookup table"""
+    terms = {}
+    for counts in parallel_map(_count_terms, len(properties), workers, properties=properties):
+        for token, n in counts.items():
+            terms[token] = terms.get(token, 0) + n
+    # Drop digits-only and very short tokens; they only add false corrections
+    terms = {t: n for t, n in terms.items()
+             if len(t) >= SPELL_MIN_TERM_LENGTH and not t.isdigit()}
+
+    deletes = {}
+    for term in terms:
+        for deleted in _deletes(term[:SPELL_PREFIX_LENGTH], SPELL_MAX_DISTANCE):
+            bucket = deletes.get(deleted)
+            if bucket is None:
+                deletes[deleted] = [term]
+            else:
+                bucket.append(term)
+    return {'terms': terms, 'deletes': deletes}
+
+def correct_term(term):
+    """Closest vocabulary term within SPELL_MAX_DISTANCE, or the term itself"""
+    terms = SPELL_INDEX['terms']
+    if term in terms or len(term) < SPELL_MIN_TERM_LENGTH or term.isdigit():
+        return term
+    # A prefecture with no stays is still a real place: leave it to the nearby fallback
+    if term in PREFECTURE_ALIASES:
+        return term
+    best, best_distance, best_count = term, SPELL_MAX_DISTANCE + 1, 0
+    seen = set()
+    for deleted in _deletes(term[:SPELL_PREFIX_LENGTH], SPELL_MAX_DISTANCE):
+        for candidate in SPELL_INDEX['deletes'].get(deleted, ()):
+            if candidate in seen:
+                continue
+            seen.add(candidate)
+            distance = edit_distance(term, candidate, SPELL_MAX_DISTANCE)
+            count = terms[candidate]
+            if distance < best_distance or (distance == best_distance and count > best_count):
+                best, best_distance, best_count = candidate, distance, count
+    return best
+
+def correct_query(text):
+    """Replace unknown latin-script words in normalized text with their closest vocabulary term"""
+    if not text:
+        return text
+    return re.sub(r'[a-z0-9]+', lambda m: correct_term(m.group(0)), text)
+
+# ----------------------------------------------------------------------------
+# Near-duplicate detection (MinHash + LSH)
+# ----------------------------------------------------------------------------
+# Many stories are near copies of each other, so result lists can read the
+# same three times. Each property's description gets a MinHash signature at
+# load (one-permutation hashing over byte 8-grams, densified) and one LSH
+# bucket key per band. A result is skipped when it shares a bucket with an
+# item already picked and their estimated Jaccard similarity is above
+# DIVERSITY_THRESHOLD, which costs MINHASH_BANDS lookups per candidate.
+
+MINHASH_BINS = 32
+MINHASH_BANDS = 8  # 4 rows per band: buckets collide from roughly 0.6 similarity
+MINHASH_SHINGLE_BYTES = 8
+# Near duplicates share their opening; hashing more text only slows loading
+MINHASH_MAX_BYTES = 2048
+DIVERSITY_THRESHOLD = float(os.environ.get('DIVERSITY_THRESHOLD', '0.6'))
+# Popularity lists stop looking for distinct items after this many candidates
+DIVERSITY_SCAN_LIMIT = 200
+
+_MINHASH_EMPTY = 0xFFFFFFFF
+
+# Flat arrays indexed by property: signatures[i*BINS:(i+1)*BINS], bands[i*BANDS:(i+1)*BANDS]
+MINHASH_INDEX = {'signatures': array('I'), 'bands': array('q')}
+
+def minhash_signature(text):
+    """One-permutation MinHash of a text's byte shingles (list of MINHASH_BINS ints)"""
+    data = ' '.join(text.split()).encode('utf-8')[:MINHASH_MAX_BYTES]
+    bins = MINHASH_BINS
+    signature = [_MINHASH_EMPTY] * bins
+    if not data:
+        return signature
+    crc32 = zlib.crc32
+    for i in range(max(1, len(data) - MINHASH_SHINGLE_BYTES + 1)):
+        h = crc32(data[i:i + MINHASH_SHINGLE_BYTES])
+        b = h % bins
+        v = h // bins
+        if v < signature[b]:
+            signature[b] = v
+    # Densify: an empty bin borrows the next filled bin to its right, offset by distance
+    filled = [b for b in range(bins) if signature[b] != _MINHASH_EMPTY]
+    if len(filled) < bins:
+        dense = list(signature)
+        for b in range(bins):
+            if signature[b] == _MINHASH_EMPTY:
+                distance = next(d for d in range(1, bins + 1) if signature[(b + d) % bins] != _MINHASH_EMPTY)
+                dense[b] = (signature[(b + distance) % bins] + distance * 0x0FFFFFFF) & _MINHASH_EMPTY
+        signature = dense
+    return signature
+
+def band_keys(signature):
+    """LSH bucket id for each band of a signature"""
+    rows = MINHASH_BINS // MINHASH_BANDS
+    return [hash((band,) + tuple(signature[band * rows:(band + 1) * rows])) for band in range(MINHASH_BANDS)]
+
+def _minhash_rows(bounds):
+    """Flat signatures and band keys for properties[start:end]"""
+    signatures = array('I')
+    bands = array('q')
+    for prop in PARALLEL_INPUT['properties'][bounds[0]:bounds[1]]:
+        signature = minhash_signature(prop['description'])
+        signatures.extend(signature)
+        bands.extend(band_keys(signature))
+    return signatures, bands
+
+def build_minhash_index(properties, workers=1):
+    """Signatures and band keys for every property's description"""
+    signatures = array('I')
+    bands = array('q')
+    for chunk_signatures, chunk_bands in parallel_map(_minhash_rows, len(properties), workers,
+                                                      properties=properties):
+        signatures.extend(chunk_signatures)
+        bands.extend(chunk_bands)
+    return {'signatures': signatures, 'bands': bands}
+
+def estimated_similarity(a, b):
+    """Estimated Jaccard similarity of two properties from their signatures"""
+    sigs = MINHASH_INDEX['signatures']
+    offset_a, offset_b = a * MINHASH_BINS, b * MINHASH_BINS
+    same = sum(1 for k in range(MINHASH_BINS) if sigs[offset_a + k] == sigs[offset_b + k])
+    return same / MINHASH_BINS
+
+def new_diversity_filter():
+    """Per-request state for admit_diverse(): LSH bucket -> picked property indices"""
+    return {}
+
+def admit_diverse(picked_buckets, i, threshold=None):
+    """
+    True if property i is not a near duplicate of anything picked so far
+    (and records it as picked); False if it should be skipped.
+    """
+    threshold = DIVERSITY_THRESHOLD if threshold is None else threshold
+    bands = MINHASH_INDEX['bands']
+    if len(bands) < (i + 1) * MINHASH_BANDS:
+        return True  # index not built for this property
+    keys = bands[i * MINHASH_BANDS:(i + 1) * MINHASH_BANDS]
+    checked = set()
+    for key in keys:
+        for other in picked_buckets.get(key, ()):
+            if other not in checked:
+                checked.add(other)
+                if estimated_similarity(i, other) >= threshold:
+                    return False
+    for key in keys:
+        picked_buckets.setdefault(key, []).append(i)
+    return True
+
+# ----------------------------------------------------------------------------
+# "More like this" (k-nearest-neighbour graph)
+# ----------------------------------------------------------------------------
+# Each property becomes a sparse TF-IDF vector over latin words and CJK
+# character bigrams of its stories. Neighbours are found through an inverted
+# index (very common terms are skipped), scored by cosine similarity plus a
+# same-prefecture and popularity bonus, and the top KNN_K are stored as flat
+# int32/float32 arrays, so /similar is an O(k) slice. Large datasets are
+# scored in a multiprocessing pool across all cores.
+
+KNN_K = 10
+KNN_TERMS_PER_DOC = 32
+KNN_PREFECTURE_BONUS = 0.15
+KNN_POPULARITY_BONUS = 0.05
+
+KNN_INDEX = {'k': KNN_K, 'neighbors': array('i'), 'scores': array('f')}
+
+_CJK_RUN_RE = re.compile(r'[\u3040-\u30ff\u3400-\u9fff]+')
+
+def knn_terms(text):
+    """Latin words and CJK character bigrams of normalized text"""
+    terms = [t for t in tokenize(text) if len(t) >= 3 and not t.isdigit()]
+    for run in _CJK_RUN_RE.findall(text):
+        terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+def build_knn_vectors(properties):
+    """Unit-length sparse vectors (term id -> weight), top terms only"""
+    term_ids = {}
+    doc_counts = []
+    raw = []
+    for prop in properties:
+        counts = {}
+        for term in knn_terms(prop['search_description']):
+            term_id = term_ids.get(term)
+            if term_id is None:
+                term_id = term_ids[term] = len(term_ids)
+                doc_counts.append(0)
+            counts[term_id] = counts.get(term_id, 0) + 1
+        for term_id in counts:
+            doc_counts[term_id] += 1
+        raw.append(counts)
+
+    n = len(properties)
+    vectors = []
+    for counts in raw:
+        weighted = [(tid, (1 + math.log(tf)) * math.log((n + 1) / (doc_counts[tid] + 1)))
+                    for tid, tf in counts.items()]
+        weighted = heapq.nlargest(KNN_TERMS_PER_DOC, weighted, key=lambda x: x[1])
+        norm = math.sqrt(sum(w * w for _, w in weighted)) or 1.0
+        vectors.append({tid: w / norm for tid, w in weighted if w > 0})
+    return vectors
+
+def _knn_rows(bounds):
+    """Neighbour lists for properties[start:end] (runs in pool workers too)"""
+    start, end = bounds
+    vectors = PARALLEL_INPUT['vectors']
+    postings = PARALLEL_INPUT['postings']
+    prefectures = PARALLEL_INPUT['prefectures']
+    popularity = PARALLEL_INPUT['popularity']
+    rows = []
+    for i in range(start, end):
+        scores = {}
+        for tid, w in vectors[i].items():
+            for j, wj in postings.get(tid, ()):
+                if j != i:
+                    scores[j] = scores.get(j, 0.0) + w * wj
+        ranked = heapq.nlargest(KNN_K, (
+            (score + (KNN_PREFECTURE_BONUS if prefectures[j] == prefectures[i] else 0.0)
+             + KNN_POPULARITY_BONUS * popularity[j], j)
+            for j, score in scores.items()))
+        rows.append(ranked)
+    return rows
+
+def build_knn_index(properties, workers=1):
+    """k-NN graph over properties as flat neighbour/score arrays (-1 = no neighbour)"""
+    n = len(properties)
+    vectors = build_knn_vectors(properties)
+    # Terms in more than 5% of properties say little about similarity
+    max_posting = max(50, n // 20)
+    postings = {}
+    for i, vector in enumerate(vectors):
+        for tid, w in vector.items():
+            postings.setdefault(tid, []).append((i, w))
+    postings = {tid: plist for tid, plist in postings.items() if len(plist) <= max_posting}
+    max_log_likes = math.log1p(max((p['likes'] for p in properties), default=0)) or 1.0
+
+    chunks = parallel_map(
+        _knn_rows, n, workers,
+        vectors=vectors,
+        postings=postings,
+        prefectures=[p['prefecture'] for p in properties],
+        popularity=[math.log1p(p['likes']) / max_log_likes for p in properties]
+    )
+
+    neighbors = array('i', [-1]) * (n * KNN_K)
+    scores = array('f', [0.0]) * (n * KNN_K)
+    i = 0
+    for rows in chunks:
+        for ranked in rows:
+            for slot, (score, j) in enumerate(ranked):
+                neighbors[i * KNN_K + slot] = j
+                scores[i * KNN_K + slot] = score
+            i += 1
+    return {'k': KNN_K, 'neighbors': neighbors, 'scores': scores}
+
+def nearest_neighbors(i, limit=KNN_K):
+    """(property index, score) pairs for property i, best first"""
+    k = KNN_INDEX['k']
+    base = i * k
+    neighbors = KNN_INDEX['neighbors'][base:base + min(limit, k)]
+    scores = KNN_INDEX['scores'][base:base + min(limit, k)]
+    # Properties emptied by live updates stay in the graph until the next load
+    return [(j, score) for j, score in zip(neighbors, scores) if j >= 0 and PROPERTIES[j]['stories']]
+
+# ----------------------------------------------------------------------------
+# Nearby-prefecture fallback
+# ----------------------------------------------------------------------------
+# When a destination matches nothing (a small town, or a prefecture with no
+# stays), results expand outward instead of jumping to a random corner of
+# the country: the prefecture itself, then its neighbours, then the rest of
+# its region, then everything else, each ordered by distance between
+# prefecture centroids. Rings are fixed at import; each prefecture's
+# properties are kept in popularity order at load, so filling a page is
+# O(page size). Town names resolve to a prefecture through the property
+# names they appear in.
+
+# name: (Japanese name, region, centroid lat, lon, neighbours by land or bridge)
+PREFECTURE_GEO = {
+    'Hokkaido': ('北海道', 'Hokkaido', 43.06, 141.35, ['Aomori']),
+    'Aomori': ('青森県', 'Tohoku', 40.82, 140.74, ['Iwate', 'Akita']),
+    'Iwate': ('岩手県', 'Tohoku', 39.70, 141.15, ['Akita', 'Miyagi']),
+    'Miyagi': ('宮城県', 'Tohoku', 38.27, 140.87, ['Akita', 'Yamagata', 'Fukushima']),
+    'Akita': ('秋田県', 'Tohoku', 39.72, 140.10, ['Yamagata']),
+    'Yamagata': ('山形県', 'Tohoku', 38.24, 140.36, ['Fukushima', 'Niigata']),
+    'Fukushima': ('福島県', 'Tohoku', 37.75, 140.47, ['Niigata', 'Gunma', 'Tochigi', 'Ibaraki']),
+    'Ibaraki': ('茨城県', 'Kanto', 36.34, 140.45, ['Tochigi', 'Saitama', 'Chiba']),
+    'Tochigi': ('栃木県', 'Kanto', 36.57, 139.88, ['Saitama', 'Gunma']),
+    'Gunma': ('群馬県', 'Kanto', 36.39, 139.06, ['Saitama', 'Nagano', 'Niigata']),
+    'Saitama': ('埼玉県', 'Kanto', 35.86, 139.65, ['Nagano', 'Yamanashi', 'Tokyo', 'Chiba']),
+    'Chiba': ('千葉県', 'Kanto', 35.61, 140.12, ['Tokyo', 'Kanagawa']),
+    'Tokyo': ('東京都', 'Kanto', 35.69, 139.69, ['Kanagawa', 'Yamanashi']),
+    'Kanagawa': ('神奈川県', 'Kanto', 35.45, 139.64, ['Yamanashi', 'Shizuoka']),
+    'Niigata': ('新潟県', 'Chubu', 37.90, 139.02, ['Nagano', 'Toyama']),
+    'Toyama': ('富山県', 'Chubu', 36.70, 137.21, ['Nagano', 'Gifu', 'Ishikawa']),
+    'Ishikawa': ('石川県', 'Chubu', 36.59, 136.63, ['Gifu', 'Fukui']),
+    'Fukui': ('福井県', 'Chubu', 36.07, 136.22, ['Gifu', 'Shiga', 'Kyoto']),
+    'Yamanashi': ('山梨県', 'Chubu', 35.66, 138.57, ['Shizuoka', 'Nagano']),
+    'Nagano': ('長野県', 'Chubu', 36.65, 138.18, ['Shizuoka', 'Aichi', 'Gifu']),
+    'Gifu': ('岐阜県', 'Chubu', 35.39, 136.72, ['Aichi', 'Mie', 'Shiga']),
+    'Shizuoka': ('静岡県', 'Chubu', 34.98, 138.38, ['Aichi']),
+    'Aichi': ('愛知県', 'Chubu', 35.18, 136.91, ['Mie']),
+    'Mie': ('三重県', 'Kansai', 34.73, 136.51, ['Shiga', 'Kyoto', 'Nara', 'Wakayama']),
+    'Shiga': ('滋賀県', 'Kansai', 35.00, 135.87, ['Kyoto']),
+    'Kyoto': ('京都府', 'Kansai', 35.02, 135.76, ['Nara', 'Osaka', 'Hyogo']),
+    'Osaka': ('大阪府', 'Kansai', 34.69, 135.52, ['Nara', 'Wakayama', 'Hyogo']),
+    'Hyogo': ('兵庫県', 'Kansai', 34.69, 135.18, ['Okayama', 'Tottori', 'Tokushima']),
+    'Nara': ('奈良県', 'Kansai', 34.69, 135.83, ['Wakayama']),
+    'Wakayama': ('和歌山県', 'Kansai', 34.23, 135.17, []),
+    'Tottori': ('鳥取県', 'Chugoku', 35.50, 134.24, ['Okayama', 'Shimane', 'Hiroshima']),
+    'Shimane': ('島根県', 'Chugoku', 35.47, 133.05, ['Hiroshima', 'Yamaguchi']),
+    'Okayama': ('岡山県', 'Chugoku', 34.66, 133.93, ['Hiroshima', 'Kagawa']),
+    'Hiroshima': ('広島県', 'Chugoku', 34.40, 132.46, ['Yamaguchi', 'Ehime']),
+    'Yamaguchi': ('山口県', 'Chugoku', 34.19, 131.47, ['Fukuoka']),
+    'Tokushima': ('徳島県', 'Shikoku', 34.07, 134.56, ['Kagawa', 'Ehime', 'Kochi']),
+    'Kagawa': ('香川県', 'Shikoku', 34.34, 134.04, ['Ehime']),
+    'Ehime': ('愛媛県', 'Shikoku', 33.84, 132.77, ['Kochi']),
+    'Kochi': ('高知県', 'Shikoku', 33.56, 133.53, []),
+    'Fukuoka': ('福岡県', 'Kyushu', 33.61, 130.42, ['Saga', 'Kumamoto', 'Oita']),
+    'Saga': ('佐賀県', 'Kyushu', 33.25, 130.30, ['Nagasaki']),
+    'Nagasaki': ('長崎県', 'Kyushu', 32.74, 129.87, []),
+    'Kumamoto': ('熊本県', 'Kyushu', 32.79, 130.74, ['Oita', 'Miyazaki', 'Kagoshima']),
+    'Oita': ('大分県', 'Kyushu', 33.24, 131.61, ['Miyazaki']),
+    'Miyazaki': ('宮崎県', 'Kyushu', 31.91, 131.42, ['Kagoshima']),
+    'Kagoshima': ('鹿児島県', 'Kyushu', 31.56, 130.56, ['Okinawa']),
+    'Okinawa': ('沖縄県', 'Kyushu', 26.21, 127.68, []),
+}
+
+# Town-name tokens must point at one prefecture this often to be trusted
+PLACE_PREFECTURE_MIN_SHARE = 0.6
+
+def prefecture_key(text):
+    """Normalized prefecture name ('Kyoto-fu', '京都府', 'kyoto prefecture' -> 'kyoto')"""
+    key = normalize_text(text).strip()
+    key = re.sub(r'[\s-]+(prefecture|ken|fu|to)$', '', key) if key.isascii() else key
+    return PREFECTURE_ALIASES.get(key, key)
+
+def _build_prefecture_tables():
+    """Alias map and distance-ordered rings for every prefecture in PREFECTURE_GEO"""
+    aliases = {}
+    neighbours = {name: set(geo[4]) for name, geo in PREFECTURE_GEO.items()}
+    for name, geo in PREFECTURE_GEO.items():
+        key = normalize_text(name)
+        aliases[key] = key
+        aliases[normalize_text(geo[0])] = key
+        # Without the 県/府/都 suffix (京都府 -> 京都, 東京都 -> 東京)
+        aliases[normalize_text(geo[0][:-1] if geo[0][-1] in '県府都' else geo[0])] = key
+        for other in geo[4]:
+            neighbours[other].add(name)
+
+    def distance(a, b):
+        (lat1, lon1), (lat2, lon2) = PREFECTURE_GEO[a][2:4], PREFECTURE_GEO[b][2:4]
+        return math.hypot(lat1 - lat2, (lon1 - lon2) * math.cos(math.radians((lat1 + lat2) / 2)))
+
+    rings = {}
+    for name, geo in PREFECTURE_GEO.items():
+        by_distance = sorted((p for p in PREFECTURE_GEO if p != name), key=lambda p: distance(name, p))
+        near = [p for p in by_distance if p in neighbours[name]]
+        region = [p for p in by_distance if p not in neighbours[name] and PREFECTURE_GEO[p][1] == geo[1]]
+        rest = [p for p in by_distance if p not in neighbours[name] and PREFECTURE_GEO[p][1] != geo[1]]
+        rings[normalize_text(name)] = [[normalize_text(p) for p in ring] for ring in ([name], near, region, rest)]
+    return aliases, rings
+
+PREFECTURE_ALIASES, PREFECTURE_RINGS = _build_prefecture_tables()
+
+# Prefecture key -> property indices, most liked first
+PREFECTURE_INDEX = {}
+
+# Latin town/place token from property names -> prefecture key
+PLACE_PREFECTURE = {}
+
+def build_prefecture_index(properties, popular_order):
+    """Per-prefecture popularity lists plus the town-token -> prefecture map"""
+    index = {}
+    for i in popular_order:
+        index.setdefault(prefecture_key(properties[i]['prefecture']), array('i')).append(i)
+
+    token_counts = {}
+    for prop in properties:
+        key = prefecture_key(prop['prefecture'])
+        for token in set(tokenize(prop['search_name'])):
+            counts = token_counts.setdefault(token, {})
+            counts[key] = counts.get(key, 0) + 1
+    places = {}
+    for token, counts in token_counts.items():
+        key, n = max(counts.items(), key=lambda kv: kv[1])
+        if len(token) >= SPELL_MIN_TERM_LENGTH and n >= 2 and n >= PLACE_PREFECTURE_MIN_SHARE * sum(counts.values()):
+            places[token] = key
+    return index, places
+
+def resolve_prefecture(destination):
+    """Prefecture key a destination refers to (prefecture or town name), or None"""
+    if not destination:
+        return None
+    key = prefecture_key(destination)
+    if key in PREFECTURE_INDEX or key in PREFECTURE_RINGS:
+        return key
+    for token in tokenize(destination):
+        key = PREFECTURE_ALIASES.get(token) or PLACE_PREFECTURE.get(token)
+        if key:
+            return key
+    for alias, key in PREFECTURE_ALIASES.items():
+        if not alias.isascii() and alias in destination:
+            return key
+    return None
+
+def nearby_properties(destination, limit):
+    """
+    Up to `limit` property indices near a destination, nearest rings first.
+
+    Returns (indices, prefecture keys they came from); both empty when the
+    destination can't be placed.
+    """
+    prefecture = resolve_prefecture(destination)
+    if prefecture is None:
+        return [], []
+    picked = []
+    used = []
+    for ring in PREFECTURE_RINGS.get(prefecture, [[prefecture]]):
+        for key in ring:
+            candidates = PREFECTURE_INDEX.get(key)
+            if not candidates:
+                continue
+            used.append(key)
+            picked.extend(candidates[:limit - len(picked)])
+            if len(picked) >= limit:
+                return picked, used
+    return picked, used
+
+# ----------------------------------------------------------------------------
+# Compressed bitmaps
+# ----------------------------------------------------------------------------
+# Roaring-style sets of property indices. Indices are split by their high 16
+# bits into containers; a container keeps its low 16 bits as a sorted
+# array('H') while it has at most ROARING_ARRAY_MAX entries and as a
+# 65536-bit int once denser, so intersections and counts run as C-level set
+# and bitwise operations instead of Python loops over PROPERTIES.
+
+ROARING_ARRAY_MAX = 4096
+
+def _container(lows):
+    """Smallest container for sorted low 16-bit values"""
+    lows = array('H', lows)
+    if len(lows) <= ROARING_ARRAY_MAX:
+        return lows
+    bits = bytearray(8192)
+    for x in lows:
+        bits[x >> 3] |= 1 << (x & 7)
+    return int.from_bytes(bits, 'little')
+
+def _container_lows(c):
+    """Sorted low values held by a container"""
+    if not isinstance(c, int):
+        return c
+    bits = c.to_bytes(8192, 'little')
+    return array('H', (byte << 3 | bit for byte, value in enumerate(bits) if value
+                       for bit in range(8) if value >> bit & 1))
+
+def _container_as_int(c):
+    if isinstance(c, int):
+        return c
+    bits = bytearray(8192)
+    for x in c:
+        bits[x >> 3] |= 1 << (x & 7)
+    return int.from_bytes(bits, 'little')
+
+def _container_count(c):
+    return c.bit_count() if isinstance(c, int) else len(c)
+
+def _container_and(a, b):
+    if isinstance(a, int) and isinstance(b, int):
+        bits = a & b
+        return bits if bits.bit_count() > ROARING_ARRAY_MAX else _container_lows(bits)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        dense = b.to_bytes(8192, 'little')
+        return array('H', (x for x in a if dense[x >> 3] >> (x & 7) & 1))
+    return array('H', sorted(set(a).intersection(b)))
+
+def _container_or(a, b):
+    if isinstance(a, int) or isinstance(b, int):
+        return _container_as_int(a) | _container_as_int(b)
+    return _container(sorted(set(a).union(b)))
+
+def bitmap_from_indices(indices):
+    """Bitmap holding the given property indices (any order)"""
+    groups = {}
+    for i in indices:
+        groups.setdefault(i >> 16, []).append(i & 0xFFFF)
+    return {high: _container(sorted(lows)) for high, lows in groups.items()}
+
+def bitmap_and(a, b):
+    result = {}
+    for high in a.keys() & b.keys():
+        c = _container_and(a[high], b[high])
+        if _container_count(c):
+            result[high] = c
+    return result
+
+def bitmap_or(a, b):
+    result = dict(a)
+    for high, c in b.items():
+        result[high] = _container_or(result[high], c) if high in result else c
+    return result
+
+def bitmap_count(bitmap):
+    return sum(_container_count(c) for c in bitmap.values())
+
+def bitmap_and_count(a, b):
+    """Size of the intersection without building it"""
+    total = 0
+    for high in a.keys() & b.keys():
+        x, y = a[high], b[high]
+        if isinstance(x, int) and isinstance(y, int):
+            total += (x & y).bit_count()
+        elif isinstance(x, int) or isinstance(y, int):
+            total += len(_container_and(x, y))
+        else:
+            total += len(set(x).intersection(y))
+    return total
+
+def bitmap_andnot(a, b):
+    """Members of a that are not in b"""
+    result = {}
+    for high, x in a.items():
+        y = b.get(high)
+        if y is None:
+            result[high] = x
+            continue
+        if isinstance(x, int):
+            c = x & ~_container_as_int(y)
+            c = c if c.bit_count() > ROARING_ARRAY_MAX else _container_lows(c)
+        elif isinstance(y, int):
+            dense = y.to_bytes(8192, 'little')
+            c = array('H', (v for v in x if not dense[v >> 3] >> (v & 7) & 1))
+        else:
+            c = array('H', sorted(set(x).difference(y)))
+        if _container_count(c):
+            result[high] = c
+    return result
+
+def bitmap_contains(bitmap, i):
+    c = bitmap.get(i >> 16)
+    if c is None:
+        return False
+    low = i & 0xFFFF
+    if isinstance(c, int):
+        return bool(c >> low & 1)
+    k = bisect.bisect_left(c, low)
+    return k < len(c) and c[k] == low
+
+def bitmap_range(bitmap, lo, hi):
+    """The part of a bitmap with lo <= index < hi"""
+    result = {}
+    for high, c in bitmap.items():
+        base = high << 16
+        if base + 0x10000 <= lo or base >= hi:
+            continue
+        if lo <= base and base + 0x10000 <= hi:
+            result[high] = c
+            continue
+        lows = _container_lows(c)
+        kept = lows[bisect.bisect_left(lows, lo - base):bisect.bisect_left(lows, hi - base)]
+        if kept:
+            result[high] = _container(kept)
+    return result
+
+def bitmap_indices(bitmap, start=0):
+    """Property indices in ascending order, from `start` on"""
+    for high in sorted(bitmap):
+        if high < start >> 16:
+            continue
+        base = high << 16
+        lows = _container_lows(bitmap[high])
+        first = bisect.bisect_left(lows, start - base) if start > base else 0
+        for k in range(first, len(lows)):
+            yield base | lows[k]
+
+# ----------------------------------------------------------------------------
+# Facets
+# ----------------------------------------------------------------------------
+# One bitmap per country, prefecture and theme, plus a term -> properties
+# posting list (latin words and CJK bigrams of names and stories) so a query
+# becomes a bitmap too. /facets counts are then a bitmap intersection and a
+# popcount per facet value.
+
+# theme -> phrases that tag a property with it (English and Japanese).
+# Japanese phrases match inside words, so each must be specific on its own:
+# no bare ペット (ペットボトル), 山の (山の手線), 山から (富山から), 海が (熱海が)
+# or 自然 (自然に, "naturally"), and no meal words every stay mentions
+# (breakfast, dinner, ご飯).
+THEME_LEXICON = {
+    'onsen': ['onsen', 'hot spring', '温泉', '露天風呂', '源泉'],
+    'ryokan': ['ryokan', '旅館', '民宿'],
+    'mountain': ['mountain', 'hiking', '登山', '山頂', '山々', '山並み', '山小屋', '山が見える', '山の見える'],
+    'beach': ['beach', 'ocean', 'seaside', 'ビーチ', '海が見える', '海の見える', '海辺', '海岸', '海水浴'],
+    'workation': ['workation', 'remote work', 'worked remotely', 'coworking', 'ワーケーション', 'テレワーク', 'リモートワーク'],
+    'sauna': ['sauna', 'サウナ'],
+    'temple': ['temple', 'shrine', 'お寺', '神社'],
+    'food': ['local food', 'local cuisine', 'cuisine', 'seafood', 'gourmet', 'kaiseki',
+             '地元のご飯', '郷土料理', '懐石', 'グルメ', '海の幸', '山の幸'],
+    'pet_friendly': ['dog friendly', 'pet friendly', 'pets allowed', 'dogs allowed', 'pets welcome',
+                     'ペット可', 'ペット同伴', 'ペットと', 'ワンちゃん', '愛犬'],
+    'snow': ['snow', 'skiing', 'ski resort', '雪', 'スキー'],
+    'cafe': ['cafe', 'coffee', 'カフェ', 'コーヒー'],
+    'nature': ['forest', 'nature', 'river', 'waterfall', '大自然', '自然豊か', '自然の中', '自然に囲まれ', '森林', '滝'],
+}
+
+# Facet counts returned per facet unless the request asks for more
+FACET_LIMIT = 10
+
+# facet -> value -> bitmap; 'all' holds every property
+FACET_INDEX = {'all': {}, 'country': {}, 'prefecture': {}, 'theme': {}}
+
+# facet -> normalized value -> value as shown in FACET_INDEX
+FACET_ALIASES = {'country': {}, 'prefecture': {}, 'theme': {}}
+
+# Term postings: property indices for term t are TERM_POSTINGS[start:end], TERM_OFFSETS[t] = (start, end)
+TERM_POSTINGS = array('i')
+TERM_OFFSETS = {}
+
+# Live updates since the postings were built: term -> {property index: has the term}
+TERM_DELTA = {}
+
+def facet_terms(text):
+    """Latin words and CJK character bigrams of normalized text"""
+    terms = set(tokenize(text))
+    for run in _CJK_RUN_RE.findall(text):
+        terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+def property_terms(prop):
+    """Index terms of a property's name, place and stories"""
+    return facet_terms(' '.join((prop['search_name'], prop['search_prefecture'], prop.get('search_romaji', ''),
+                                 prop['search_description'])))
+
+def _facet_rows(bounds):
+    """Sorted terms for properties[start:end]"""
+    rows = []
+    for prop in PARALLEL_INPUT['properties'][bounds[0]:bounds[1]]:
+        rows.append(sorted(property_terms(prop)))
+    return rows
+
+def build_facet_index(properties, theme_flags, workers=1):
+    """Facet bitmaps, facet aliases and term postings for all properties"""
+    by_value = {'country': {}, 'prefecture': {}, 'theme': {}}
+    term_lists = {}
+    i = 0
+    for rows in parallel_map(_facet_rows, len(properties), workers, properties=properties):
+        for terms in rows:
+            prop = properties[i]
+            by_value['country'].setdefault(prop['country'] or 'unknown', []).append(i)
+            by_value['prefecture'].setdefault(prop['prefecture'] or 'unknown', []).append(i)
+            for theme in theme_names(theme_flags[i]):
+                by_value['theme'].setdefault(theme, []).append(i)
+            for term in terms:
+                term_lists.setdefault(term, []).append(i)
+            i += 1
+
+    index = {'all': {'all': bitmap_from_indices(range(len(properties)))}}
+    aliases = {}
+    for facet, values in by_value.items():
+        index[facet] = {value: bitmap_from_indices(ids) for value, ids in values.items()}
+        aliases[facet] = {normalize_text(value): value for value in values}
+        if facet == 'prefecture':
+            aliases[facet].update((prefecture_key(value), value) for value in values)
+
+    postings = array('i')
+    offsets = {}
+    for term, ids in term_lists.items():
+        offsets[term] = (len(postings), len(postings) + len(ids))
+        postings.extend(ids)
+    return index, aliases, postings, offsets
+
+def facet_bitmap(facet, value):
+    """Bitmap for one facet value, matched loosely ('kyoto-fu', '京都'); empty if unknown"""
+    aliases = FACET_ALIASES[facet]
+    name = aliases.get(normalize_text(value))
+    if name is None and facet == 'prefecture':
+        name = aliases.get(prefecture_key(value))
+    elif name is None and facet == 'theme':
+        name = next(iter(resolve_themes(value)), None)
+    return FACET_INDEX[facet].get(name, {})
+
+def term_bitmap(term):
+    """Properties with one index term (postings plus live updates)"""
+    start, end = TERM_OFFSETS.get(term, (0, 0))
+    result = bitmap_from_indices(TERM_POSTINGS[start:end])
+    changes = TERM_DELTA.get(term)
+    if changes:
+        added = bitmap_from_indices(i for i, has in changes.items() if has)
+        # Shard workers only answer for their own slice
+        result = bitmap_or(result, bitmap_and(added, FACET_INDEX['all']['all']))
+        result = bitmap_andnot(result, bitmap_from_indices(i for i, has in changes.items() if not has))
+    return result
+
+def term_frequency(term):
+    start, end = TERM_OFFSETS.get(term, (0, 0))
+    return end - start + len(TERM_DELTA.get(term, ()))
+
+def query_bitmap(query):
+    """Properties containing every term of an already normalized query (rarest term first)"""
+    terms = sorted(facet_terms(query), key=term_frequency)
+    if not terms:
+        return FACET_INDEX['all']['all']
+    result = term_bitmap(terms[0])
+    for term in terms[1:]:
+        if not result:
+            break
+        result = bitmap_and(result, term_bitmap(term))
+    return result
+
+def property_has_term(i, term):
+    """Whether property i has an index term (one binary search)"""
+    changes = TERM_DELTA.get(term)
+    if changes and i in changes:
+        return changes[i]
+    start, end = TERM_OFFSETS.get(term, (0, 0))
+    k = bisect.bisect_left(TERM_POSTINGS, i, start, end)
+    return k < end and TERM_POSTINGS[k] == i
+
+def property_has_terms(i, text):
+    """Whether property i has every index term of normalized text"""
+    return all(property_has_term(i, term) for term in facet_terms(text))
+
+def facet_counts(selected, facet, limit):
+    """[(value, count)] for one facet within a selection, largest first"""
+    counts = [(value, bitmap_and_count(selected, bitmap)) for value, bitmap in FACET_INDEX[facet].items()]
+    counts = [(value, n) for value, n in counts if n]
+    return heapq.nlargest(limit, counts, key=lambda vc: (vc[1], vc[0]))
+
+# ----------------------------------------------------------------------------
+# Theme tags
+# ----------------------------------------------------------------------------
+# Every story is tagged once at load, while its text is being normalized: one
+# regex pass with every lexicon phrase as an alternative (English phrases
+# count on word boundaries only, plurals allowed). Tags are bit flags, one bit
+# per theme in THEME_LEXICON order, kept per story and per property (the OR of
+# its stories and name), and each theme has a postings list of property
+# indices by likes, so "top onsen stays" is a slice.
+
+THEME_BITS = {theme: 1 << k for k, theme in enumerate(THEME_LEXICON)}
+
+# normalized phrase -> theme (theme names themselves included)
+THEME_PHRASES = {normalize_text(phrase): theme for theme, phrases in THEME_LEXICON.items()
+                 for phrase in phrases + [theme.replace('_', ' ')]}
+
+# A flat alternation of literals (longest first) lets the regex engine skip
+# ahead on first characters; lookarounds or named groups per theme would
+# make it try every branch at every position
+THEME_RE = re.compile('(' + '|'.join(re.escape(p) for p in sorted(THEME_PHRASES, key=len, reverse=True))
+                      + ')(?:e?s)?')
+
+# Theme bit flags per property and per story (parallel to PROPERTIES and STORIES)
+THEME_FLAGS = array('I')
+STORY_THEME_FLAGS = array('I')
+
+# theme -> property indices with that theme, most liked first
+THEME_POSTINGS = {}
+
+def tag_text(text):
+    """Theme bit flags of normalized text"""
+    flags = 0
+    for match in THEME_RE.finditer(text):
+        phrase = match.group(1)
+        if not phrase.isascii() or _on_word_boundary(text, match.start(), match.end()):
+            flags |= THEME_BITS[THEME_PHRASES[phrase]]
+    return flags
+
+def theme_names(flags):
+    """Themes set in a flags value, in lexicon order"""
+    return [theme for theme, bit in THEME_BITS.items() if flags & bit]
+
+def resolve_themes(text):
+    """Themes named in free text ('hot springs', '温泉', 'pet_friendly')"""
+    text = re.sub(r'[_-]', ' ', normalize_text(text))
+    return theme_names(tag_text(text))
+
+def themed_properties(themes):
+    """Property indices carrying every one of `themes`, most liked first"""
+    postings = THEME_POSTINGS.get(themes[0], ())
+    if len(themes) == 1:
+        return postings
+    mask = sum(THEME_BITS[theme] for theme in themes)
+    return [i for i in postings if THEME_FLAGS[i] & mask == mask]
+
+def build_theme_postings(flags, popular_order):
+    """theme -> array of property indices carrying it, in popularity order"""
+    postings = {theme: array('i') for theme in THEME_BITS}
+    for i in popular_order:
+        if flags[i]:
+            for theme in theme_names(flags[i]):
+                postings[theme].append(i)
+    return postings
+
+# ----------------------------------------------------------------------------
+# Snippets
+# ----------------------------------------------------------------------------
+# Stories are split into sentences while they are normalized and tagged, so
+# each sentence has its end offset in the original text and its own theme
+# flags. A snippet starts at the best sentence for the request (themes
+# checked against the flags; leftover keywords the term index places in the
+# property, against at most SNIPPET_SCAN_LIMIT sentences) and grows by whole
+# sentences up to the length budget, so it costs about the snippet's length,
+# never the whole description, and never cuts Japanese text mid-word unless
+# one sentence alone is over budget.
+
+# Sentence ends: Japanese/full-width punctuation, latin punctuation followed by a space, line breaks
+SENTENCE_END_RE = re.compile(r'[。！？!?]+[」』）)]*\s*|[.!?]+["\')]*(?:\s+|$)|\n+')
+
+# Snippet budgets (characters before the ellipses)
+SNIPPET_LENGTH = 200
+
+# Sentences (and skipped stories) looked at when choosing a snippet
+SNIPPET_SCAN_LIMIT = 64
+
+# Story s has sentences STORY_SENTENCES[s]:STORY_SENTENCES[s + 1] of SENTENCE_ENDS / SENTENCE_FLAGS
+STORY_SENTENCES = array('I')
+SENTENCE_ENDS = array('I')
+SENTENCE_FLAGS = array('I')
+
+def split_story(description):
+    """(sentence end offsets, theme flags per sentence, normalized text) of one story"""
+    ends = [m.end() for m in SENTENCE_END_RE.finditer(description) if m.end() < len(description)]
+    ends.append(len(description))
+    flags = []
+    parts = []
+    start = 0
+    for end in ends:
+        part = normalize_text(description[start:end])
+        parts.append(part)
+        flags.append(tag_text(part))
+        start = end
+    return ends, flags, ''.join(parts)
+
+def snippet_focus(query='', themes=()):
+    """(theme mask, keywords) a snippet should show, from a normalized query and themes"""
+    themes = set(themes) | set(resolve_themes(query)) if query else set(themes)
+    keywords = [w for w in query.split() if len(w) > 1 and w not in QUERY_STOPWORDS and not tag_text(w)]
+    return sum(THEME_BITS[theme] for theme in themes), keywords
+
+def best_sentence(prop, focus):
+    """(story offset, sentence index) that best shows the focus; the top story's start otherwise"""
+    mask, keywords = focus
+    if keywords:
+        # Only look for words the term index says the property has
+        i = PID_INDEX.get(prop['pid'])
+        keywords = [w for w in keywords if i is not None and property_has_terms(i, w)]
+    target = bin(mask).count('1') + len(keywords)
+    best, best_score = None, 0
+    looked = 0
+    for o in prop['stories'] if target else ():
+        looked += 1
+        if not keywords and not STORY_THEME_FLAGS[o] & mask:
+            continue
+        for k in range(STORY_SENTENCES[o], STORY_SENTENCES[o + 1]):
+            looked += 1
+            score = bin(SENTENCE_FLAGS[k] & mask).count('1')
+            if keywords:
+                start = SENTENCE_ENDS[k - 1] if k > STORY_SENTENCES[o] else 0
+                text = normalize_text(STORIES[o]['description'][start:SENTENCE_ENDS[k]])
+                score += sum(1 for w in keywords if w in text)
+            if score > best_score:
+                best, best_score = (o, k), score
+            if best_score == target or looked >= SNIPPET_SCAN_LIMIT:
+                break
+        if best_score == target or looked >= SNIPPET_SCAN_LIMIT:
+            break
+    if best is None:
+        o = next((o for o in prop['stories'] if STORIES[o]['description']), prop['stories'][0])
+        best = (o, STORY_SENTENCES[o])
+    return best
+
+def snippet_text(o, k, budget=SNIPPET_LENGTH):
+    """Whole sentences of story o around sentence k, at most `budget` characters"""
+    description = STORIES[o]['description']
+    first, last = STORY_SENTENCES[o], STORY_SENTENCES[o + 1]
+    begin = k
+    start = SENTENCE_ENDS[k - 1] if k > first else 0
+    end = start
+    # Forward from the chosen sentence, then back if there is room left
+    while k < last and SENTENCE_ENDS[k] - start <= budget:
+        end = SENTENCE_ENDS[k]
+        k += 1
+    while end > start and begin > first:
+        previous = SENTENCE_ENDS[begin - 2] if begin - 1 > first else 0
+        if end - previous > budget:
+            break
+        start = previous
+        begin -= 1
+    if end == start:
+        # One sentence over budget: cut it, at a space when the text has them
+        end = start + budget
+        space = description.rfind(' ', start + budget // 2, end)
+        end = space if space > 0 else end
+    text = description[start:end].strip()
+    return ('...' if start > 0 else '') + text + ('...' if end < len(description.rstrip()) else '')
+
+def snippet(prop, focus=(0, ()), budget=SNIPPET_LENGTH):
+    """Snippet of a property's stories for a focus from snippet_focus()"""
+    return snippet_text(*best_sentence(prop, focus), budget)
+
+# ----------------------------------------------------------------------------
+# Filter engine
+# ----------------------------------------------------------------------------
+# Every criterion compiles to a bitmap and requests combine them with
+# AND/OR/NOT, so handlers share one engine instead of per-property checks.
+# A request can send a full expression in "filter" and/or the shorthand
+# fields (country, prefecture, theme, style, min_likes, max_likes), which are
+# ANDed together:
+#
+#   {"filter": {"and": [{"theme": ["onsen", "sauna"]},
+#                       {"not": {"prefecture": "Tokyo"}},
+#                       {"likes": {"min": 50}}]}}
+
+# Nesting deeper than this is rejected
+FILTER_MAX_DEPTH = 8
+
+# Likes of POPULAR_ORDER entries, negated so the array ascends (for bisect)
+POPULAR_NEG_LIKES = array('i')
+
+class FilterError(ValueError):
+    """Malformed filter expression (reported to the caller as a 400)"""
+
+def keyword_bitmap(text):
+    """Properties whose name, place or stories contain every word of normalized text"""
+    if facet_terms(text):
+        return query_bitmap(text)
+    # A lone CJK character has no bigram to look up
+    lo, hi = SHARD_BOUNDS or (0, len(PROPERTIES))
+    return bitmap_from_indices(i for i in range(lo, min(hi, len(PROPERTIES)))
+                               if text in PROPERTIES[i]['search_description'] or text in PROPERTIES[i]['search_name'])
+
+def destination_bitmap(destination):
+    """Properties in any prefecture/region whose name contains the destination"""
+    aliases = FACET_ALIASES['prefecture']
+    names = {name for alias, name in aliases.items() if destination in alias}
+    if prefecture_key(destination) in aliases:
+        names.add(aliases[prefecture_key(destination)])
+    result = {}
+    for name in names:
+        result = bitmap_or(result, FACET_INDEX['prefecture'][name])
+    return result
+
+def likes_bitmap(low=None, high=None):
+    """Properties with low <= likes <= high (either bound optional)"""
+    start = bisect.bisect_left(POPULAR_NEG_LIKES, -high) if high is not None else 0
+    end = bisect.bisect_right(POPULAR_NEG_LIKES, -low) if low is not None else len(POPULAR_NEG_LIKES)
+    return bitmap_from_indices(POPULAR_ORDER[start:end])
+
+_FILTER_LEAVES = {
+    'country': lambda v: facet_bitmap('country', v),
+    'prefecture': lambda v: facet_bitmap('prefecture', v),
+    'theme': lambda v: facet_bitmap('theme', v),
+    'keyword': lambda v: keyword_bitmap(correct_query(normalize_text(v))),
+    'destination': lambda v: destination_bitmap(correct_query(normalize_text(v)))
+}
+
+def compile_filter(expr, depth=0):
+    """
+    Bitmap of the properties matching a filter expression.
+
+    Leaves are {"country" | "prefecture" | "theme" | "keyword" | "destination": value}
+    (a list value matches any item) and {"likes": {"min": n, "max": n}};
+    {"and": [...]}, {"or": [...]} and {"not": expr} combine them.
+    """
+    if depth > FILTER_MAX_DEPTH:
+        raise FilterError('filter nested too deeply')
+    if not isinstance(expr, dict) or len(expr) != 1:
+        raise FilterError('each filter node needs exactly one key')
+    (op, arg), = expr.items()
+    if op in ('and', 'or'):
+        if not isinstance(arg, list) or not arg:
+            raise FilterError(f"'{op}' takes a non-empty list")
+        parts = [compile_filter(e, depth + 1) for e in arg]
+        if op == 'or':
+            result = {}
+            for part in parts:
+                result = bitmap_or(result, part)
+            return result
+        # Smallest first keeps every intermediate result small
+        parts.sort(key=bitmap_count)
+        result = parts[0]
+        for part in parts[1:]:
+            if not result:
+                break
+            result = bitmap_and(result, part)
+        return result
+    if op == 'not':
+        return bitmap_andnot(FACET_INDEX['all']['all'], compile_filter(arg, depth + 1))
+    if op == 'likes':
+        if not isinstance(arg, dict):
+            raise FilterError("'likes' takes {\"min\": n, \"max\": n}")
+        try:
+            low = int(arg['min']) if arg.get('min') is not None else None
+            high = int(arg['max']) if arg.get('max') is not None else None
+        except (TypeError, ValueError):
+            raise FilterError("'likes' bounds must be numbers")
+        return likes_bitmap(low, high)
+    if op not in _FILTER_LEAVES:
+        raise FilterError(f"unknown filter '{op}'")
+    result = {}
+    for value in (arg if isinstance(arg, list) else [arg]):
+        result = bitmap_or(result, _FILTER_LEAVES[op](str(value)))
+    return result
+
+def request_filter(data):
+    """The filter criteria of a request body as one expression, or None"""
+    parts = []
+    if data.get('filter'):
+        parts.append(data['filter'])
+    for field in ('country', 'prefecture', 'theme'):
+        if data.get(field):
+            parts.append({field: data[field]})
+    # The old API's free-form "style": the themes it names, else a keyword
+    style = normalize_text(str(data.get('style') or ''))
+    if style:
+        themes = resolve_themes(style)
+        parts.append({'theme': themes} if themes else {'keyword': style})
+    if data.get('min_likes') is not None or data.get('max_likes') is not None:
+        parts.append({'likes': {'min': data.get('min_likes'), 'max': data.get('max_likes')}})
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else {'and': parts}
+
+def filter_themes(expr):
+    """Themes a filter expression asks for outside any 'not' (for snippets)"""
+    themes = []
+    if isinstance(expr, dict):
+        for op, arg in expr.items():
+            if op in ('and', 'or') and isinstance(arg, list):
+                for e in arg:
+                    themes += filter_themes(e)
+            elif op == 'theme':
+                for value in (arg if isinstance(arg, list) else [arg]):
+                    themes += resolve_themes(str(value))
+    return themes
+
+def select_properties(query, destination, expr=None):
+    """Bitmap of properties matching query OR destination, AND the filter; None without criteria"""
+    selected = None
+    if query:
+        selected = keyword_bitmap(query)
+    if destination:
+        near = destination_bitmap(destination)
+        selected = near if selected is None else bitmap_or(selected, near)
+    if expr:
+        matched = compile_filter(expr)
+        selected = matched if selected is None else bitmap_and(selected, matched)
+    return selected
+
+# Pages list matches most liked first, by popularity key (-likes, index),
+# and cursors hold the POPULAR_ORDER position a page resumes from. A
+# selection holding at least this many times fewer properties than the
+# rest of the order is ranked by heaping its matches' keys rather than by
+# walking the order and testing membership.
+RANK_WALK_RATIO = 64
+
+def _order_range(order, negs, neg):
+    """Positions of order holding properties with likes -neg"""
+    # A delta batch swaps the two lists one after the other; don't index past either
+    lo = bisect.bisect_left(negs, neg)
+    hi = bisect.bisect_right(negs, neg, lo)
+    return min(lo, len(order)), min(hi, len(order))
+
+def popularity_position(i):
+    """Position of property i in POPULAR_ORDER (where it would go if it isn't listed)"""
+    order = POPULAR_ORDER
+    lo, hi = _order_range(order, POPULAR_NEG_LIKES, -PROPERTIES[i]['likes'])
+    return bisect.bisect_left(order, i, lo, hi)
+
+def popularity_floor(start):
+    """Popularity key of POPULAR_ORDER position start (None for the beginning)"""
+    return _popularity_key(POPULAR_ORDER[start]) if 0 < start < len(POPULAR_ORDER) else None
+
+def ranked_indices(bitmap, floor=None):
+    """A bitmap's properties most liked first, from popularity key floor on"""
+    order = POPULAR_ORDER
+    start = 0
+    if floor is not None:
+        lo, hi = _order_range(order, POPULAR_NEG_LIKES, floor[0])
+        start = bisect.bisect_left(order, floor[1], lo, hi)
+    if not bitmap or start >= len(order):
+        return
+    count = bitmap_count(bitmap)
+    if count * RANK_WALK_RATIO >= len(order) - start:
+        for pos in range(start, len(order)):
+            if bitmap_contains(bitmap, order[pos]):
+                yield order[pos]
+        return
+    keys = [key for key in map(_popularity_key, bitmap_indices(bitmap)) if floor is None or key >= floor]
+    heapq.heapify(keys)
+    while keys:
+        yield heapq.heappop(keys)[1]
+
+# ----------------------------------------------------------------------------
+# Sharded selection
+# ----------------------------------------------------------------------------
+# One process only uses one core to build a selection, and on a million
+# stories the posting lists behind it get long. With SCORING_SHARDS=N (and
+# at least SHARD_MIN_PROPERTIES properties) warm-up forks N shard workers,
+# each owning a contiguous slice of PROPERTIES. Forked after loading, they
+# share the parent's stores and indexes copy-on-write (gc.freeze() keeps
+# the collector from dirtying those pages) and cut their own facet bitmaps,
+# term postings and likes order down to their slice. A request fans out to
+# every shard; each returns its local top-k by popularity key (-likes,
+# index) from the page's starting key on, and a heap merges them by the
+# same key, so pages list the same properties in the same order as
+# selecting in-process. Property indices stay global, so merged results
+# need no translation. Deltas go down the same pipes: every shard applies
+# every record (so appended properties get the same index everywhere) and
+# keeps only its own slice of each selection; the last shard's slice is
+# open-ended to own appended properties. Off by default; any shard failure
+# falls back to selecting in-process.
+#
+# Every shard has one pipe per request thread (a "channel" is one pipe to
+# each shard). A request checks a channel out for its fan-out and hands it
+# back after, so concurrent requests never wait on each other's replies;
+# shard workers serve all their pipes in arrival order.
+
+SCORING_SHARDS = int(os.environ.get('SCORING_SHARDS', '0'))
+SHARD_MIN_PROPERTIES = int(os.environ.get('SHARD_MIN_PROPERTIES', '50000'))
+
+# Matches each shard returns per round, and how long a round may take
+SHARD_BATCH = 64
+SHARD_TIMEOUT = 10.0
+
+# Channels to the shards: one per request thread
+SHARD_CHANNELS = ADMISSION_THREADS
+
+# (lo, hi) slice of PROPERTIES owned by this process when it is a shard worker
+SHARD_BOUNDS = None
+
+# Shard workers of this process: every pipe, the processes, their (lo, hi)
+# slices and the free channels, each {'conns': one pipe per shard, 'owed':
+# pipes whose reply was abandoned at a request deadline}
+SHARDS = {'pid': None, 'conns': [], 'processes': [], 'bounds': [], 'channels': None}
+_SHARD_LOCK = threading.Lock()
+
+class ShardError(RuntimeError):
+    """A shard worker died or stopped answering"""
+
+def _restrict_to_shard(lo, hi):
+    """Cut this process's indexes down to PROPERTIES[lo:hi] (in a shard worker)"""
+    global SHARD_BOUNDS, FACET_INDEX, TERM_POSTINGS, TERM_OFFSETS, POPULAR_ORDER, POPULAR_NEG_LIKES
+    SHARD_BOUNDS = (lo, hi)
+    FACET_INDEX = {facet: {value: bitmap_range(bitmap, lo, hi) for value, bitmap in values.items()}
+                   for facet, values in FACET_INDEX.items()}
+    postings = array('i')
+    offsets = {}
+    for term, (start, end) in TERM_OFFSETS.items():
+        first = bisect.bisect_left(TERM_POSTINGS, lo, start, end)
+        last = bisect.bisect_left(TERM_POSTINGS, hi, first, end)
+        if last > first:
+            offsets[term] = (len(postings), len(postings) + last - first)
+            postings.extend(TERM_POSTINGS[first:last])
+    TERM_POSTINGS, TERM_OFFSETS = postings, offsets
+    POPULAR_ORDER = [i for i in POPULAR_ORDER if lo <= i < hi]
+    POPULAR_NEG_LIKES = array('i', (-PROPERTIES[i]['likes'] for i in POPULAR_ORDER))
+
+def _shard_main(conns, lo, hi):
+    """
+    Shard worker loop: answer ('select', (query, destination, expr,
+    candidates, floor, k)) and ('deltas', rows) requests on any of its pipes
+    """
+    _restrict_to_shard(lo, hi)
+    # Per pipe: the last selection, which later rounds of a request reuse
+    cached = {}
+    conns = list(conns)
+    while conns:
+        for conn in multiprocessing.connection.wait(conns):
+            try:
+                kind, args = conn.recv()
+            except (EOFError, OSError):
+                conns.remove(conn)
+                cached.pop(conn, None)
+                continue
+            if kind == 'deltas':
+                cached.clear()
+                try:
+                    try:
+                        for row in args:
+                            try:
+                                apply_delta(row)
+                            except DeltaError:
+                                pass  # the parent applied the same rows and reported it
+                    finally:
+                        publish_delta_work()
+                    conn.send(('ok', None))
+                except Exception as e:
+                    conn.send(('error', repr(e)))
+                continue
+            query, destination, expr, candidates, floor, k = args
+            try:
+                # Deltas file properties outside the slice too, so cut it to the slice
+                key, selected = cached.get(conn, (None, None))
+                if key != (query, destination, expr):
+                    selected = bitmap_range(select_properties(query, destination, expr) or {}, lo, hi)
+                    cached[conn] = ((query, destination, expr), selected)
+                matched = [i for i in candidates if bitmap_contains(selected, i)]
+                top = [_popularity_key(i) for i in itertools.islice(ranked_indices(selected, floor), k + 1)]
+                conn.send(('ok', bool(selected), matched, top[:k], len(top) > k))
+            except FilterError as e:
+                cached.pop(conn, None)
+                conn.send(('filter', str(e)))
+            except Exception as e:
+                cached.pop(conn, None)
+                conn.send(('error', repr(e)))
+
+def start_shards(n):
+    """Fork n shard workers over PROPERTIES; False when sharding doesn't apply"""
+    if n < 2 or len(PROPERTIES) < SHARD_MIN_PROPERTIES or 'fork' not in multiprocessing.get_all_start_methods():
+        return False
+    if not WARMUP['ready']:
+        warmup_stage('shards')
+    gc.freeze()
+    context = multiprocessing.get_context('fork')
+    size = -(-len(PROPERTIES) // n)
+    with _SHARD_LOCK:
+        channels = [{'conns': [], 'owed': set()} for _ in range(SHARD_CHANNELS)]
+        for lo in range(0, len(PROPERTIES), size):
+            # The last shard also owns properties that deltas append
+            hi = lo + size if lo + size < len(PROPERTIES) else sys.maxsize
+            pipes = [context.Pipe() for _ in channels]
+            children = [child for _, child in pipes]
+            process = context.Process(target=_shard_main, args=(children, lo, hi), name=f'shard-{lo}', daemon=True)
+            process.start()
+            for (conn, child), channel in zip(pipes, channels):
+                child.close()
+                channel['conns'].append(conn)
+                SHARDS['conns'].append(conn)
+            SHARDS['processes'].append(process)
+            SHARDS['bounds'].append((lo, hi))
+        SHARDS['channels'] = queue.Queue()
+        for channel in channels:
+            SHARDS['channels'].put(channel)
+        SHARDS['pid'] = os.getpid()
+    print(f"✅ Started {len(SHARDS['processes'])} scoring shards (~{size} properties each)")
+    return True
+
+def stop_shards():
+    """Stop the shard workers; selection goes back to running in-process"""
+    with _SHARD_LOCK:
+        for conn in SHARDS['conns']:
+            conn.close()
+        for process in SHARDS['processes']:
+            process.terminate()
+        SHARDS.update(pid=None, conns=[], processes=[], bounds=[], channels=None)
+
+def _checkout_channel():
+    """A channel for this thread's use alone, with the pool to give it back to"""
+    with _SHARD_LOCK:
+        if SHARDS['pid'] != os.getpid():
+            raise ShardError('no shard workers in this process')
+        channels = SHARDS['channels']
+    try:
+        return channels, channels.get(timeout=SHARD_TIMEOUT)
+    except queue.Empty:
+        raise ShardError('no free shard channel')
+
+def _collect_owed(channel, conn):
+    """Read and drop a reply abandoned at a deadline before the pipe is reused"""
+    if conn in channel['owed']:
+        if not conn.poll(SHARD_TIMEOUT):
+            raise ShardError('shard timed out')
+        conn.recv()
+        channel['owed'].discard(conn)
+
+def shard_request(query, destination, expr, candidates, floor, k):
+    """
+    Send one request to every shard and gather the replies as (nonempty,
+    matched candidates, top popularity keys, more) per shard. A shard still
+    working when the request's budget runs out is left behind: its reply is
+    None and is read and dropped before its pipe's next send.
+    """
+    remaining = remaining_budget()
+    deadline = None if remaining is None else time.perf_counter() + remaining
+    channels, channel = _checkout_channel()
+    try:
+        for conn in channel['conns']:
+            _collect_owed(channel, conn)
+            conn.send(('select', (query, destination, expr, candidates, floor, k)))
+        replies = []
+        for conn in channel['conns']:
+            wait = SHARD_TIMEOUT if deadline is None else max(0.0, deadline - time.perf_counter())
+            if not conn.poll(min(wait, SHARD_TIMEOUT)):
+                if wait >= SHARD_TIMEOUT:
+                    raise ShardError('shard timed out')
+                out_of_time()
+                channel['owed'].add(conn)
+                replies.append(None)
+                continue
+            replies.append(conn.recv())
+    except (EOFError, OSError) as e:
+        raise ShardError(f'shard unreachable: {e}')
+    finally:
+        channels.put(channel)
+    for reply in replies:
+        if reply is None:
+            continue
+        if reply[0] == 'filter':
+            raise FilterError(reply[1])
+        if reply[0] != 'ok':
+            raise ShardError(f'shard failed: {reply[1]}')
+    return [reply and reply[1:] for reply in replies]
 
-def load_sample_data():
-    """Load ALL properties from hafh_stories"""
-    global PROPERTIES
+def shard_deltas(rows):
+    """Apply delta records in every shard worker (after this process applied them)"""
     try:
-        with open('data/hafh_stories.json', 'r', encoding='utf-8') as f:
-            stories = json.load(f)  # Load as JSON array
-            count = 0
-            for story in stories:
-                # Load ALL properties (removed limit)
+        channels, channel = _checkout_channel()
+    except ShardError:
+        if SHARDS['pid'] != os.getpid():
+            return
+        raise
+    try:
+        for conn in channel['conns']:
+            _collect_owed(channel, conn)
+            conn.send(('deltas', rows))
+        for conn in channel['conns']:
+            if not conn.poll(SHARD_TIMEOUT):
+                raise ShardError('shard timed out applying deltas')
+            reply = conn.recv()
+            if reply[0] != 'ok':
+                raise ShardError(f'shard failed applying deltas: {reply[1]}')
+    except (EOFError, OSError) as e:
+        raise ShardError(f'shard unreachable: {e}')
+    finally:
+        channels.put(channel)
+
+class ShardedSelection:
+    """
+    A selection held by the shard workers. Offers what /recommend and
+    /search need from a bitmap: truthiness, membership of the candidates
+    it was built with, and matches in popularity order from a position.
+    """
+
+    def __init__(self, query, destination, expr, candidates=(), start=0):
+        self.request = (query, destination, expr)
+        replies = shard_request(query, destination, expr, list(candidates), popularity_floor(start), SHARD_BATCH)
+        self.nonempty = any(reply and reply[0] for reply in replies)
+        self.matched = {i for reply in replies if reply for i in reply[1]}
+        self.start = start
+        self.first = self.rounds(replies)
+
+    @staticmethod
+    def rounds(replies):
+        """(top, more) per shard, or None when a shard missed the deadline"""
+        if None in replies:
+            return None
+        return [(top, more) for _, _, top, more in replies]
+
+    def __bool__(self):
+        return self.nonempty
+
+    def contains(self, i):
+        return i in self.matched
+
+    def indices(self, start=0):
+        if start >= len(POPULAR_ORDER):
+            return
+        floor = popularity_floor(start)
+        rounds = self.first if start == self.start else None
+        while True:
+            if rounds is None:
+                # Out of time: stop at the last complete round (out_of_time() is now set)
+                if out_of_time():
+                    return
                 try:
-                    prop = {
-                        'name': story.get('name', 'Unknown Property'),
-                        'prefecture': story.get('prefecture', ''),
-                        'country': story.get('country', 'JP'),
-                        'description': story.get('ts_stay_text', story.get('ts_text', '')),
-                        'likes': story.get('likes_count', 0)
-                    }
-                    if prop['name'] and prop['name'] != 'Unknown Property':
-                        PROPERTIES.append(prop)
-                        count += 1
-                except:
-                    continue
-        print(f"✅ Loaded {len(PROPERTIES)} properties")
-    except Exception as e:
-        print(f"⚠️  Could not load data: {e}")
-        # Fallback sample data
-        PROPERTIES = [
-            {
-                'name': 'Mountain Retreat Nagano',
-                'prefecture': 'Nagano',
-                'country': 'JP',
-                'description': 'Peaceful mountain property with stunning views. Guests love the serene atmosphere.',
-                'likes': 45
-            },
-            {
-                'name': 'Kyoto Traditional Guesthouse',
-                'prefecture': 'Kyoto',
-                'country': 'JP',
-                'description': 'Authentic Japanese experience in historic Kyoto. Traditional architecture and warm hospitality.',
-                'likes': 38
-            }
-        ]
+                    replies = shard_request(*self.request, [], floor, SHARD_BATCH)
+                except ShardError as e:
+                    print(f"⚠️  Scoring shards failed, selecting in-process: {e}")
+                    stop_shards()
+                    yield from ranked_indices(select_properties(*self.request) or {}, floor)
+                    return
+                rounds = self.rounds(replies)
+                if rounds is None:
+                    return
+            # Everything up to the last key of a cut-short shard is complete
+            bound = min((tuple(top[-1]) for top, more in rounds if more), default=None)
+            for key in heapq.merge(*(map(tuple, top) for top, _ in rounds)):
+                if bound is not None and key > bound:
+                    break
+                yield key[1]
+            if bound is None:
+                return
+            floor, rounds = (bound[0], bound[1] + 1), None
+
+def find_properties(query, destination, expr=None, candidates=(), start=0):
+    """
+    select_properties() across the shard workers when they run (candidates
+    are the indices the caller will test with selection_contains(), start
+    the POPULAR_ORDER position the caller will list matches from).
+    """
+    if SHARDS['pid'] == os.getpid() and (query or destination or expr):
+        try:
+            return ShardedSelection(query, destination, expr, candidates, start)
+        except ShardError as e:
+            print(f"⚠️  Scoring shards failed, selecting in-process: {e}")
+            stop_shards()
+    return select_properties(query, destination, expr)
+
+def selection_contains(selected, i):
+    if isinstance(selected, ShardedSelection):
+        return selected.contains(i)
+    return bitmap_contains(selected, i)
+
+def selection_indices(selected, start=0):
+    """A selection's matches most liked first, from POPULAR_ORDER position start on"""
+    if isinstance(selected, ShardedSelection):
+        return selected.indices(start)
+    if start >= len(POPULAR_ORDER):
+        return iter(())
+    return ranked_indices(selected or {}, popularity_floor(start))
+
+# ----------------------------------------------------------------------------
+# Query understanding
+# ----------------------------------------------------------------------------
+# Voice agents often pass the caller's whole sentence as "query". One
+# Aho-Corasick automaton over intent phrases, place names (prefectures in
+# English and Japanese plus towns seen in property names) and the theme
+# lexicon finds every entity in a single pass over the sentence, so
+# "quiet onsen stay near Nagano" becomes destination=nagano (and its
+# neighbours), theme=onsen, keywords="quiet". Latin patterns only match on
+# word boundaries.
+
+INTENT_LEXICON = {
+    'recommend': ['recommend', 'suggest', 'looking for', 'find me', 'where should', 'おすすめ', '探して'],
+    'more': ['any others', 'anything else', 'more options', 'another one', 'ほかに', '他に'],
+    'similar': ['similar to', 'something like', 'like the last', '似ている', '似た'],
+    'inspiration': ['inspire', 'inspiration', 'popular', 'trending', '人気'],
+    'experiences': ['reviews', 'experiences', 'guests say', '口コミ', '体験'],
+    'nearby': ['near', 'nearby', 'around', 'close to', '近く', '周辺'],
+}
+
+# Filler words dropped from what's left of the sentence
+QUERY_STOPWORDS = {
+    'a', 'an', 'the', 'in', 'at', 'to', 'for', 'with', 'of', 'and', 'or', 'on', 'some', 'somewhere',
+    'i', 'me', 'my', 'we', 'us', 'want', 'would', 'like', 'love', 'please', 'can', 'you', 'show',
+    'stay', 'stays', 'place', 'places', 'trip', 'travel', 'go', 'visit', 'is', 'are', 'there', 'any'
+}
+
+QUERY_AUTOMATON = {'goto': [{}], 'fail': [0], 'out': [[]]}
+
+def build_automaton(patterns):
+    """Aho-Corasick automaton over {pattern: [payload, ...]}"""
+    goto, fail, out = [{}], [0], [[]]
+    for pattern, payloads in patterns.items():
+        state = 0
+        for ch in pattern:
+            nxt = goto[state].get(ch)
+            if nxt is None:
+                nxt = len(goto)
+                goto.append({})
+                fail.append(0)
+                out.append([])
+                goto[state][ch] = nxt
+            state = nxt
+        out[state].append((len(pattern), payloads))
+    # Breadth-first, so every state's failure target is already final
+    pending = list(goto[0].values())
+    for state in pending:
+        for ch, nxt in goto[state].items():
+            pending.append(nxt)
+            f = fail[state]
+            while f and ch not in goto[f]:
+                f = fail[f]
+            fail[nxt] = goto[f].get(ch, 0)
+            out[nxt] = out[nxt] + out[fail[nxt]]
+    return {'goto': goto, 'fail': fail, 'out': out}
+
+def scan_automaton(automaton, text):
+    """(start, end, payloads) for every pattern occurrence in text"""
+    goto, fail, out = automaton['goto'], automaton['fail'], automaton['out']
+    state = 0
+    for pos, ch in enumerate(text):
+        while state and ch not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(ch, 0)
+        for length, payloads in out[state]:
+            yield pos + 1 - length, pos + 1, payloads
+
+def build_query_automaton():
+    """Automaton over intents, place names and theme phrases"""
+    patterns = {}
+
+    def add(pattern, payload):
+        pattern = normalize_text(pattern).strip()
+        if len(pattern) >= (3 if pattern.isascii() else 2):
+            patterns.setdefault(pattern, []).append(payload)
+
+    for intent, phrases in INTENT_LEXICON.items():
+        for phrase in phrases:
+            add(phrase, ('intent', intent))
+    for theme, phrases in THEME_LEXICON.items():
+        add(theme.replace('_', ' '), ('theme', theme))
+        for phrase in phrases:
+            add(phrase, ('theme', theme))
+    # Town tokens that are also theme or intent words ("Nozawa Onsen") stay themes
+    places = {token: key for token, key in PLACE_PREFECTURE.items()
+              if token not in patterns and token not in QUERY_STOPWORDS}
+    places.update(PREFECTURE_ALIASES)
+    places.update((alias, prefecture_key(name)) for alias, name in FACET_ALIASES['prefecture'].items())
+    for place, key in places.items():
+        add(place, ('destination', key))
+    return build_automaton(patterns)
+
+def _on_word_boundary(text, start, end):
+    before = text[start - 1] if start else ' '
+    after = text[end] if end < len(text) else ' '
+    return not ((before.isascii() and before.isalnum()) or (after.isascii() and after.isalnum()))
+
+def parse_utterance(text):
+    """
+    Intent, destination, themes and leftover keywords of a normalized sentence.
+
+    Overlapping matches resolve to the leftmost, then longest, one.
+    """
+    matches = sorted(((start, end, payloads) for start, end, payloads in scan_automaton(QUERY_AUTOMATON, text)
+                      if not text[start:end].isascii() or _on_word_boundary(text, start, end)),
+                     key=lambda m: (m[0], m[0] - m[1]))
+    parsed = {'intent': None, 'destination': None, 'nearby': False, 'themes': [], 'keywords': ''}
+    leftover = []
+    covered = 0
+    for start, end, payloads in matches:
+        if start < covered:
+            continue
+        leftover.append(text[covered:start])
+        covered = end
+        for kind, value in payloads:
+            if kind == 'intent' and value == 'nearby':
+                parsed['nearby'] = True
+            elif kind == 'intent':
+                parsed['intent'] = parsed['intent'] or value
+            elif kind == 'destination':
+                parsed['destination'] = parsed['destination'] or value
+            elif value not in parsed['themes']:
+                parsed['themes'].append(value)
+    leftover.append(text[covered:])
+    rest = ' '.join(leftover)
+    words = [t for t in tokenize(rest) if t not in QUERY_STOPWORDS]
+    words += [run for run in _CJK_RUN_RE.findall(rest) if len(run) >= 2]
+    parsed['keywords'] = ' '.join(words)
+    return parsed
+
+def understand_query(text):
+    """
+    parse_utterance() on the sentence as heard, then on its spell-corrected
+    leftovers (correcting first would turn filler words like "near" into
+    vocabulary terms)
+    """
+    parsed = parse_utterance(text)
+    corrected = correct_query(parsed['keywords'])
+    if corrected != parsed['keywords']:
+        again = parse_utterance(corrected)
+        parsed['intent'] = parsed['intent'] or again['intent']
+        parsed['destination'] = parsed['destination'] or again['destination']
+        parsed['nearby'] = parsed['nearby'] or again['nearby']
+        parsed['themes'] += [t for t in again['themes'] if t not in parsed['themes']]
+        parsed['keywords'] = again['keywords']
+    return parsed
+
+def utterance_filter(parsed):
+    """Filter expression for the destination and themes of a parsed sentence, or None"""
+    parts = [{'theme': theme} for theme in parsed['themes']]
+    if parsed['destination']:
+        rings = PREFECTURE_RINGS.get(parsed['destination'])
+        if parsed['nearby'] and rings:
+            parts.append({'destination': rings[0] + rings[1]})
+        else:
+            parts.append({'destination': parsed['destination']})
+    if not parts:
+        return None
+    return parts[0] if len(parts) == 1 else {'and': parts}
+
+def dataset_stats():
+    """Headline numbers for the landing and details pages"""
+    return {
+        'stories': len(STORIES),
+        'properties': len(PROPERTIES),
+        'countries': len(FACET_INDEX['country']),
+        'locations': len(FACET_INDEX['prefecture'])
+    }
+
+# ----------------------------------------------------------------------------
+# Prebuilt index artifact
+# ----------------------------------------------------------------------------
+# `python -m webhook_server build-index data/hafh_stories.json` runs the whole
+# load pipeline once, across all cores, and writes one file: a JSON header
+# line (format version, build settings, source checksum, payload sha256)
+# followed by the pickled stores and indexes. At boot the server loads it
+# instead of rebuilding, and refuses it (falling back to a fresh build) when
+# the format version, settings, checksum or source data don't match.
+
+# Bump whenever the shape of any stored index changes
+INDEX_FORMAT_VERSION = 6
+INDEX_PATH = os.environ.get('INDEX_PATH') or os.path.splitext(DATA_SOURCES or DATA_PATH)[0] + '.index'
+
+class IndexArtifactError(ValueError):
+    """Index artifact is missing, corrupt or built for different code/data"""
+
+def index_build_settings():
+    """Settings baked into the indexes; an artifact built with others is stale"""
+    return {
+        'romaji_column': ROMAJI_COLUMN,
+        'romaji': kana_to_romaji('きょうと おおさか きゅうしゅう'),
+        'spell': [SPELL_MAX_DISTANCE, SPELL_PREFIX_LENGTH, SPELL_MIN_TERM_LENGTH, SPELL_PLACE_WEIGHT],
+        'minhash': [MINHASH_BINS, MINHASH_BANDS, MINHASH_SHINGLE_BYTES, MINHASH_MAX_BYTES],
+        'knn': [KNN_K, KNN_TERMS_PER_DOC, KNN_PREFECTURE_BONUS, KNN_POPULARITY_BONUS],
+        'themes': THEME_LEXICON,
+        'sentences': SENTENCE_END_RE.pattern
+    }
+
+def file_sha256(path):
+    """Hex sha256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_identity(source):
+    """What an artifact records about one source, to tell whether it still matches"""
+    return {'path': os.path.abspath(source['path']), 'format': source['format'], 'kind': source['kind'],
+            'fields': source['fields'], 'size': os.path.getsize(source['path']),
+            'sha256': file_sha256(source['path'])}
+
+def write_index_artifact(path, sources):
+    """Write the loaded stores and indexes to `path` (atomically)"""
+    payload = pickle.dumps({
+        'stories': STORIES,
+        'properties': PROPERTIES,
+        'popular_order': POPULAR_ORDER,
+        'spell_index': SPELL_INDEX,
+        'minhash_index': MINHASH_INDEX,
+        'knn_index': KNN_INDEX,
+        'prefecture_index': PREFECTURE_INDEX,
+        'place_prefecture': PLACE_PREFECTURE,
+        'facet_index': FACET_INDEX,
+        'facet_aliases': FACET_ALIASES,
+        'term_postings': TERM_POSTINGS,
+        'term_offsets': TERM_OFFSETS,
+        'theme_flags': THEME_FLAGS,
+        'story_theme_flags': STORY_THEME_FLAGS,
+        'story_sentences': STORY_SENTENCES,
+        'sentence_ends': SENTENCE_ENDS,
+        'sentence_flags': SENTENCE_FLAGS
+    }, protocol=pickle.HIGHEST_PROTOCOL)
+    header = {
+        'format': 'kabuk-index',
+        'version': INDEX_FORMAT_VERSION,
+        'settings': index_build_settings(),
+        'dataset_version': DATASET_VERSION,
+        'sources': [source_identity(source) for source in sources],
+        'properties': len(PROPERTIES),
+        'stories': len(STORIES),
+        'payload_sha256': hashlib.sha256(payload).hexdigest(),
+        'created_at': datetime.now().isoformat()
+    }
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(json.dumps(header).encode('utf-8') + b'\n')
+        f.write(payload)
+    os.replace(tmp_path, path)
+    return header
+
+def load_index_artifact(path):
+    """Install the stores and indexes from an artifact; IndexArtifactError if it doesn't fit"""
+    global STORIES, PROPERTIES, POPULAR_ORDER, SPELL_INDEX, MINHASH_INDEX, KNN_INDEX, DATASET_VERSION
+    global PREFECTURE_INDEX, PLACE_PREFECTURE, FACET_INDEX, FACET_ALIASES, TERM_POSTINGS, TERM_OFFSETS
+    global THEME_FLAGS, STORY_THEME_FLAGS, STORY_SENTENCES, SENTENCE_ENDS, SENTENCE_FLAGS
+    with open(path, 'rb') as f:
+        try:
+            header = json.loads(f.readline())
+        except ValueError:
+            raise IndexArtifactError('unreadable header')
+        if header.get('format') != 'kabuk-index' or header.get('version') != INDEX_FORMAT_VERSION:
+            raise IndexArtifactError(
+                f"format version {header.get('version')}, this server needs {INDEX_FORMAT_VERSION}")
+        if header.get('settings') != json.loads(json.dumps(index_build_settings())):
+            raise IndexArtifactError('built with different index settings')
+        # Source files next to the artifact must be the ones (and mappings) it was built from
+        try:
+            sources = data_sources()
+        except (OSError, ValueError):
+            sources = []
+        built = {entry['path']: entry for entry in header['sources']}
+        for source in sources:
+            if os.path.exists(source['path']) and built.get(os.path.abspath(source['path'])) != source_identity(source):
+                raise IndexArtifactError(f"{source['path']} changed since the artifact was built")
+        payload = f.read()
+    if hashlib.sha256(payload).hexdigest() != header['payload_sha256']:
+        raise IndexArtifactError('checksum mismatch')
+    data = pickle.loads(payload)
+    STORIES = data['stories']
+    PROPERTIES = data['properties']
+    POPULAR_ORDER = data['popular_order']
+    SPELL_INDEX = data['spell_index']
+    MINHASH_INDEX = data['minhash_index']
+    KNN_INDEX = data['knn_index']
+    PREFECTURE_INDEX = data['prefecture_index']
+    PLACE_PREFECTURE = data['place_prefecture']
+    FACET_INDEX = data['facet_index']
+    FACET_ALIASES = data['facet_aliases']
+    TERM_POSTINGS = data['term_postings']
+    TERM_OFFSETS = data['term_offsets']
+    THEME_FLAGS = data['theme_flags']
+    STORY_THEME_FLAGS = data['story_theme_flags']
+    STORY_SENTENCES = data['story_sentences']
+    SENTENCE_ENDS = data['sentence_ends']
+    SENTENCE_FLAGS = data['sentence_flags']
+    build_derived_indexes()
+    DATASET_VERSION = header['dataset_version']
+    print(f"✅ Loaded index artifact {path} ({len(PROPERTIES)} properties, built {header['created_at']})")
+    return header
+
+def load_data(workers=INDEX_WORKERS):
+    """Load the prebuilt artifact when there is a matching one, else build from DATA_PATH"""
+    if os.path.exists(INDEX_PATH):
+        warmup_plan(['artifact', 'pages'])
+        warmup_stage('artifact')
+        try:
+            load_index_artifact(INDEX_PATH)
+            return
+        except (IndexArtifactError, OSError, KeyError, pickle.UnpicklingError) as e:
+            print(f"⚠️  Refusing index artifact {INDEX_PATH}: {e}")
+    warmup_plan(WARMUP_BUILD_STAGES + ['pages'])
+    load_sample_data(workers)
+    build_indexes(workers)
+
+def build_index_main(argv):
+    """CLI: python -m webhook_server build-index SOURCE [--sources] [-o OUTPUT] [--workers N]"""
+    global DATA_PATH, DATA_SOURCES
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m webhook_server build-index',
+                                     description='Build the index artifact the server loads at boot')
+    parser.add_argument('source', help='stories file (JSON array, JSONL, CSV, TSV or Parquet)')
+    parser.add_argument('--sources', action='store_true',
+                        help='SOURCE is a DATA_SOURCES list of sources to merge instead')
+    parser.add_argument('-o', '--output', help='artifact path (default: SOURCE with an .index extension)')
+    parser.add_argument('--workers', type=int, default=INDEX_WORKERS, help='processes used for building')
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.source):
+        parser.error(f"{args.source} not found")
+
+    start = time.perf_counter()
+    if args.sources:
+        DATA_SOURCES = args.source
+    else:
+        DATA_PATH, DATA_SOURCES = args.source, ''
+    # A bad export must fail the build, not ship an artifact of the fallback sample
+    try:
+        sources = data_sources()
+        load_sample_data(args.workers, strict=True)
+    except IngestError as e:
+        parser.error(str(e))
+    build_indexes(args.workers)
+    output = args.output or os.path.splitext(args.source)[0] + '.index'
+    header = write_index_artifact(output, sources)
+    print(f"✅ Wrote {output} ({os.path.getsize(output) // 1024} KiB, {header['properties']} properties, "
+          f"{time.perf_counter() - start:.1f}s)")
+    return 0
 
 def build_index_html():
     """Build investor-focused landing page with centered widget"""
+    stats = dataset_stats()
     return f"""
 <!DOCTYPE html>
 <html lang="en">
@@ -246,15 +3388,15 @@ def build_index_html():
 
         <div class="stats-bar">
             <div class="stat">
-                <span class="stat-value">10,230+</span>
+                <span class="stat-value">{stats['stories']:,}</span>
                 <span class="stat-label">Travel Stories</span>
             </div>
             <div class="stat">
-                <span class="stat-value">48</span>
+                <span class="stat-value">{stats['countries']}</span>
                 <span class="stat-label">Countries</span>
             </div>
             <div class="stat">
-                <span class="stat-value">1,630+</span>
+                <span class="stat-value">{stats['locations']:,}</span>
                 <span class="stat-label">Locations</span>
             </div>
             <div class="stat">
@@ -330,6 +3472,7 @@ def build_index_html():
 
 def build_details_html():
     """Build technical details page with inline SVG icons"""
+    stats = dataset_stats()
     return f"""
     <!DOCTYPE html>
     <html>
@@ -352,32 +3495,40 @@ def build_details_html():
     <body>
         <div class="container">
             <h1>KABUK AI API - Technical Documentation</h1>
-            <p><span class="status">OPERATIONAL</span> | {len(PROPERTIES)} properties loaded</p>
+            <p><span class="status">OPERATIONAL</span> | {len(PROPERTIES)} properties loaded from {len(STORIES)} stories</p>
 
             <h2>API Endpoints</h2>
 
             <div class="endpoint primary">
                 <h3><span class="method post">POST</span> /recommend <em>(Primary)</em></h3>
                 <p><strong>Purpose:</strong> Intelligent travel recommendations based on natural language preferences</p>
-                <p><strong>Parameters:</strong> <code>query</code> (string, required), <code>destination</code> (string, optional)</p>
+                <p><strong>Parameters:</strong> <code>query</code> (string, required - a whole sentence works; places and themes in it become filters), <code>destination</code> (string, optional), <code>email</code> or <code>conversation_id</code> (string, optional - personalizes using saved progress), <code>cursor</code> (string, optional - <code>next_cursor</code> from a previous response for more results), filters (see below)</p>
                 <p><strong>Returns:</strong> Personalized property recommendations + popular inspiration</p>
             </div>
 
             <div class="endpoint">
                 <h3><span class="method post">POST</span> /search</h3>
                 <p><strong>Purpose:</strong> Search properties by keyword and location</p>
-                <p><strong>Parameters:</strong> <code>query</code>, <code>destination</code></p>
+                <p><strong>Parameters:</strong> <code>query</code>, <code>destination</code>, <code>cursor</code> (optional, for the next page), filters (see below)</p>
+            </div>
+
+            <div class="endpoint">
+                <h3>Filters (/recommend, /search, /inspiration, /facets)</h3>
+                <p><strong>Shorthand:</strong> <code>country</code>, <code>prefecture</code>, <code>theme</code>, <code>style</code>, <code>min_likes</code>, <code>max_likes</code> - all ANDed</p>
+                <p><strong>Expression:</strong> <code>filter</code> with leaves <code>country</code>, <code>prefecture</code>, <code>theme</code>, <code>keyword</code>, <code>destination</code> (value or list), <code>likes</code> (<code>min</code>/<code>max</code>), combined with <code>and</code>, <code>or</code>, <code>not</code>, e.g. <code>{{"and": [{{"theme": "onsen"}}, {{"not": {{"prefecture": "Tokyo"}}}}]}}</code></p>
             </div>
 
             <div class="endpoint">
                 <h3><span class="method post">POST</span> /experiences</h3>
                 <p><strong>Purpose:</strong> Guest experiences and reviews</p>
+                <p><strong>Parameters:</strong> <code>theme</code> (string, optional - e.g. <code>onsen</code>, <code>温泉</code>, <code>pet friendly</code>)</p>
                 <p><strong>Returns:</strong> Highly-rated stays with guest testimonials</p>
             </div>
 
             <div class="endpoint">
                 <h3><span class="method post">POST</span> /gallery</h3>
                 <p><strong>Purpose:</strong> Photo-rich property showcases</p>
+                <p><strong>Parameters:</strong> <code>theme</code> (string, optional)</p>
                 <p><strong>Returns:</strong> Visually appealing stays with image galleries</p>
             </div>
 
@@ -387,17 +3538,48 @@ def build_details_html():
                 <p><strong>Returns:</strong> Most-liked properties and destinations</p>
             </div>
 
+            <div class="endpoint">
+                <h3><span class="method post">POST</span> /similar</h3>
+                <p><strong>Purpose:</strong> "More like this" - nearest neighbours of a property</p>
+                <p><strong>Parameters:</strong> <code>pid</code> or <code>name</code>, <code>limit</code> (optional, max 10)</p>
+            </div>
+
+            <div class="endpoint">
+                <h3><span class="method post">POST</span> /facets</h3>
+                <p><strong>Purpose:</strong> Counts by country, prefecture and theme ("212 stays in Kyoto, 40 with onsen")</p>
+                <p><strong>Parameters:</strong> <code>query</code> and filters (all optional), <code>limit</code> (values per facet, default 10)</p>
+            </div>
+
+            <div class="endpoint">
+                <h3><span class="method post">POST</span> /deltas</h3>
+                <p><strong>Purpose:</strong> Apply story upserts, removals and likes changes to the live data (enabled by <code>DELTA_TOKEN</code>)</p>
+                <p><strong>Parameters:</strong> <code>deltas</code>: list of <code>{{"op": "upsert" | "remove" | "likes", "tsid": ...}}</code> records with export columns; <code>Authorization: Bearer &lt;DELTA_TOKEN&gt;</code></p>
+            </div>
+
             <div class="endpoint">
                 <h3><span class="method get">GET</span> /health</h3>
                 <p><strong>Purpose:</strong> Service health check</p>
                 <p><strong>Returns:</strong> System status and property count</p>
             </div>
 
+            <div class="endpoint">
+                <h3><span class="method get">GET</span> /health/live, /health/ready</h3>
+                <p><strong>Purpose:</strong> Liveness and readiness probes</p>
+                <p><strong>Returns:</strong> <code>/health/live</code> is 200 once the process is up; <code>/health/ready</code> is 503 with warm-up stage and progress until data and indexes are loaded</p>
+            </div>
+
+            <div class="endpoint">
+                <h3><span class="method get">GET</span> /metrics</h3>
+                <p><strong>Purpose:</strong> Prometheus scrape endpoint</p>
+                <p><strong>Returns:</strong> Per-route request counts, errors, latency histograms, cache and index stats</p>
+            </div>
+
             <h2>Dataset Statistics</h2>
             <ul>
                 <li><strong>Properties:</strong> {len(PROPERTIES)}</li>
+                <li><strong>Travel Stories:</strong> {len(STORIES)}</li>
                 <li><strong>Data Sources:</strong> HafH travel stories, BigQuery export, property metadata</li>
-                <li><strong>Coverage:</strong> 48 countries, 1,630+ unique locations</li>
+                <li><strong>Coverage:</strong> {stats['countries']} countries, {stats['locations']:,} unique locations</li>
                 <li><strong>Media Assets:</strong> 47,000+ images</li>
             </ul>
 
@@ -428,14 +3610,15 @@ def index():
     """Landing page - cached for performance"""
     # Return cached HTML with performance headers
     response = app.make_response(CACHED_INDEX_HTML)
-    response.headers['Cache-Control'] = 'public, max-age=300'  # Cache for 5 minutes
+    # Cache for 5 minutes, but not the warm-up copy (its stats are still empty)
+    response.headers['Cache-Control'] = 'public, max-age=300' if WARMUP['ready'] else 'no-store'
     response.headers['Content-Type'] = 'text/html; charset=utf-8'
     return response
 
 @app.route('/details', methods=['GET'])
 def details():
     """Technical details and API documentation"""
-    response = app.make_response(build_details_html())
+    response = app.make_response(CACHED_DETAILS_HTML or build_details_html())
     response.headers['Content-Type'] = 'text/html; charset=utf-8'
     return response
 
@@ -444,205 +3627,1184 @@ def favicon():
     """Return 204 No Content for favicon to prevent 404 errors"""
     return '', 204
 
+def warm_caches():
+    """Fill the caches that depend on loaded data"""
+    global CACHED_INDEX_HTML, CACHED_DETAILS_HTML
+    CACHED_INDEX_HTML = build_index_html()
+    CACHED_DETAILS_HTML = build_details_html()
+    build_degraded_responses()
+
+def build_degraded_responses():
+    """Serialize the answers shed requests get: the most popular (distinct) stays"""
+    picked = new_diversity_filter()
+    top = [i for i in POPULAR_ORDER[:DIVERSITY_SCAN_LIMIT] if admit_diverse(picked, i)][:SEARCH_PAGE_SIZE]
+    common = {'success': True, 'degraded': True, 'message': DEGRADED_MESSAGE}
+    DEGRADED_RESPONSES.update((route, json.dumps(dict(common, **body), ensure_ascii=False)) for route, body in {
+        '/recommend': {
+            'understanding': 'Showing popular stays',
+            'personalized': False,
+            'recommendations': {
+                'properties': [{'pid': PROPERTIES[i]['pid'], 'name': PROPERTIES[i]['name'],
+                                'location': PROPERTIES[i]['prefecture'], 'highlight': snippet(PROPERTIES[i])}
+                               for i in top[:RECOMMEND_PAGE_SIZE]],
+                'inspiration': [{'title': f"Popular: {PROPERTIES[i]['name']}", 'location': PROPERTIES[i]['prefecture'],
+                                 'likes': PROPERTIES[i]['likes'], 'why': 'Highly rated by guests'}
+                                for i in top[RECOMMEND_PAGE_SIZE:]]
+            },
+            'next_cursor': None
+        },
+        '/search': {
+            'properties': [dict(public_property(PROPERTIES[i]), highlight=snippet(PROPERTIES[i])) for i in top],
+            'understanding': 'Showing popular properties',
+            'next_cursor': None
+        },
+        '/inspiration': {
+            'stories': [{'title': PROPERTIES[i]['name'], 'location': PROPERTIES[i]['prefecture'],
+                         'popularity': PROPERTIES[i]['likes'], 'story': snippet(PROPERTIES[i], budget=120)}
+                        for i in top],
+            'count': len(top)
+        }
+    }.items())
+
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
+    """Health check endpoint (always 200 while the process is up; see 'ready')"""
     return jsonify({
-        'status': 'healthy',
+        'status': 'healthy' if WARMUP['ready'] else 'warming_up',
+        'ready': WARMUP['ready'],
         'properties_loaded': len(PROPERTIES),
+        'stories_loaded': len(STORIES),
+        'scoring_shards': len(SHARDS['conns']) if SHARDS['pid'] == os.getpid() else 0,
+        'deltas': dict(DELTA_STATS),
+        'overloaded': ADMISSION['overloaded'],
         'endpoints': {
             '/search': 'Property search',
             '/recommend': 'MAIN - Intelligent recommendations (use this!)',
             '/experiences': 'Guest experiences and reviews',
             '/gallery': 'Photo-rich stays',
-            '/inspiration': 'Popular travel stories'
+            '/inspiration': 'Popular travel stories',
+            '/similar': 'Properties like a given one',
+            '/facets': 'Counts by country, prefecture and theme',
+            '/deltas': 'Live story and likes updates (needs DELTA_TOKEN)',
+            '/metrics': 'Prometheus metrics',
+            '/health/live': 'Liveness probe',
+            '/health/ready': 'Readiness probe with warm-up progress'
         }
     })
 
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    """Liveness: the process is up and serving"""
+    return jsonify({'status': 'alive'})
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    """Readiness: data loaded, indexes built and caches warm (503 with progress until then)"""
+    status = readiness_status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint - request counts, latency histograms, cache and index stats"""
+    response = app.make_response(render_metrics(collect_metrics()))
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+# ============================================================================
+# PAGINATION
+# ============================================================================
+# "Any others?" follow-ups pass back the next_cursor from the previous
+# response. A cursor is an opaque token holding the (corrected) query, the
+# dataset version and where the previous page stopped in the scan, so the
+# next page resumes there instead of rescanning from the top. Cursors pass
+# through the agent, so they are signed with CURSOR_SECRET (tampered ones
+# are rejected) and name a personalized caller only by a keyed hash.
+
+SEARCH_PAGE_SIZE = 5
+RECOMMEND_PAGE_SIZE = 3
+
+# Set it to the same value on every worker; the random fallback only
+# verifies cursors issued by this process
+CURSOR_SECRET = (os.environ.get('CURSOR_SECRET') or secrets.token_hex(32)).encode('utf-8')
+CURSOR_SIGNATURE_BYTES = 16
+
+# Caller hash in a cursor -> conversation state key it stands for; least
+# recently used entries are dropped past CURSOR_CALLERS_MAX callers (their
+# cursors still page, without personalization)
+CURSOR_CALLERS = OrderedDict()
+CURSOR_CALLERS_MAX = int(os.environ.get('CURSOR_CALLERS_MAX', '10000'))
+_CURSOR_CALLERS_LOCK = threading.Lock()
+
+class CursorError(ValueError):
+    """Raised for malformed, tampered or stale pagination cursors"""
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def cursor_signature(raw):
+    return hmac.new(CURSOR_SECRET, raw, hashlib.sha256).digest()[:CURSOR_SIGNATURE_BYTES]
+
+def cursor_caller(state_key):
+    """Opaque stand-in for a conversation state key (an email address) in a cursor"""
+    token = hmac.new(CURSOR_SECRET, f"caller:{state_key}".encode('utf-8'), hashlib.sha256).hexdigest()[:24]
+    with _CURSOR_CALLERS_LOCK:
+        CURSOR_CALLERS[token] = state_key
+        CURSOR_CALLERS.move_to_end(token)
+        while len(CURSOR_CALLERS) > CURSOR_CALLERS_MAX:
+            CURSOR_CALLERS.popitem(last=False)
+    return token
+
+def cursor_state_key(token):
+    """The conversation state key behind a cursor's caller hash; None once forgotten"""
+    with _CURSOR_CALLERS_LOCK:
+        state_key = CURSOR_CALLERS.get(token)
+        if state_key is not None:
+            CURSOR_CALLERS.move_to_end(token)
+    return state_key
+
+def encode_cursor(route, **state):
+    """Opaque, signed URL-safe token for the next page of a route's results"""
+    payload = dict(state, r=route, v=DATASET_VERSION)
+    raw = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return f"{_b64encode(raw)}.{_b64encode(cursor_signature(raw))}"
+
+def decode_cursor(token, route):
+    """Validate a cursor's signature, route and dataset; raises CursorError"""
+    try:
+        body, signature = str(token).split('.')
+        raw = _b64decode(body)
+        if not hmac.compare_digest(_b64decode(signature), cursor_signature(raw)):
+            raise CursorError('Invalid cursor')
+        payload = json.loads(raw.decode('utf-8'))
+    except (ValueError, UnicodeDecodeError):
+        raise CursorError('Invalid cursor')
+    if not isinstance(payload, dict) or payload.get('r') != route or not isinstance(payload.get('o'), int):
+        raise CursorError('Invalid cursor')
+    if payload.get('v') != DATASET_VERSION:
+        raise CursorError('Cursor expired: the property data has changed, please search again')
+    return payload
+
 @app.route('/search', methods=['POST'])
 def search():
     """Search properties (basic version for demo)"""
     try:
-        data = request.get_json() or {}
-        query = data.get('query', '').lower()
-        destination = data.get('destination', '').lower()
+        data = parse_request_json()
+        cursor = decode_cursor(data['cursor'], '/search') if data.get('cursor') else None
+        if cursor:
+            query, destination, expr = cursor.get('q', ''), cursor.get('d', ''), cursor.get('f')
+            heard = (query, destination)
+        else:
+            query = normalize_text(data.get('query', ''))
+            destination = normalize_text(data.get('destination', ''))
+            expr = request_filter(data)
 
-        print(f"🔍 SEARCH - Query: '{query}', Destination: '{destination}'")
+            # Fix speech-to-text typos before matching
+            heard = (query, destination)
+            query, destination = correct_query(query), correct_query(destination)
+        mark_phase('correct')
 
-        # Simple keyword matching for demo
+        # Keyword or destination match, narrowed by any filters, resuming where the last page stopped
         results = []
-        for prop in PROPERTIES:
-            matches = False
-            if query and query in prop['description'].lower():
-                matches = True
-            if destination and destination in prop['prefecture'].lower():
-                matches = True
-            if matches:
-                results.append(prop)
-                if len(results) >= 5:
-                    break
+        next_offset = None
+        offset = cursor['o'] if cursor else 0
+        selected = find_properties(query, destination, expr, start=offset)
+        resume = offset
+        for i in selection_indices(selected, offset):
+            if out_of_time():
+                next_offset = popularity_position(i)
+                break
+            resume = popularity_position(i) + 1
+            results.append(PROPERTIES[i])
+            if len(results) >= SEARCH_PAGE_SIZE:
+                next_offset = resume
+                break
+        else:
+            # Shard rounds cut short by the deadline end the matches early
+            if g.partial:
+                next_offset = resume
 
-        # If no matches, return random sample
-        if not results:
-            results = random.sample(PROPERTIES, min(5, len(PROPERTIES)))
+        # If no matches, widen to nearby prefectures, else a random sample (first page only)
+        nearby = []
+        if not results and not cursor and not g.partial:
+            indices, nearby = nearby_properties(destination, SEARCH_PAGE_SIZE)
+            if not indices:
+                indices = random.sample(POPULAR_ORDER, min(SEARCH_PAGE_SIZE, len(POPULAR_ORDER)))
+            results = [PROPERTIES[i] for i in indices]
+        focus = snippet_focus(query, filter_themes(expr))
+        mark_phase('match')
 
         response = {
             'success': True,
-            'properties': results[:5],
-            'understanding': f"Searching for: {query}" if query else "Showing popular properties"
+            'properties': [dict(public_property(prop), highlight=snippet(prop, focus)) for prop in results],
+            'understanding': f"Searching for: {query}" if query else "Showing popular properties",
+            'next_cursor': (encode_cursor('/search', q=query, d=destination, f=expr, o=next_offset)
+                            if next_offset is not None and next_offset < len(POPULAR_ORDER) else None)
         }
+        if nearby:
+            response['nearby'] = {'destination': destination, 'prefectures': nearby}
+        if (query, destination) != heard:
+            response['corrected'] = {'query': query, 'destination': destination}
 
-        print(f"✅ Found {len(results)} matches")
-        return jsonify(response)
+        log_event('/search', 'search', query=query, destination=destination, matches=len(results),
+                  filtered=expr is not None, page=bool(cursor), partial=g.partial)
+        return timed_jsonify(response, data)
 
+    except (CursorError, FilterError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
-        print(f"❌ ERROR: {str(e)}")
+        log_event('/search', 'error', level='error', error=str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# ============================================================================
+# PERSONALIZATION
+# ============================================================================
+
+# Maximum number of preference-matched properties kept per user
+PERSONALIZATION_POOL_SIZE = 200
+
+# Description keywords that signal a stay fits a budget level
+BUDGET_KEYWORDS = {
+    'low': ['budget', 'cheap', 'affordable', 'hostel', 'dorm', 'guesthouse'],
+    'mid': ['hotel', 'guesthouse', 'cozy', 'comfortable'],
+    'high': ['luxury', 'premium', 'suite', 'ryokan', 'private onsen', 'boutique']
+}
+BUDGET_ALIASES = {'budget': 'low', 'cheap': 'low', 'medium': 'mid', 'mid-range': 'mid',
+                  'luxury': 'high', 'premium': 'high'}
+
+def find_conversation_state(email, conversation_id):
+    """Look up saved state by email first, then conversation_id. Returns (key, state)"""
+    if email:
+        state = CONVERSATION_STATE.get(f"email:{email}")
+        if state:
+            return f"email:{email}", state
+    if conversation_id:
+        state = CONVERSATION_STATE.get(f"conv:{conversation_id}")
+        if state:
+            return f"conv:{conversation_id}", state
+    return None, None
+
+def invalidate_personalization(email, conversation_id):
+    """Drop cached candidates for a user whose conversation state changed"""
+    with _PERSONALIZATION_LOCK:
+        if email:
+            PERSONALIZATION_CACHE.pop(f"email:{email}", None)
+        if conversation_id:
+            PERSONALIZATION_CACHE.pop(f"conv:{conversation_id}", None)
+
+def get_personal_candidates(state_key, state):
+    """
+    Preference-matched properties for one user, best first, viewed excluded.
+
+    Built with one pass over PROPERTIES the first time a user is seen and
+    cached until their state changes, so later /recommend calls only filter
+    this small list.
+    """
+    with _PERSONALIZATION_LOCK:
+        cached = PERSONALIZATION_CACHE.get(state_key)
+        if cached is not None:
+            PERSONALIZATION_CACHE.move_to_end(state_key)
+    record_cache('personalization', cached is not None)
+    if cached is not None:
+        return cached
+
+    prefs = state.get('preferences') or {}
+    viewed = set(str(v) for v in state.get('viewed_properties') or [])
+    destination = normalize_text(str(prefs.get('destination') or '')).strip()
+    style_terms = [t for t in re.split(r'[\s,/、]+', normalize_text(str(prefs.get('style') or '')))
+                   if len(t) >= 3 or (t and not t.isascii())]
+    budget = normalize_text(str(prefs.get('budget') or '')).strip()
+    budget_terms = BUDGET_KEYWORDS.get(BUDGET_ALIASES.get(budget, budget), [])
+
+    scored = []
+    if destination or style_terms or budget_terms:
+        for i, prop in enumerate(PROPERTIES):
+            if not i & 1023 and out_of_time():
+                break
+            if prop['pid'] in viewed or prop['name'] in viewed:
+                continue
+            desc = prop['search_description']
+            score = 0
+            if destination and destination in prop['search_prefecture']:
+                score += 3
+            score += 2 * sum(1 for term in style_terms if term in desc)
+            if any(term in desc for term in budget_terms):
+                score += 1
+            if score:
+                scored.append((score, prop['likes'], i))
+        scored.sort(reverse=True)
+
+    candidates = [i for _, _, i in scored[:PERSONALIZATION_POOL_SIZE]]
+    cached = {
+        'candidates': candidates,
+        'candidate_set': set(candidates),
+        'viewed': viewed
+    }
+    # A scan cut short by the time budget is used once, not cached
+    if not g.partial:
+        with _PERSONALIZATION_LOCK:
+            PERSONALIZATION_CACHE[state_key] = cached
+            while len(PERSONALIZATION_CACHE) > PERSONALIZATION_CACHE_MAX:
+                PERSONALIZATION_CACHE.popitem(last=False)
+    return cached
+
 @app.route('/recommend', methods=['POST'])
 def recommend():
     """Main recommendation endpoint - combines search + inspiration"""
     try:
-        data = request.get_json() or {}
-        query = data.get('query', '').lower()
-        destination = data.get('destination', '').lower()
+        data = parse_request_json()
+        cursor = decode_cursor(data['cursor'], '/recommend') if data.get('cursor') else None
+        if cursor:
+            query, destination, expr = cursor.get('q', ''), cursor.get('d', ''), cursor.get('f')
+            heard = (query, destination)
+            parsed = None
+        else:
+            query = normalize_text(data.get('query', ''))
+            destination = normalize_text(data.get('destination', ''))
+            expr = request_filter(data)
+            heard = (query, destination)
 
-        print("="*80)
-        print(f"📞 RECOMMEND - Query: '{query}', Destination: '{destination}'")
+            # Whole sentences in "query": places and themes become indexed filters
+            parsed = understand_query(query) if query else None
+            if parsed and (parsed['destination'] or parsed['themes']):
+                if destination:
+                    parsed['destination'] = None  # the agent's explicit destination wins
+                found = utterance_filter(parsed)
+                expr = {'and': [expr, found]} if expr and found else (expr or found)
+                query = parsed['keywords']
+                heard = (query, destination)
+            else:
+                parsed = None
 
-        # Search for matching properties
-        properties = []
-        for prop in PROPERTIES:
-            matches = False
-            if query and (query in prop['description'].lower() or query in prop['name'].lower()):
-                matches = True
-            if destination and (destination in prop['prefecture'].lower() or destination in prop.get('address', '').lower()):
-                matches = True
-            if matches:
-                # Add highlight snippet
-                desc = prop['description']
-                properties.append({
-                    'name': prop['name'],
-                    'location': prop['prefecture'],
-                    'highlight': desc[:200] + '...' if len(desc) > 200 else desc
-                })
-                if len(properties) >= 3:
+            # Fix speech-to-text typos before matching
+            query, destination = correct_query(query), correct_query(destination)
+        mark_phase('correct')
+
+        # Returning callers get candidates re-ranked by their saved preferences
+        personal = None
+        state_key, state = None, None
+        if cursor:
+            state_key = cursor_state_key(cursor.get('u'))
+            state = CONVERSATION_STATE.get(state_key) if state_key else None
+        elif data.get('email') or data.get('conversation_id'):
+            state_key, state = find_conversation_state(data.get('email'), data.get('conversation_id'))
+        if state:
+            personal = get_personal_candidates(state_key, state)
+        viewed = personal['viewed'] if personal else set()
+        mark_phase('personalize')
+
+        # None when the request has no query, destination or filter
+        stage, offset = (cursor['s'], cursor['o']) if cursor else ('c' if personal else 'p', 0)
+        candidates = personal['candidates'] if personal and stage == 'c' else ()
+        selected = find_properties(query, destination, expr, candidates, offset if stage == 'p' else 0)
+        if not cursor and parsed and query and not selected:
+            # Leftover words of a sentence are a preference, not a requirement
+            query = ''
+            heard = (query, heard[1])
+            selected = find_properties(query, destination, expr, candidates)
+
+        # Search for matching properties: preference matches first ('c' stage),
+        # then a scan of everything else ('p' stage). Cursors resume either stage.
+        # Near-duplicate descriptions are held back so results don't read the
+        # same; they only fill a page when nothing more distinct matched
+        chosen = []
+        duplicates = []
+        picked = new_diversity_filter()
+        next_page = None
+        if stage == 'c':
+            for k in range(offset, len(candidates)):
+                if out_of_time():
+                    next_page = ('c', k)
+                    break
+                i = candidates[k]
+                if selected is None or selection_contains(selected, i):
+                    if not admit_diverse(picked, i):
+                        duplicates.append(i)
+                        continue
+                    chosen.append(i)
+                    if len(chosen) >= RECOMMEND_PAGE_SIZE:
+                        next_page = ('c', k + 1)
+                        break
+            else:
+                stage, offset = 'p', 0
+        if stage == 'p' and next_page is None and selected is not None:
+            candidate_set = personal['candidate_set'] if personal else ()
+            resume = offset
+            for i in selection_indices(selected, offset):
+                if out_of_time():
+                    next_page = ('p', popularity_position(i))
                     break
+                resume = popularity_position(i) + 1
+                prop = PROPERTIES[i]
+                if i in candidate_set or prop['pid'] in viewed or prop['name'] in viewed:
+                    continue
+                if not admit_diverse(picked, i):
+                    duplicates.append(i)
+                    continue
+                chosen.append(i)
+                if len(chosen) >= RECOMMEND_PAGE_SIZE:
+                    next_page = ('p', resume)
+                    break
+            else:
+                # Shard rounds cut short by the deadline end the matches early
+                if g.partial:
+                    next_page = ('p', resume)
+        # Out of time: the best found so far, near duplicates included
+        if next_page is None or g.partial:
+            chosen += duplicates[:RECOMMEND_PAGE_SIZE - len(chosen)]
+
+        properties = []
+        focus = snippet_focus(query, filter_themes(expr))
+        for i in chosen:
+            prop = PROPERTIES[i]
+            properties.append({
+                'pid': prop['pid'],
+                'name': prop['name'],
+                'location': prop['prefecture'],
+                # The sentences that match the request, not the opening of the top story
+                'highlight': snippet(prop, focus)
+            })
+        mark_phase('match')
 
-        # Get popular inspiration (most-liked properties)
-        inspiration = sorted(PROPERTIES, key=lambda x: x['likes'], reverse=True)[:3]
+        # Get popular inspiration (most-liked, preference matches first); first page only
+        inspiration = []
+        similar = []
+        pools = [personal['candidates'], POPULAR_ORDER] if personal else [POPULAR_ORDER]
+        examined = 0
+        for pool in pools if not cursor else []:
+            for i in pool:
+                if len(inspiration) >= 3 or examined >= DIVERSITY_SCAN_LIMIT:
+                    break
+                prop = PROPERTIES[i]
+                if i in chosen or i in inspiration or i in similar or prop['pid'] in viewed or prop['name'] in viewed:
+                    continue
+                examined += 1
+                if admit_diverse(picked, i):
+                    inspiration.append(i)
+                elif len(similar) < 3:
+                    similar.append(i)
+        inspiration += similar[:3 - len(inspiration)]
         inspiration_items = [
             {
-                'title': f"Popular: {prop['name']}",
-                'location': prop['prefecture'],
-                'likes': prop['likes'],
-                'why': 'Highly rated by guests'
+                'title': f"Popular: {PROPERTIES[i]['name']}",
+                'location': PROPERTIES[i]['prefecture'],
+                'likes': PROPERTIES[i]['likes'],
+                'why': 'Matches your saved preferences' if personal and i in personal['candidate_set'] else 'Highly rated by guests'
             }
-            for prop in inspiration
+            for i in inspiration
         ]
+        mark_phase('rank')
 
         response = {
             'success': True,
             'understanding': f"Looking for: {query if query else 'properties'}, {destination if destination else 'travel inspiration'}",
+            'personalized': personal is not None,
             'recommendations': {
                 'properties': properties,
                 'inspiration': inspiration_items
-            }
+            },
+            'next_cursor': (encode_cursor('/recommend', q=query, d=destination, f=expr,
+                                          u=cursor_caller(state_key) if personal else None,
+                                          s=next_page[0], o=next_page[1])
+                            if next_page else None)
         }
+        if (query, destination) != heard:
+            response['corrected'] = {'query': query, 'destination': destination}
+        if not cursor and parsed:
+            response['parsed'] = dict({key: parsed[key] for key in ('intent', 'destination', 'nearby', 'themes')},
+                                      keywords=query)
+            response['understanding'] = (f"Looking for: {' '.join(parsed['themes'] + [query]).strip() or 'properties'}, "
+                                         f"{parsed['destination'] or destination or 'travel inspiration'}")
 
-        print(f"✅ Returning {len(properties)} properties + {len(inspiration_items)} inspiration")
-        print("="*80 + "\n")
-        return jsonify(response)
+        log_event('/recommend', 'recommend', query=query, destination=destination,
+                  personalized=personal is not None, properties=len(properties),
+                  inspiration=len(inspiration_items), filtered=expr is not None, page=bool(cursor),
+                  partial=g.partial)
+        return timed_jsonify(response, data)
 
+    except (CursorError, FilterError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
-        print(f"❌ ERROR: {str(e)}")
-        print("="*80 + "\n")
+        log_event('/recommend', 'error', level='error', error=str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/experiences', methods=['POST'])
 def experiences():
     """Guest experiences endpoint"""
     try:
-        data = request.get_json() or {}
-        print(f"🎭 EXPERIENCES - Request: {data}")
+        data = parse_request_json()
+        themes = resolve_themes(str(data.get('theme') or data.get('style') or ''))
+        log_event('/experiences', 'experiences', keys=sorted(data), themes=themes)
 
-        # Return highly-liked properties
-        top_rated = sorted(PROPERTIES, key=lambda x: x['likes'], reverse=True)[:3]
-        results = [
-            {
+        # Theme postings are already in popularity order; without a theme (or
+        # when nothing carries it) fall back to the most liked overall
+        candidates = (themes and themed_properties(themes)) or POPULAR_ORDER
+        mark_phase('match')
+
+        # Return highly-liked properties, told through their most-liked story
+        # (the sentences on the theme when there is one), skipping stories
+        # that are near copies of one already picked
+        picked = new_diversity_filter()
+        top_rated = []
+        similar = []
+        for i in candidates[:DIVERSITY_SCAN_LIMIT]:
+            if len(top_rated) >= 3:
+                break
+            if admit_diverse(picked, i):
+                top_rated.append(i)
+            elif len(similar) < 3:
+                similar.append(i)
+        top_rated += similar[:3 - len(top_rated)]
+        results = []
+        focus = snippet_focus(themes=themes)
+        for i in top_rated:
+            prop = PROPERTIES[i]
+            o, k = best_sentence(prop, focus)
+            story = STORIES[o]
+            results.append({
                 'name': prop['name'],
                 'location': prop['prefecture'],
-                'experience': prop['description'][:150] + '...' if len(prop['description']) > 150 else prop['description'],
-                'guest_rating': '★' * min(5, prop['likes'] // 10)
-            }
-            for prop in top_rated
-        ]
+                'experience': snippet_text(o, k, 150),
+                'guest_rating': '★' * min(5, story['likes'] // 10),
+                'stories': prop['story_count'],
+                'themes': theme_names(THEME_FLAGS[i])
+            })
+        mark_phase('rank')
 
-        return jsonify({'success': True, 'experiences': results})
+        response = {'success': True, 'experiences': results}
+        if themes:
+            response['themes'] = themes
+        return timed_jsonify(response, data)
     except Exception as e:
-        print(f"❌ ERROR: {str(e)}")
+        log_event('/experiences', 'error', level='error', error=str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/gallery', methods=['POST'])
 def gallery():
     """Photo-rich properties endpoint"""
     try:
-        data = request.get_json() or {}
-        print(f"📸 GALLERY - Request: {data}")
+        data = parse_request_json()
+        themes = resolve_themes(str(data.get('theme') or data.get('style') or ''))
+        log_event('/gallery', 'gallery', keys=sorted(data), themes=themes)
 
-        # Return random visually appealing properties
-        results = random.sample(PROPERTIES, min(3, len(PROPERTIES)))
-        gallery_items = [
-            {
+        # Return random visually appealing properties, on the theme if asked
+        pool = (themes and themed_properties(themes)) or POPULAR_ORDER
+        results = random.sample(pool, min(3, len(pool)))
+        gallery_items = []
+        focus = snippet_focus(themes=themes)
+        for i in results:
+            prop = PROPERTIES[i]
+            gallery_items.append({
                 'name': prop['name'],
                 'location': prop['prefecture'],
-                'description': prop['description'][:100] + '...'
-            }
-            for prop in results
-        ]
+                'description': snippet(prop, focus, 100),
+                'themes': theme_names(THEME_FLAGS[i])
+            })
+        mark_phase('match')
 
-        return jsonify({'success': True, 'gallery': gallery_items})
+        response = {'success': True, 'gallery': gallery_items}
+        if themes:
+            response['themes'] = themes
+        return timed_jsonify(response, data)
     except Exception as e:
-        print(f"❌ ERROR: {str(e)}")
+        log_event('/gallery', 'error', level='error', error=str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/inspiration', methods=['POST'])
 def inspiration():
     """Popular travel stories endpoint"""
     try:
-        data = request.get_json() or {}
+        data = parse_request_json()
         limit = int(data.get('limit', 5))
-        destination = data.get('destination', '').lower()
+        destination = correct_query(normalize_text(data.get('destination', '')))
 
-        print(f"💡 INSPIRATION - Destination: '{destination}', Limit: {limit}")
+        log_event('/inspiration', 'inspiration', destination=destination, limit=limit)
 
-        # Filter by destination if provided
-        if destination:
-            filtered = [p for p in PROPERTIES
-                       if destination in p['prefecture'].lower() or destination in p.get('address', '').lower()]
-        else:
-            filtered = PROPERTIES
+        # Filter by destination and any filter criteria if provided
+        expr = request_filter(data)
+        selected = select_properties('', destination, expr)
+        mark_phase('match')
 
-        # Sort by likes and return top N
-        if filtered:
-            popular = sorted(filtered, key=lambda x: x['likes'], reverse=True)[:limit]
+        # Top N by likes; nothing there -> nearby prefectures, then anywhere
+        nearby = []
+        if selected is None:
+            popular = [PROPERTIES[i] for i in POPULAR_ORDER[:limit]]
+        elif selected:
+            # Out of time: the most liked of the matches scanned so far
+            scanned = itertools.takewhile(lambda i: not out_of_time(), bitmap_indices(selected))
+            popular = [PROPERTIES[i] for i in heapq.nlargest(limit, scanned, key=lambda i: PROPERTIES[i]['likes'])]
         else:
-            popular = random.sample(PROPERTIES, min(limit, len(PROPERTIES)))
+            indices, nearby = nearby_properties(destination, limit)
+            if not indices:
+                indices = random.sample(POPULAR_ORDER, min(limit, len(POPULAR_ORDER)))
+            popular = [PROPERTIES[i] for i in indices]
 
+        focus = snippet_focus(themes=filter_themes(expr))
         stories = [
             {
                 'title': prop['name'],
                 'location': prop['prefecture'],
                 'popularity': prop['likes'],
-                'story': prop['description'][:120] + '...' if len(prop['description']) > 120 else prop['description']
+                'story': snippet(prop, focus, 120)
             }
             for prop in popular
         ]
+        mark_phase('rank')
+
+        response = {'success': True, 'stories': stories, 'count': len(stories)}
+        if nearby:
+            response['nearby'] = {'destination': destination, 'prefectures': nearby}
+        return timed_jsonify(response, data)
+
+    except FilterError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        log_event('/inspiration', 'error', level='error', error=str(e))
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+class RequestError(ValueError):
+    """Invalid request parameter (reported to the caller as a 400)"""
+
+def request_limit(data, default, maximum):
+    """The 'limit' field as an int in 1..maximum; RequestError when it isn't a positive number"""
+    value = data.get('limit', default)
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise RequestError(f"limit must be a number, got {value!r}")
+    if limit < 1:
+        raise RequestError('limit must be at least 1')
+    return min(maximum, limit)
+
+@app.route('/similar', methods=['POST'])
+def similar():
+    """Properties most like a given one ("something like that last place")"""
+    try:
+        data = parse_request_json()
+        pid = str(data.get('pid') or data.get('property_id') or '')
+        name = normalize_text(data.get('name', ''))
+        limit = request_limit(data, 5, KNN_K)
+
+        # Resolve the property: pid, then exact name, then a name containing the words
+        # (only properties with all of the name's index terms can contain it)
+        index = PID_INDEX.get(pid) if pid else None
+        if index is None and name:
+            name = correct_query(name)
+            index = NAME_INDEX.get(name)
+            if index is None:
+                index = next((i for i in bitmap_indices(query_bitmap(name))
+                              if name in PROPERTIES[i]['search_name']), None)
+        mark_phase('match')
+
+        if index is None:
+            return jsonify({'success': False, 'error': 'Property not found; pass pid or name'}), 404
 
-        return jsonify({'success': True, 'stories': stories, 'count': len(stories)})
+        source = PROPERTIES[index]
+        results = []
+        # Highlight the themes each stay shares with the source
+        for j, score in nearest_neighbors(index, limit):
+            prop = PROPERTIES[j]
+            results.append({
+                'pid': prop['pid'],
+                'name': prop['name'],
+                'location': prop['prefecture'],
+                'similarity': round(score, 3),
+                'highlight': snippet(prop, (THEME_FLAGS[index] & THEME_FLAGS[j], []))
+            })
+        mark_phase('rank')
+
+        log_event('/similar', 'similar', pid=source['pid'], results=len(results))
+        return timed_jsonify({
+            'success': True,
+            'source': {'pid': source['pid'], 'name': source['name'], 'location': source['prefecture']},
+            'similar': results
+        }, data)
+
+    except RequestError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        log_event('/similar', 'error', level='error', error=str(e))
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/facets', methods=['POST'])
+def facets():
+    """Property counts by country, prefecture and theme ("212 stays in Kyoto, 40 with onsen")"""
+    try:
+        data = parse_request_json()
+        heard = normalize_text(data.get('query', ''))
+        query = correct_query(heard)
+        limit = request_limit(data, FACET_LIMIT, 100)
+        mark_phase('correct')
+
+        # Narrow to the query and any filters (facet values already chosen)
+        expr = request_filter(data)
+        selected = select_properties(query, '', expr)
+        if selected is None:
+            selected = FACET_INDEX['all']['all']
+        mark_phase('match')
+
+        response = {
+            'success': True,
+            'total': bitmap_count(selected),
+            'facets': {facet: [{'value': value, 'count': n} for value, n in facet_counts(selected, facet, limit)]
+                       for facet in ('country', 'prefecture', 'theme')}
+        }
+        if query:
+            response['query'] = query
+            if query != heard:
+                response['corrected'] = {'query': query}
+        if expr:
+            response['filter'] = expr
+        mark_phase('count')
+
+        log_event('/facets', 'facets', query=query, filtered=expr is not None, total=response['total'])
+        return timed_jsonify(response, data)
+
+    except (RequestError, FilterError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        log_event('/facets', 'error', level='error', error=str(e))
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# ============================================================================
+# LIVE UPDATES
+# ============================================================================
+# Likes change every day, and a full reload just to pick them up rebuilds
+# every index. Deltas keyed by story id are applied to the live stores
+# instead: POST them to /deltas (with DELTA_TOKEN as a bearer token), or
+# append them as JSON lines to DELTA_PATH, which every worker tails each
+# DELTA_POLL_SECONDS (reading it from the top at boot, so deltas survive a
+# restart until the next export includes them):
+#
+#   {"op": "likes", "tsid": "5001", "likes_count": 42}
+#   {"op": "upsert", "tsid": "5002", "pid": "77", "name": "...", "ts_stay_text": "...", "likes_count": 3}
+#   {"op": "remove", "tsid": "5003"}
+#
+# Upserts use the export's columns (DEFAULT_FIELD_MAP); a known pid fills in
+# the property's name, prefecture and country. The popularity lists
+# (POPULAR_ORDER, PREFECTURE_INDEX, THEME_POSTINGS) are ordered by
+# (-likes, index), so a property whose likes change moves with two binary
+# searches and a delete/insert instead of a re-sort. Facet bitmaps change per
+# property and term changes go to TERM_DELTA, an overlay on the postings.
+# Requests read all of these without a lock, so nothing they can hold is
+# edited in place: a batch edits copies of the lists and overlays it
+# touches (one copy of each per batch, made on first touch) and swaps them
+# in when it ends, and a property's story list is replaced, not edited.
+# Indices never move: new properties are appended and emptied ones stay as
+# tombstones, so cursors stay valid. The spelling index, k-NN graph and
+# place-name tables keep their loaded state until the next full load.
+
+DELTA_TOKEN = os.environ.get('DELTA_TOKEN', '')
+DELTA_PATH = os.environ.get('DELTA_PATH', '')
+DELTA_POLL_SECONDS = float(os.environ.get('DELTA_POLL_SECONDS', '5'))
+
+# gunicorn workers (gunicorn.conf.py reads the same variable). A POST reaches
+# one of them, so with more than one /deltas is refused in favour of DELTA_PATH
+WEB_WORKERS = int(os.environ.get('WEB_CONCURRENCY', '1'))
+
+# Records accepted per /deltas request
+DELTA_MAX_RECORDS = 10000
+
+DELTA_STATS = {'applied': 0, 'unchanged': 0, 'rejected': 0, 'last_applied_at': None}
+_DELTA_LOCK = threading.Lock()
+
+# DELTA_PATH tail position of this worker
+_DELTA_WATCHER = {'pid': None, 'inode': None, 'offset': 0}
+
+# The current batch's copies of the popularity lists and term overlays
+_DELTA_WORK = {}
+
+class DeltaError(ValueError):
+    """A delta record that can't be applied (reported back, the rest still apply)"""
+
+def _popularity_key(i):
+    return (-PROPERTIES[i]['likes'], i)
+
+def _story_key(o):
+    return (-STORIES[o]['likes'], o)
+
+def _delta_work():
+    """This batch's copies of what it edits, made on first use"""
+    if not _DELTA_WORK:
+        _DELTA_WORK.update(order=list(POPULAR_ORDER), neg=array('i', POPULAR_NEG_LIKES),
+                           prefecture={}, themes={}, terms={})
+    return _DELTA_WORK
+
+def _working_list(table, lists, name):
+    """The batch's copy of one prefecture or theme list"""
+    if name not in table:
+        table[name] = array('i', lists.get(name, ()))
+    return table[name]
+
+def _term_changes(term):
+    """The batch's copy of one term's TERM_DELTA overlay"""
+    terms = _delta_work()['terms']
+    if term not in terms:
+        terms[term] = dict(TERM_DELTA.get(term, ()))
+    return terms[term]
+
+def publish_delta_work():
+    """Swap the batch's copies in for the lists and overlays requests read"""
+    global POPULAR_ORDER, POPULAR_NEG_LIKES, PREFECTURE_INDEX, THEME_POSTINGS, TERM_DELTA
+    if not _DELTA_WORK:
+        return
+    work = dict(_DELTA_WORK)
+    _DELTA_WORK.clear()
+    PREFECTURE_INDEX = {**PREFECTURE_INDEX, **work['prefecture']}
+    THEME_POSTINGS = {**THEME_POSTINGS, **work['themes']}
+    TERM_DELTA = {**TERM_DELTA, **work['terms']}
+    POPULAR_NEG_LIKES = work['neg']
+    POPULAR_ORDER = work['order']
+
+def _popularity_lists(i):
+    """The batch's likes-ordered lists property i belongs in, by its current prefecture and themes"""
+    work = _delta_work()
+    lists = [work['order'], _working_list(work['prefecture'], PREFECTURE_INDEX,
+                                          prefecture_key(PROPERTIES[i]['prefecture']))]
+    return lists + [_working_list(work['themes'], THEME_POSTINGS, theme) for theme in theme_names(THEME_FLAGS[i])]
+
+def _unlist_property(i):
+    """Take property i out of the popularity lists (before its likes or themes change)"""
+    if not PROPERTIES[i]['stories']:
+        return
+    key = _popularity_key(i)
+    for order in _popularity_lists(i):
+        k = bisect.bisect_left(order, key, key=_popularity_key)
+        if k < len(order) and order[k] == i:
+            del order[k]
+            if order is _DELTA_WORK['order']:
+                del _DELTA_WORK['neg'][k]
+
+def _list_property(i):
+    """Put property i back into the popularity lists at its current likes"""
+    if not PROPERTIES[i]['stories']:
+        return
+    key = _popularity_key(i)
+    for order in _popularity_lists(i):
+        k = bisect.bisect_left(order, key, key=_popularity_key)
+        order.insert(k, i)
+        if order is _DELTA_WORK['order']:
+            _DELTA_WORK['neg'].insert(k, key[0])
+
+def _without_story(prop, o):
+    """A copy of prop's story list without story o"""
+    stories = list(prop['stories'])
+    del stories[bisect.bisect_left(stories, _story_key(o), key=_story_key)]
+    return stories
+
+def _with_story(prop, o):
+    """A copy of prop's story list with story o in likes order"""
+    stories = list(prop['stories'])
+    bisect.insort(stories, o, key=_story_key)
+    return stories
+
+def _facet_values(i):
+    """(facet, value) pairs property i is filed under; none for a tombstone"""
+    prop = PROPERTIES[i]
+    if not prop['stories']:
+        return set()
+    values = {('all', 'all'), ('country', prop['country'] or 'unknown'),
+              ('prefecture', prop['prefecture'] or 'unknown')}
+    return values | {('theme', theme) for theme in theme_names(THEME_FLAGS[i])}
+
+def _refile_facets(i, before):
+    """Move property i between facet bitmaps after its themes or stories changed"""
+    after = _facet_values(i)
+    single = bitmap_from_indices([i])
+    for facet, value in before - after:
+        FACET_INDEX[facet][value] = bitmap_andnot(FACET_INDEX[facet][value], single)
+    for facet, value in after - before:
+        if value in FACET_INDEX[facet]:
+            FACET_INDEX[facet][value] = bitmap_or(FACET_INDEX[facet][value], single)
+            continue
+        # A new value: requests may be iterating the facet's values
+        FACET_INDEX[facet] = {**FACET_INDEX[facet], value: single}
+        if facet in FACET_ALIASES:
+            aliases = {normalize_text(value): value}
+            if facet == 'prefecture':
+                aliases[prefecture_key(value)] = value
+            FACET_ALIASES[facet] = {**aliases, **FACET_ALIASES[facet]}
+
+def _refresh_representative(i):
+    """Re-pick property i's description (its most liked story with text) and re-hash it"""
+    prop = PROPERTIES[i]
+    texts = (STORIES[o]['description'] for o in prop['stories'])
+    description = next((text for text in texts if text), '')
+    signatures, bands = MINHASH_INDEX['signatures'], MINHASH_INDEX['bands']
+    if description == prop['description'] and len(signatures) > i * MINHASH_BINS:
+        return
+    prop['description'] = description
+    signature = minhash_signature(description)
+    if len(signatures) > i * MINHASH_BINS:
+        signatures[i * MINHASH_BINS:(i + 1) * MINHASH_BINS] = array('I', signature)
+        bands[i * MINHASH_BANDS:(i + 1) * MINHASH_BANDS] = array('q', band_keys(signature))
+    else:
+        signatures.extend(signature)
+        bands.extend(band_keys(signature))
+
+def _set_story_likes(o, likes):
+    """Change an attached story's likes and move its property in the popularity lists"""
+    story = STORIES[o]
+    i = PROPERTY_KEYS[story_key(story)]
+    prop = PROPERTIES[i]
+    _unlist_property(i)
+    stories = _without_story(prop, o)
+    prop['likes'] += likes - story['likes']
+    story['likes'] = likes
+    bisect.insort(stories, o, key=_story_key)
+    prop['stories'] = stories
+    _refresh_representative(i)
+    _list_property(i)
+
+def _new_property(record):
+    """Append an empty property for a story whose key hasn't been seen"""
+    prop = {
+        'pid': record['pid'] or record['tsid'] or story_key(record),
+        'name': record['name'],
+        'prefecture': record['prefecture'],
+        'country': record['country'],
+        'likes': 0,
+        'stories': [],
+        'story_count': 0,
+        'description': '',
+        'search_description': ''
+    }
+    THEME_FLAGS.append(0)
+    PROPERTIES.append(prop)
+    PROPERTY_KEYS[story_key(record)] = len(PROPERTIES) - 1
+    return len(PROPERTIES) - 1
+
+def _add_story(record):
+    """Append a story and attach it to its property (created or revived as needed)"""
+    ends, flags, text = split_story(record['description'])
+    o = len(STORIES)
+    STORIES.append(record)
+    STORY_THEME_FLAGS.append(0)
+    for f in flags:
+        STORY_THEME_FLAGS[o] |= f
+    SENTENCE_ENDS.extend(ends)
+    SENTENCE_FLAGS.extend(flags)
+    STORY_SENTENCES.append(len(SENTENCE_ENDS))
+
+    i = PROPERTY_KEYS.get(story_key(record))
+    if i is None:
+        i = _new_property(record)
+    prop = PROPERTIES[i]
+    before = _facet_values(i)
+    _unlist_property(i)
+    terms = facet_terms(text)
+    if not prop['stories']:
+        # New or revived: the name and place become searchable (again)
+        prop['search_name'] = normalize_text(prop['name'])
+        prop['search_prefecture'] = normalize_text(prop['prefecture'])
+        if ROMAJI_COLUMN:
+            romaji = kana_to_romaji(prop['search_name'])
+            prop['search_romaji'] = romaji if romaji != prop['search_name'] else ''
+        THEME_FLAGS[i] = tag_text(prop['search_name'])
+        terms |= property_terms(prop)
+    # Only this story's terms can be new to the property
+    for term in terms:
+        changes = _term_changes(term)
+        if not (changes[i] if i in changes else property_has_term(i, term)):
+            changes[i] = True
+    prop['stories'] = _with_story(prop, o)
+    prop['likes'] += record['likes']
+    prop['story_count'] = len(prop['stories'])
+    prop['search_description'] = f"{prop['search_description']}\n{text}" if prop['search_description'] else text
+    THEME_FLAGS[i] |= STORY_THEME_FLAGS[o]
+    PID_INDEX[prop['pid']] = i
+    NAME_INDEX.setdefault(prop['search_name'], i)
+    if record['tsid']:
+        STORY_INDEX[record['tsid']] = o
+    _refresh_representative(i)
+    _list_property(i)
+    _refile_facets(i, before)
+
+def _remove_story(o):
+    """Detach a story from its property; a property left without stories becomes a tombstone"""
+    story = STORIES[o]
+    i = PROPERTY_KEYS[story_key(story)]
+    prop = PROPERTIES[i]
+    before = _facet_values(i)
+    _unlist_property(i)
+    STORY_INDEX.pop(story['tsid'], None)
+    prop['stories'] = _without_story(prop, o)
+    prop['likes'] -= story['likes']
+    prop['story_count'] = len(prop['stories'])
+    # Terms that only this story had: re-read what the property has left
+    old_terms = property_terms(prop)
+    prop['search_description'] = '\n'.join(normalize_text(STORIES[s]['description']) for s in prop['stories'])
+    new_terms = property_terms(prop) if prop['stories'] else set()
+    for term in old_terms - new_terms:
+        _term_changes(term)[i] = False
+    flags = tag_text(prop['search_name']) if prop['stories'] else 0
+    for s in prop['stories']:
+        flags |= STORY_THEME_FLAGS[s]
+    THEME_FLAGS[i] = flags
+    if not prop['stories']:
+        PID_INDEX.pop(prop['pid'], None)
+        if NAME_INDEX.get(prop['search_name']) == i:
+            del NAME_INDEX[prop['search_name']]
+        prop['search_name'] = prop['search_prefecture'] = prop['search_romaji'] = ''
+    _refresh_representative(i)
+    _list_property(i)
+    _refile_facets(i, before)
+
+def apply_delta(row):
+    """Apply one delta record; False when it changed nothing, DeltaError when it is unusable"""
+    if not isinstance(row, dict):
+        raise DeltaError('each delta must be an object')
+    op = row.get('op', 'upsert')
+    tsid = str(_column(row, DEFAULT_FIELD_MAP['tsid']) or '')
+    if not tsid:
+        raise DeltaError('delta needs a tsid')
+    o = STORY_INDEX.get(tsid)
+    if op == 'remove':
+        if o is None:
+            return False
+        _remove_story(o)
+        return True
+    if op == 'likes':
+        if o is None:
+            raise DeltaError(f"unknown story {tsid}")
+        try:
+            likes = int(float(_column(row, DEFAULT_FIELD_MAP['likes'])))
+        except (TypeError, ValueError):
+            raise DeltaError('likes delta needs a numeric likes_count')
+        if likes == STORIES[o]['likes']:
+            return False
+        _set_story_likes(o, likes)
+        return True
+    if op != 'upsert':
+        raise DeltaError(f"unknown op {op!r}")
+    pid = str(_column(row, DEFAULT_FIELD_MAP['pid']) or '')
+    i = PID_INDEX.get(pid) if pid else None
+    joined = {pid: {f: PROPERTIES[i][f] for f in PROPERTY_SOURCE_FIELDS}} if i is not None else {}
+    record = map_story(row, DEFAULT_FIELD_MAP, joined)
+    if record is None:
+        raise DeltaError('upsert needs a property name and numeric likes')
+    if o is not None:
+        old = STORIES[o]
+        if all(old[f] == record[f] for f in record if f != 'likes'):
+            if record['likes'] == old['likes']:
+                return False
+            _set_story_likes(o, record['likes'])
+            return True
+        _remove_story(o)
+    _add_story(record)
+    return True
+
+def apply_deltas(rows):
+    """Apply delta records in order; counts plus per-record errors"""
+    result = {'applied': 0, 'unchanged': 0, 'errors': []}
+    with _DELTA_LOCK:
+        try:
+            for n, row in enumerate(rows):
+                try:
+                    result['applied' if apply_delta(row) else 'unchanged'] += 1
+                except DeltaError as e:
+                    result['errors'].append({'index': n, 'error': str(e)})
+        finally:
+            publish_delta_work()
+        if result['applied']:
+            # Cached candidate lists, degraded answers and shard copies predate the change
+            with _PERSONALIZATION_LOCK:
+                PERSONALIZATION_CACHE.clear()
+            build_degraded_responses()
+            try:
+                shard_deltas(rows)
+            except ShardError as e:
+                print(f"⚠️  Scoring shards failed, selecting in-process: {e}")
+                stop_shards()
+            DELTA_STATS['last_applied_at'] = datetime.now().isoformat()
+        DELTA_STATS['applied'] += result['applied']
+        DELTA_STATS['unchanged'] += result['unchanged']
+        DELTA_STATS['rejected'] += len(result['errors'])
+    return result
+
+def poll_delta_file():
+    """Apply the complete lines appended to DELTA_PATH since the last poll"""
+    try:
+        stat = os.stat(DELTA_PATH)
+    except FileNotFoundError:
+        return None
+    # A replaced or truncated file is read from the top
+    if stat.st_ino != _DELTA_WATCHER['inode'] or stat.st_size < _DELTA_WATCHER['offset']:
+        _DELTA_WATCHER.update(inode=stat.st_ino, offset=0)
+    if stat.st_size == _DELTA_WATCHER['offset']:
+        return None
+    with open(DELTA_PATH, 'rb') as f:
+        f.seek(_DELTA_WATCHER['offset'])
+        data = f.read(stat.st_size - _DELTA_WATCHER['offset'])
+    end = data.rfind(b'\n') + 1
+    rows = []
+    for line in data[:end].splitlines():
+        if line.strip():
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                rows.append(None)
+    _DELTA_WATCHER['offset'] += end
+    return apply_deltas(rows) if rows else None
+
+def _delta_watcher_loop():
+    while True:
+        try:
+            result = poll_delta_file()
+            if result:
+                log_event('/deltas', 'file', applied=result['applied'], unchanged=result['unchanged'],
+                          rejected=len(result['errors']))
+        except Exception as e:
+            log_event('/deltas', 'file_failed', level='error', error=str(e))
+        time.sleep(DELTA_POLL_SECONDS)
+
+def start_delta_watcher():
+    """Start tailing DELTA_PATH in this worker (after warm-up, when configured)"""
+    if _DELTA_WATCHER['pid'] == os.getpid():
+        return
+    if DELTA_TOKEN and WEB_WORKERS > 1:
+        print(f"⚠️  {WEB_WORKERS} workers: POST /deltas would only update one, so it is refused; use DELTA_PATH")
+    if not DELTA_PATH:
+        return
+    _DELTA_WATCHER.update(pid=os.getpid(), inode=None, offset=0)
+    threading.Thread(target=_delta_watcher_loop, name='delta-watcher', daemon=True).start()
+    print(f"✅ Watching {DELTA_PATH} for deltas every {DELTA_POLL_SECONDS:g}s")
+
+@app.route('/deltas', methods=['POST'])
+def deltas():
+    """Apply story deltas (upserts, removals, likes changes) to the live stores"""
+    try:
+        if not DELTA_TOKEN:
+            return jsonify({'success': False, 'error': 'Live updates are disabled (set DELTA_TOKEN)'}), 404
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {DELTA_TOKEN}"):
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+        if WEB_WORKERS > 1:
+            return jsonify({'success': False,
+                            'error': f'Only one of {WEB_WORKERS} workers would apply these; append them to DELTA_PATH'}), 409
+        if not WARMUP['ready']:
+            response = jsonify({'success': False, 'warming_up': True, 'error': 'Still loading; retry shortly'})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        data = parse_request_json()
+        rows = data.get('deltas') if isinstance(data, dict) else data
+        if not isinstance(rows, list):
+            return jsonify({'success': False, 'error': 'Send {"deltas": [...]}'}), 400
+        if len(rows) > DELTA_MAX_RECORDS:
+            return jsonify({'success': False, 'error': f'At most {DELTA_MAX_RECORDS} deltas per request'}), 400
+
+        result = apply_deltas(rows)
+        mark_phase('apply')
+
+        log_event('/deltas', 'applied', applied=result['applied'], unchanged=result['unchanged'],
+                  rejected=len(result['errors']))
+        return timed_jsonify(dict(result, success=True, properties=len(PROPERTIES)), data)
 
     except Exception as e:
-        print(f"❌ ERROR: {str(e)}")
+        log_event('/deltas', 'error', level='error', error=str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -698,8 +4860,9 @@ def save_progress():
             CONVERSATION_STATE[f"email:{email}"] = state
         if conversation_id:
             CONVERSATION_STATE[f"conv:{conversation_id}"] = state
+        invalidate_personalization(email, conversation_id)
 
-        print(f"💾 Saved conversation state for {email or conversation_id}")
+        log_event('/save-progress', 'saved', user=email or conversation_id)
 
         return jsonify({
             'success': True,
@@ -711,7 +4874,7 @@ def save_progress():
         })
 
     except Exception as e:
-        print(f"❌ ERROR saving progress: {str(e)}")
+        log_event('/save-progress', 'error', level='error', error=str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -758,7 +4921,7 @@ def resume_conversation():
                 'is_new_user': True
             }), 404
 
-        print(f"📖 Retrieved conversation state for {email or conversation_id}")
+        log_event('/resume-conversation', 'resumed', user=email or conversation_id)
 
         return jsonify({
             'success': True,
@@ -768,7 +4931,7 @@ def resume_conversation():
         })
 
     except Exception as e:
-        print(f"❌ ERROR resuming conversation: {str(e)}")
+        log_event('/resume-conversation', 'error', level='error', error=str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -816,7 +4979,7 @@ def get_user_history():
         })
 
     except Exception as e:
-        print(f"❌ ERROR getting user history: {str(e)}")
+        log_event('/get-user-history', 'error', level='error', error=str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -878,8 +5041,9 @@ def update_progress():
         CONVERSATION_STATE[lookup_key] = state
         if email and conversation_id:
             CONVERSATION_STATE[f"conv:{conversation_id}"] = state
+        invalidate_personalization(state.get('email') or email, state.get('conversation_id') or conversation_id)
 
-        print(f"🔄 Updated conversation state for {email or conversation_id}")
+        log_event('/update-progress', 'updated', user=email or conversation_id)
 
         return jsonify({
             'success': True,
@@ -888,19 +5052,38 @@ def update_progress():
         })
 
     except Exception as e:
-        print(f"❌ ERROR updating progress: {str(e)}")
+        log_event('/update-progress', 'error', level='error', error=str(e))
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-# Load data at module import time (works with both gunicorn and direct run)
+# Subsystem sizes reported on /metrics
+register_collector('kabuk_properties_loaded', 'Properties in the in-memory store', 'gauge',
+                   lambda: len(PROPERTIES))
+register_collector('kabuk_stories_loaded', 'Travel stories in the in-memory store', 'gauge',
+                   lambda: len(STORIES))
+register_collector('kabuk_index_entries', 'Entries per precomputed index', 'gauge',
+                   lambda: {'index="popular_order"': len(POPULAR_ORDER),
+                            'index="spelling_terms"': len(SPELL_INDEX['terms']),
+                            'index="knn_slots"': len(KNN_INDEX['neighbors']),
+                            'index="facet_terms"': len(TERM_OFFSETS),
+                            'index="term_postings"': len(TERM_POSTINGS),
+                            'index="personalization_cache"': len(PERSONALIZATION_CACHE)})
+register_collector('kabuk_conversation_states', 'Conversation state keys held in memory', 'gauge',
+                   lambda: len(CONVERSATION_STATE))
+register_collector('kabuk_overloaded', 'Whether queue time says this worker is overloaded', 'gauge',
+                   lambda: int(ADMISSION['overloaded']))
+
+if __name__ == '__main__' and sys.argv[1:2] == ['build-index']:
+    sys.exit(build_index_main(sys.argv[2:]))
+
 print("🚀 Starting HafH webhook server...")
-load_sample_data()
 
-# Build and cache landing page HTML for fast delivery
+# Build and cache landing page HTML for fast delivery (rebuilt with real stats once warm)
 CACHED_INDEX_HTML = build_index_html()
 print("✅ Landing page cached")
 
-print(f"📊 Serving {len(PROPERTIES)} properties")
+# Load data and build indexes in the background (works with both gunicorn and direct run)
+start_warmup()
 
 if __name__ == '__main__':
     print("🌐 Server running on http://localhost:5001")